@@ -9,6 +9,8 @@ from ant_nest.exceptions import ExceptionFilter
 
 # your ant`s class modules or packages
 ANT_PACKAGES = ["ants"]
+# cache ant names of modules here, so unchanged modules are not imported to find ants
+ANT_INDEX_FILE = ".ant_index.json"
 ANT_ENV = os.getenv("ANT_ENV", "development")
 
 
@@ -28,12 +30,57 @@ HTTPX_CONFIG = {
 POOL_CONFIG = {"limit": 100, "timeout": 60}
 REPORTER = {
     "slot": 60,
+    # serve metrics in Prometheus text format on http://127.0.0.1:{port}/metrics
+    "prometheus_port": None,
+    # dump metrics as json every slot, "{name}" and "{pid}" are formatted
+    "snapshot_file": None,
+}
+# items are processed in micro batches by pipelines with "process_batch", one batch
+# is processed when it is full or its first item waits "max_latency" seconds
+ITEM_BATCH = {"size": 100, "max_latency": 0.1}
+# with "queue_size", collected items are put into a bounded queue and processed by
+# "workers" sink tasks in background, collecting waits when the queue is full
+ITEM_SINK = {"queue_size": None, "workers": 1}
+# time every pipeline, parser and field extractor into reporter histograms,
+# with "profile_top", sampled sync calls are profiled by cProfile and the slowest
+# ones are logged and dumped to "profile_dir"
+INSTRUMENT = {
+    "enabled": False,
+    "profile_top": 0,
+    "profile_sample_rate": 0.01,
+    "profile_dir": None,
+}
+# write "Ant.request" spans with phase timings(queue wait, pipelines, connect,
+# tls, first byte, download and retries) to a Chrome trace file, open it in
+# chrome://tracing or https://ui.perfetto.dev, "{name}" and "{pid}" are formatted
+TRACE = {"file": None, "sample_rate": 1.0}
+# thread and process pool for CPU heavy extractors and pipelines
+EXECUTOR_CONFIG = {
+    "max_workers": None,
+    "queue_size": None,
+}
+# per host in-flight requests and requests per second limit, 0 means no limit
+HOST_LIMIT = {
+    "concurrency": 0,
+    "rate": 0,
 }
 
 
 # ANT config
 HTTP_RETRIES = 0
-HTTP_RETRY_DELAY = 0.1
+HTTP_RETRY_DELAY = 0.1  # base delay of exponential backoff with full jitter
+HTTP_RETRY_MAX_DELAY = 10
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_RETRY_BUDGET = 0.2  # retries are limited to 20% of requests
+# "Ant.download" splits files bigger than "chunk_size" into parallel Range requests
+DOWNLOADER = {"chunk_size": 8 * 1024 * 1024, "concurrency": 4}
+# persist scheduled requests here to resume stopped crawls, None means in memory
+FRONTIER_DIR = None
+# share frontier and request fingerprints among machines by "redis://127.0.0.1:6379/0"
+# or among processes of one host by "sqlite:////var/lib/ant_nest"(not on network
+# filesystems), popped requests are leased for "visibility_timeout" seconds(renewed
+# while crawling) and popped again by other nodes if their node died
+SHARED_STATE = {"url": None, "visibility_timeout": 300}
 
 
 if ANT_ENV in ("development", "testing"):
@@ -5,14 +5,23 @@ import abc
 import itertools
 import logging
 import time
+import asyncio
+import contextvars
+import functools
 
 import httpx
 from oxalis.pool import Pool
 
-from .pipelines import Pipeline
-from .items import Item
+from .pipelines import Pipeline, PipelineChain, RequestDuplicateFilterPipeline
+from .items import Item, Extractor
 from .exceptions import Dropped
 from .reporter import Reporter
+from .limiter import HostLimiter
+from .frontier import Entry, Frontier, SqliteFrontier, create_frontier
+from .filters import create_filter
+from .downloader import Downloader
+from .instrument import Instrument, TimingHook, ProfileHook, use_instrument
+from .tracer import Span, Tracer, trace_phase
 from . import utils
 
 pwd = os.getcwd()
@@ -24,18 +33,119 @@ else:
 
 __all__ = ["Ant", "CliAnt"]
 
+# the frontier entry in crawling
+_current_entry: "contextvars.ContextVar[typing.Optional[Entry]]" = (
+    contextvars.ContextVar("current_entry", default=None)
+)
+
+
+def _extract_items(extractor: typing.Any, res: httpx.Response) -> typing.List[Item]:
+    return list(extractor.extract_items(res))
+
+
+def _instrumented(
+    instrument: Instrument, func: typing.Callable, res: httpx.Response
+) -> typing.Any:
+    # in the thread running extractors
+    with use_instrument(instrument):
+        return func(res)
+
 
 class Ant(abc.ABC):
     response_pipelines: typing.List[Pipeline] = []
     request_pipelines: typing.List[Pipeline] = []
     item_pipelines: typing.List[Pipeline] = []
+    # per host limit, override "HOST_LIMIT" setting
+    host_concurrency: typing.Optional[int] = None
+    host_rate: typing.Optional[float] = None
+    # scheduled requests deeper than this are ignored
+    max_depth: typing.Optional[int] = None
+    # seconds to check the shared frontier again when it is empty
+    frontier_poll_interval: float = 1
+    # set by "ant_nest --workers", frontier entries are sharded by host,
+    # only the first worker runs "run" and set "worker_seeded" event after that
+    worker_index: int = 0
+    worker_count: int = 1
+    worker_seeded: typing.Any = None
 
     def __init__(self):
         self._start_time = time.time()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.client = httpx.AsyncClient(**settings.HTTPX_CONFIG)
         self.pool = Pool(**settings.POOL_CONFIG)
-        self.reporter = Reporter(**settings.REPORTER)
+        self.reporter = Reporter(name=self.name, **settings.REPORTER)
+        host_limit = dict(getattr(settings, "HOST_LIMIT", {}))
+        if self.host_concurrency is not None:
+            host_limit["concurrency"] = self.host_concurrency
+        if self.host_rate is not None:
+            host_limit["rate"] = self.host_rate
+        self.limiter = HostLimiter(**host_limit)
+        self.frontier: Frontier
+        budget = getattr(settings, "HTTP_RETRY_BUDGET", None)
+        self.retry_policy = utils.RetryPolicy(
+            retries=settings.HTTP_RETRIES,
+            delay=settings.HTTP_RETRY_DELAY,
+            max_delay=getattr(settings, "HTTP_RETRY_MAX_DELAY", 10),
+            statuses=getattr(settings, "HTTP_RETRY_STATUSES", ()),
+            budget=utils.RetryBudget(budget) if budget is not None else None,
+        )
+        frontier_dir = getattr(settings, "FRONTIER_DIR", None)
+        shared_state = getattr(settings, "SHARED_STATE", {})
+        if shared_state.get("url"):
+            self.frontier = create_frontier(
+                shared_state["url"],
+                self.name,
+                shard=self.worker_index,
+                shard_count=self.worker_count,
+                visibility_timeout=shared_state.get("visibility_timeout", 300),
+            )
+        elif frontier_dir:
+            self.frontier = SqliteFrontier(
+                os.path.join(frontier_dir, self.name + ".frontier.sqlite"),
+                shard=self.worker_index,
+                shard_count=self.worker_count,
+            )
+        else:
+            self.frontier = Frontier()
+        self._in_flight_count = 0
+        executor_config = getattr(settings, "EXECUTOR_CONFIG", {})
+        self.executors: typing.Dict[str, utils.OffloadExecutor] = {
+            kind: utils.OffloadExecutor(kind, **executor_config)
+            for kind in utils.OffloadExecutor.KINDS
+        }
+        self._frontier_event: typing.Optional[asyncio.Event] = None
+        self._pipeline_chains: typing.Dict[int, PipelineChain] = {}
+        item_batch = getattr(settings, "ITEM_BATCH", {})
+        self.item_batch_size: int = item_batch.get("size", 100)
+        self.item_batch_latency: float = item_batch.get("max_latency", 0.1)
+        self._item_batch: typing.List[typing.Tuple[Item, asyncio.Future]] = []
+        self._item_batch_handle: typing.Optional[asyncio.TimerHandle] = None
+        self._item_batch_tasks: typing.Set[asyncio.Future] = set()
+        item_sink = getattr(settings, "ITEM_SINK", {})
+        self.item_sink_queue_size: typing.Optional[int] = item_sink.get("queue_size")
+        self.item_sink_workers: int = item_sink.get("workers", 1)
+        self._item_queue: typing.Optional[asyncio.Queue] = None
+        self._item_sinks: typing.List[asyncio.Future] = []
+        instrument = getattr(settings, "INSTRUMENT", {})
+        # time pipelines and extractors by hooks, more hooks can be appended
+        self.instrument: typing.Optional[Instrument] = None
+        if instrument.get("enabled"):
+            self.instrument = Instrument([TimingHook(self.reporter)])
+            if instrument.get("profile_top"):
+                self.instrument.hooks.append(
+                    ProfileHook(
+                        top=instrument["profile_top"],
+                        sample_rate=instrument.get("profile_sample_rate", 0.01),
+                        profile_dir=instrument.get("profile_dir"),
+                    )
+                )
+        trace = getattr(settings, "TRACE", {})
+        self.tracer: typing.Optional[Tracer] = None
+        if trace.get("file"):
+            self.tracer = Tracer(
+                trace["file"].format(name=self.name, pid=os.getpid()),
+                sample_rate=trace.get("sample_rate", 1.0),
+            )
 
     @property
     def name(self):
@@ -53,7 +163,11 @@ class Ant(abc.ABC):
         cookies: httpx._models.CookieTypes = None,
         auth: httpx._auth.Auth = None,
         stream: bool = False,
+        dont_filter: bool = False,
     ) -> httpx.Response:
+        """Send one request through pipelines, "dont_filter" requests are not
+        dropped as duplicates, eg: probes and chunks of downloads.
+        """
         request: httpx.Request = self.client.build_request(
             method,
             url,
@@ -64,32 +178,344 @@ class Ant(abc.ABC):
             files=files,
             json=json,
         )
-        request = await self._pipe(request, self.request_pipelines)
-        self.reporter.report(request)
+        if dont_filter:
+            request.extensions = {**request.extensions, "dont_filter": True}
+        span = None
+        if self.tracer is not None:
+            span = self.tracer.start_span(
+                f"{request.method} {request.url}", url=str(request.url)
+            )
+        try:
+            with trace_phase(span, "request_pipeline"):
+                request = await self._pipe(request, self.request_pipelines)
+            if isinstance(request, httpx.Response):  # responded by pipelines
+                response = request
+                if not stream:
+                    await response.aread()
+            else:
+                self.reporter.report(request)
+
+                def on_retry(attempt: int, delay: float):
+                    self.reporter.report(request, retried=True)
+                    if span is not None:
+                        now = time.perf_counter()
+                        span.add_phase(
+                            "retry_wait", now, now + delay, {"attempt": attempt}
+                        )
 
-        response = await utils.retry(settings.HTTP_RETRIES, settings.HTTP_RETRY_DELAY)(
-            self.client.send
-        )(request, auth=auth, stream=stream)
+                response = await self.retry_policy(self._send, on_retry=on_retry)(
+                    request, auth=auth, stream=stream, span=span
+                )
 
-        response = await self._pipe(response, self.response_pipelines)
+            with trace_phase(span, "response_pipeline"):
+                response = await self._pipe(response, self.response_pipelines)
+        except BaseException as e:  # the lane is freed even if cancelled
+            if span is not None:
+                span.end(error=repr(e))
+            raise
+        if span is not None:
+            span.end(status=response.status_code)
         self.reporter.report(response)
 
         return response
 
+    async def download(
+        self,
+        url: str,
+        file_path: str,
+        checksum: typing.Optional[str] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> int:
+        """Download one large file by parallel Range chunks with resuming,
+        see "Downloader" for more detail.
+        """
+        downloader = Downloader(self.request, **getattr(settings, "DOWNLOADER", {}))
+        return await downloader.download(
+            url, file_path, checksum=checksum, headers=headers
+        )
+
+    async def _send(
+        self, request: httpx.Request, span: typing.Optional[Span] = None, **kwargs
+    ) -> httpx.Response:
+        host = request.url.host
+        if span is not None and "trace" not in request.extensions:
+            request.extensions = {**request.extensions, "trace": span.trace}
+        start_time = time.perf_counter()
+        async with self.limiter.limit(host):
+            send_time = time.perf_counter()
+            try:
+                response = await self.client.send(request, **kwargs)
+            except Exception as e:
+                if span is not None:
+                    span.add_phase("queue_wait", start_time, send_time)
+                    span.add_phase(
+                        "send", send_time, time.perf_counter(), {"error": repr(e)}
+                    )
+                raise
+        end_time = time.perf_counter()
+        self.reporter.observe("queue_wait", send_time - start_time)
+        self.reporter.observe("send", end_time - send_time)
+        if span is not None:
+            span.add_phase("queue_wait", start_time, send_time)
+            span.add_phase(
+                "send", send_time, end_time, {"status": response.status_code}
+            )
+        self.reporter.report_response(response)
+        self.limiter.feedback(host, response)
+        return response
+
+    async def schedule(
+        self,
+        callback: typing.Callable[..., typing.Awaitable],
+        url: typing.Union[str, httpx.URL],
+        priority: int = 0,
+        depth: typing.Optional[int] = None,
+        **kwargs,
+    ) -> bool:
+        """Push "callback(url, **kwargs)" into the frontier, the callback should be
+        this ant`s coroutine method and kwargs should be json serializable.
+        The depth is the current crawling entry`s depth + 1 by default.
+        """
+        if depth is None:
+            entry = _current_entry.get()
+            depth = 0 if entry is None else entry.depth + 1
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+
+        await utils.run_cor_func(
+            self.frontier.push,
+            Entry(callback.__name__, str(url), priority, depth, kwargs),
+        )
+        if self._frontier_event is not None:
+            self._frontier_event.set()
+        return True
+
+    async def crawl(self):
+        """Feed frontier entries to the pool until all of them are done"""
+        self._frontier_event = asyncio.Event()
+        while self.pool.running:
+            if 0 <= self.pool.limit <= self.pool.running_count:
+                # pop entry only when the pool has a free slot
+                await self.pool.done_queue.get()
+                continue
+            entry = await utils.run_cor_func(self.frontier.pop)
+            if entry is None:
+                if (
+                    self._in_flight_count == 0
+                    and await utils.run_cor_func(self.frontier.size) == 0
+                ):
+                    break
+                # wait for local scheduling or other workers
+                self._frontier_event.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._frontier_event.wait(), self.frontier_poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._in_flight_count += 1
+            self.pool.spawn(self._crawl_entry(entry))
+
+    async def _crawl_entry(self, entry: Entry):
+        _current_entry.set(entry)
+        renewing = None
+        visibility_timeout = getattr(self.frontier, "visibility_timeout", None)
+        if visibility_timeout:
+            renewing = asyncio.ensure_future(
+                self._renew_lease(entry, visibility_timeout)
+            )
+        try:
+            await getattr(self, entry.callback)(entry.url, **entry.kwargs)
+        except asyncio.CancelledError:
+            if self.pool.running:  # timeout
+                await utils.run_cor_func(self.frontier.done, entry)
+            else:  # force shutdown, crawl it again after resuming
+                await utils.run_cor_func(self.frontier.release, entry)
+            raise
+        except Exception:
+            await utils.run_cor_func(self.frontier.done, entry)
+            raise
+        else:
+            await utils.run_cor_func(self.frontier.done, entry)
+        finally:
+            if renewing is not None:
+                renewing.cancel()
+            self._in_flight_count -= 1
+            if self._frontier_event is not None:
+                self._frontier_event.set()
+
+    async def _renew_lease(self, entry: Entry, visibility_timeout: float):
+        """Renew the lease of the entry being crawled, so slow callbacks are not
+        crawled again by other nodes
+        """
+        while True:
+            await asyncio.sleep(visibility_timeout / 3)
+            try:
+                await utils.run_cor_func(self.frontier.renew, entry)
+            except Exception as e:
+                self.logger.warning(f"Can`t renew the lease of {entry}: {e!r}")
+
+    async def extract(self, extractor: Extractor, res: httpx.Response) -> Item:
+        """Extract one item, in the extractor`s executor if it has"""
+        func = self._instrument_extractor(extractor, extractor.extract)
+        if extractor.executor is None:
+            return func(res)
+        return await self.executors[extractor.executor].run(func, res)
+
+    async def extract_items(
+        self, extractor: Extractor, res: httpx.Response
+    ) -> typing.List[Item]:
+        """Extract items by NestExtractor or ColumnExtractor"""
+        func = self._instrument_extractor(
+            extractor, functools.partial(_extract_items, extractor)
+        )
+        if extractor.executor is None:
+            return func(res)
+        return await self.executors[extractor.executor].run(func, res)
+
+    def _instrument_extractor(
+        self, extractor: Extractor, func: typing.Callable
+    ) -> typing.Callable:
+        # hooks can`t be sent to other processes
+        if self.instrument is None or extractor.executor == "process":
+            return func
+        return functools.partial(_instrumented, self.instrument, func)
+
     async def collect(self, item: Item):
-        self.logger.debug("Collect item: " + str(item))
-        await self._pipe(item, self.item_pipelines)
+        """Process the item by item pipelines, with "ITEM_SINK" queue size, the item
+        is put into a bounded queue(wait when it`s full) and sunk in background.
+        """
+        self.logger.debug("Collect item: %s", item)
+        if self.item_sink_queue_size is not None:
+            if self._item_queue is None:
+                self._start_item_sinks()
+            await self._item_queue.put(item)  # type: ignore
+            return
+        if self._get_pipeline_chain(self.item_pipelines).batched:
+            await self._collect_in_batch(item)
+        else:
+            await self._pipe(item, self.item_pipelines)
         self.reporter.report(item)
 
+    async def _collect_in_batch(self, item: Item):
+        """Wait the item processed in one micro batch, the batch is processed when
+        it is full or its first item waits "item_batch_latency" seconds.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._item_batch.append((item, future))
+        if len(self._item_batch) >= self.item_batch_size:
+            self._flush_item_batch()
+        elif self._item_batch_handle is None:
+            self._item_batch_handle = loop.call_later(
+                self.item_batch_latency, self._flush_item_batch
+            )
+        await future
+
+    def _flush_item_batch(self):
+        if self._item_batch_handle is not None:
+            self._item_batch_handle.cancel()
+            self._item_batch_handle = None
+        batch, self._item_batch = self._item_batch, []
+        if batch:
+            task = asyncio.ensure_future(self._process_item_batch(batch))
+            self._item_batch_tasks.add(task)
+            task.add_done_callback(self._item_batch_tasks.discard)
+
+    async def _process_item_batch(
+        self, batch: typing.List[typing.Tuple[Item, asyncio.Future]]
+    ):
+        results = await self._process_items([item for item, _ in batch])
+        for (item, future), result in zip(batch, results):
+            if future.done():  # cancelled
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _process_items(self, items: typing.List[Item]) -> typing.List[typing.Any]:
+        """Process items in one batch, failed items are replaced by exceptions"""
+        start_time = time.perf_counter()
+        chain = self._get_pipeline_chain(self.item_pipelines)
+        try:
+            results = await chain.process_batch(items)
+        except Exception as e:  # pragma: no cover, failed obj is returned
+            results = [e] * len(items)
+        self.reporter.observe("item_pipeline", time.perf_counter() - start_time)
+        for item, result in zip(items, results):
+            if isinstance(result, Dropped):
+                self.reporter.report(item, dropped=True)
+        return results
+
+    def _start_item_sinks(self):
+        self._item_queue = asyncio.Queue(self.item_sink_queue_size)
+        self._item_sinks = [
+            asyncio.ensure_future(self._sink_items())
+            for _ in range(self.item_sink_workers)
+        ]
+
+    async def _sink_items(self):
+        """Get items from the queue and process them, as many as available(up to
+        batch size) at once for batch pipelines.
+        """
+        queue: asyncio.Queue = self._item_queue  # type: ignore
+        while True:
+            items = [await queue.get()]
+            if self._get_pipeline_chain(self.item_pipelines).batched:
+                while len(items) < self.item_batch_size and not queue.empty():
+                    items.append(queue.get_nowait())
+            try:
+                for item, result in zip(items, await self._process_items(items)):
+                    if not isinstance(result, Exception):
+                        self.reporter.report(item)
+                    elif not isinstance(result, Dropped):
+                        self.logger.error(f"Sink item failed: {result!r}")
+            finally:
+                for _ in items:
+                    queue.task_done()
+
+    async def _close_item_sinks(self):
+        """Wait all batched and queued items sunk"""
+        self._flush_item_batch()
+        if self._item_batch_tasks:
+            await asyncio.gather(*self._item_batch_tasks, return_exceptions=True)
+        if self._item_queue is None:
+            return
+        await self._item_queue.join()
+        for sink in self._item_sinks:
+            sink.cancel()
+        self._item_queue = None
+        self._item_sinks = []
+
     async def open(self):
         self.logger.info("Opening")
+        shared_url = getattr(settings, "SHARED_STATE", {}).get("url")
+        if shared_url:
+            # deduplicate requests among all processes and machines
+            for pipeline in self.request_pipelines:
+                if (
+                    isinstance(pipeline, RequestDuplicateFilterPipeline)
+                    and pipeline.default_filter
+                ):
+                    pipeline.fingerprint_filter = create_filter(shared_url, self.name)
         for pipeline in itertools.chain(
             self.item_pipelines, self.response_pipelines, self.request_pipelines
         ):
             await utils.run_cor_func(pipeline.on_spider_open)
+        for pipelines in (
+            self.request_pipelines,
+            self.response_pipelines,
+            self.item_pipelines,
+        ):
+            self._compile_pipelines(pipelines)
 
     async def close(self):
         await self.pool.wait_close()
+        await utils.run_cor_func(self.frontier.close)
+        await self._close_item_sinks()
 
         for pipeline in itertools.chain(
             self.item_pipelines, self.response_pipelines, self.request_pipelines
@@ -97,7 +523,13 @@ class Ant(abc.ABC):
             await utils.run_cor_func(pipeline.on_spider_close)
 
         await self.client.aclose()
+        for executor in self.executors.values():
+            executor.shutdown()
 
+        if self.instrument is not None:
+            self.instrument.close()
+        if self.tracer is not None:
+            self.tracer.close()
         self.reporter.close()
 
         self.logger.info("Closed")
@@ -109,7 +541,19 @@ class Ant(abc.ABC):
     async def main(self):
         with utils.suppress(self.logger):
             await self.open()
-            await self.run()
+            if self.worker_index == 0:
+                try:
+                    await self._seed()
+                finally:
+                    if self.worker_seeded is not None:
+                        self.worker_seeded.set()
+            else:
+                await utils.run_cor_func(self.frontier.resume)
+                if self.worker_seeded is not None:
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self.worker_seeded.wait
+                    )
+            await self.crawl()
         with utils.suppress(self.logger):
             await self.close()
         self.logger.info(
@@ -118,21 +562,53 @@ class Ant(abc.ABC):
             )
         )
 
+    async def _seed(self):
+        resumed_count = await utils.run_cor_func(self.frontier.resume)
+        if resumed_count > 0:
+            self.logger.info(f"Resume {resumed_count} requests from frontier")
+        elif await utils.run_cor_func(self.frontier.claim_seeding):
+            await self.run()
+        else:
+            self.logger.info("The shared frontier is seeded by another node")
+
     async def _pipe(
         self,
         obj: typing.Union[Item, httpx.Request, httpx.Response],
         pipelines: typing.List[Pipeline],
     ) -> typing.Any:
-        self.logger.debug("Process obj: " + str(obj))
-        raw_obj = obj
-        for pipeline in pipelines:
-            try:
-                obj = await utils.run_cor_func(pipeline.process, obj)
-            except Exception as e:
-                if isinstance(e, Dropped):
-                    self.reporter.report(raw_obj, dropped=True)
-                raise e
-        return obj
+        self.logger.debug("Process obj: %s", obj)
+        chain = self._get_pipeline_chain(pipelines)
+        start_time = time.perf_counter()
+        try:
+            processed_obj = await chain(obj)
+        except Dropped:
+            self.reporter.report(obj, dropped=True)
+            raise
+        if isinstance(obj, httpx.Request):
+            stage = "request_pipeline"
+        elif isinstance(obj, httpx.Response):
+            stage = "response_pipeline"
+        else:
+            stage = "item_pipeline"
+        self.reporter.observe(stage, time.perf_counter() - start_time)
+        return processed_obj
+
+    def _get_pipeline_chain(self, pipelines: typing.List[Pipeline]) -> PipelineChain:
+        chain = self._pipeline_chains.get(id(pipelines))
+        if chain is None or chain.is_stale(pipelines, self.instrument):
+            chain = self._compile_pipelines(pipelines)
+        return chain
+
+    def _compile_pipelines(self, pipelines: typing.List[Pipeline]) -> PipelineChain:
+        chain = PipelineChain(
+            pipelines,
+            self.executors,
+            self.instrument,
+            # responses returned by request pipelines(eg: cache) are not requests
+            stop_on=(httpx.Response,) if pipelines is self.request_pipelines else (),
+        )
+        self._pipeline_chains[id(pipelines)] = chain
+        return chain
 
 
 class CliAnt(Ant):
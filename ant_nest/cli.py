@@ -7,47 +7,120 @@ import sys
 import shutil
 import asyncio
 from importlib import import_module
+from importlib.util import find_spec
 from pkgutil import iter_modules
 import signal
 import functools
 import fnmatch
-import pkg_resources
+import logging
+import multiprocessing
+import queue
+import tempfile
+from collections import defaultdict
 
-import IPython
+import ujson
 
-from .ant import Ant, CliAnt
+if typing.TYPE_CHECKING:  # pragma: no cover
+    from .ant import Ant
 
 
 __signal_count = 0
+ANT_INDEX_VERSION = 1
 
 
-def get_ants(paths: typing.List[str]) -> typing.Dict[str, typing.Type[Ant]]:
-    """Get ant classes by package path"""
-    modules = []
-    results = {}
-    # get all modules from packages and subpackages
+def get_version() -> str:
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: no cover, python < 3.8
+        import importlib_metadata as metadata  # type: ignore
+
+    return metadata.version("ant_nest")
+
+
+def iter_ant_modules(
+    paths: typing.List[str],
+) -> typing.Iterator[typing.Tuple[str, typing.Optional[str]]]:
+    """Get module names and their source files from packages and subpackages,
+    only packages are imported.
+    """
     for path in paths:
-        module: typing.Any = import_module(path)
-        modules.append(module)
-        if hasattr(module, "__path__"):
-            package_path = []
-            for _, name, ispkg in iter_modules(module.__path__):
+        spec = find_spec(path)
+        if spec is None:
+            raise ModuleNotFoundError(f"No module named '{path}'", name=path)
+        yield path, spec.origin
+        if spec.submodule_search_locations is not None:
+            for _, name, ispkg in iter_modules(spec.submodule_search_locations):
                 next_path = path + "." + name
                 if ispkg:
-                    package_path.append(next_path)
+                    yield from iter_ant_modules([next_path])
                 else:
-                    modules.append(import_module(next_path))
-            if len(package_path) > 0:
-                results.update(get_ants(package_path))
-    # get and sift ant class obj from modules
-    for module in modules:
-        for name, obj in inspect.getmembers(module):
-            if isinstance(obj, type) and issubclass(obj, Ant) and obj is not Ant:
-                results[module.__name__ + "." + obj.__name__] = obj
+                    next_spec = find_spec(next_path)
+                    yield next_path, next_spec.origin if next_spec else None
+
+
+def index_ants(
+    paths: typing.List[str], cache_file: typing.Optional[str] = None
+) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """Get ant names with their module and attribute names by package path.
+
+    The index is cached in "cache_file", modules unchanged(by file mtime) since last
+    indexing are not imported.
+    """
+    cache: typing.Dict[str, typing.Any] = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                data = ujson.load(f)
+            if data.get("version") == ANT_INDEX_VERSION:
+                cache = data["modules"]
+        except ValueError:  # broken cache
+            pass
+
+    modules: typing.Dict[str, typing.Any] = {}
+    results = {}
+    for module_name, origin in iter_ant_modules(paths):
+        mtime = os.path.getmtime(origin) if origin and os.path.isfile(origin) else None
+        record = cache.get(module_name)
+        if record is None or mtime is None or record["mtime"] != mtime:
+            from .ant import Ant
+
+            module = import_module(module_name)
+            record = {
+                "mtime": mtime,
+                "ants": {
+                    obj.__name__: name
+                    for name, obj in inspect.getmembers(module)
+                    if isinstance(obj, type) and issubclass(obj, Ant) and obj is not Ant
+                },
+            }
+        modules[module_name] = record
+        for ant_name, attr in record["ants"].items():
+            results[module_name + "." + ant_name] = (module_name, attr)
+
+    if cache_file is not None and modules != cache:
+        try:
+            with open(cache_file, "w") as f:
+                ujson.dump({"version": ANT_INDEX_VERSION, "modules": modules}, f)
+        except OSError:  # read only project
+            pass
     return results
 
 
-def shutdown_ant(ants: typing.List[Ant]):
+def load_ant(index: typing.Dict[str, typing.Tuple[str, str]], name: str) -> type:
+    """Import one ant class by its name in the index"""
+    module_name, attr = index[name]
+    return getattr(import_module(module_name), attr)
+
+
+def get_ants(
+    paths: typing.List[str], cache_file: typing.Optional[str] = None
+) -> typing.Dict[str, typing.Type["Ant"]]:
+    """Get ant classes by package path"""
+    index = index_ants(paths, cache_file=cache_file)
+    return {name: load_ant(index, name) for name in index}
+
+
+def shutdown_ant(ants: typing.List["Ant"]):
     global __signal_count
     ant_names = "+".join([ant.name for ant in ants])
 
@@ -68,6 +141,147 @@ def shutdown_ant(ants: typing.List[Ant]):
         ant.pool.running = False
 
 
+def run_worker(
+    ant_names: typing.List[str],
+    ant_packages: typing.List[str],
+    frontier_dir: str,
+    index: int,
+    count: int,
+    seeded: typing.Any,
+    results: typing.Any,
+):
+    """Run ants in one worker process, report counts to the main process"""
+    # the main process forwards SIGINT and SIGTERM as SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from . import ant as ant_module
+
+    ant_module.settings.FRONTIER_DIR = frontier_dir
+    reporter_config = dict(ant_module.settings.REPORTER)
+    if reporter_config.get("prometheus_port"):  # one port per worker
+        reporter_config["prometheus_port"] += index
+    ant_module.settings.REPORTER = reporter_config
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ant_index = index_ants(ant_packages)
+    selected_ants: typing.List["Ant"] = []
+    for name in ant_names:
+        ant_cls: typing.Any = load_ant(ant_index, name)
+        ant_cls.worker_index = index
+        ant_cls.worker_count = count
+        ant_cls.worker_seeded = seeded
+        selected_ants.append(ant_cls())
+
+    loop.add_signal_handler(
+        signal.SIGTERM, functools.partial(shutdown_ant, selected_ants)
+    )
+    try:
+        loop.run_until_complete(asyncio.gather(*(ant.main() for ant in selected_ants)))
+    finally:
+        results.put({ant.name: ant.reporter.snapshot() for ant in selected_ants})
+
+
+def run_workers(
+    ant_names: typing.List[str], ant_packages: typing.List[str], count: int
+) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, int]]]:
+    """Run ants in "count" worker processes with shared frontiers(entries are
+    sharded by host), return merged counts of all workers.
+
+    Entries of one shard are popped only by its worker, so when a worker dies the
+    others are stopped and RuntimeError is raised, the crawl can be resumed with
+    "FRONTIER_DIR" setting.
+    """
+    from . import ant as ant_module
+
+    logger = logging.getLogger("AntNest")
+    frontier_dir = getattr(ant_module.settings, "FRONTIER_DIR", None)
+    temp_dir = None
+    if not frontier_dir:
+        frontier_dir = temp_dir = tempfile.mkdtemp()
+    seeded = multiprocessing.Event()
+    results: typing.Any = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(ant_names, ant_packages, frontier_dir, index, count, seeded, results),
+            name=f"AntNestWorker-{index}",
+        )
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward_signal(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)  # type: ignore
+
+    handlers = {
+        signum: signal.signal(signum, forward_signal)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+
+    counts: typing.Dict[str, typing.Dict[str, typing.Dict[str, int]]] = defaultdict(
+        lambda: defaultdict(lambda: defaultdict(int))
+    )
+    received = 0
+
+    def merge(snapshots: typing.Dict[str, typing.Dict[str, typing.Dict[str, int]]]):
+        nonlocal received
+        received += 1
+        for ant_name, snapshot in snapshots.items():
+            for name, record in snapshot.items():
+                for key, value in record.items():
+                    counts[ant_name][name][key] += value
+
+    dead_processes: typing.List[multiprocessing.Process] = []
+    while received < count and any(process.is_alive() for process in processes):
+        for process in processes:
+            if process.exitcode not in (None, 0) and process not in dead_processes:
+                dead_processes.append(process)
+                logger.error(
+                    f"{process.name} exited with code {process.exitcode}, "
+                    "stop other workers"
+                )
+                forward_signal(signal.SIGTERM, None)
+        try:
+            merge(results.get(timeout=0.5))
+        except queue.Empty:
+            continue
+    for process in processes:
+        process.join()
+    # workers may put counts and exit after the last getting
+    while received < count:
+        try:
+            merge(results.get(timeout=0.1))
+        except queue.Empty:
+            break
+    if received < count:
+        logger.warning(f"Get counts of {received} workers in {count}, miss the others")
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+    if temp_dir is not None:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    dead_processes.extend(
+        process
+        for process in processes
+        if process.exitcode != 0 and process not in dead_processes
+    )
+    if dead_processes:
+        raise RuntimeError(
+            "Workers exited abnormally: "
+            + ", ".join(f"{p.name}({p.exitcode})" for p in dead_processes)
+        )
+
+    for ant_name, snapshot in counts.items():
+        for name, record in snapshot.items():
+            logger.warning(
+                f"{ant_name} get {record['count']} {name} in total "
+                f"by {count} workers, drop {record['dropped_count']}, "
+                f"retry {record['retried_count']}"
+            )
+    return counts
+
+
 def main(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("-a", "--ants", help="ant names, multi name split by space")
@@ -77,15 +291,21 @@ def main(args=None):
     )
     parser.add_argument("-p", "--project", help="project name")
     parser.add_argument("-u", "--url", help="url")
+    parser.add_argument(
+        "-w", "--workers", help="worker processes count", type=int, default=1
+    )
     args = parser.parse_args(args)
     sys.path.append(os.getcwd())
 
-    version = pkg_resources.get_distribution("ant_nest").version
-
     if args.version:
-        print(version)
+        print(get_version())
         exit()
     elif args.url:
+        import IPython
+
+        from .ant import CliAnt
+
+        version = get_version()
         cli_ant = CliAnt()
         res = asyncio.get_event_loop().run_until_complete(cli_ant.request(args.url))
         objs = {"res": res, "cli_ant": cli_ant}
@@ -115,7 +335,9 @@ def main(args=None):
         print('Are "settings.py" created?')
         exit(-1)
     try:
-        ants = get_ants(settings.ANT_PACKAGES)
+        ants = index_ants(
+            settings.ANT_PACKAGES, getattr(settings, "ANT_INDEX_FILE", None)
+        )
     except Exception as e:
         print("There is a problem with finding and loading ants:")
         raise e
@@ -127,15 +349,26 @@ def main(args=None):
         else:
             print("\n".join(ants.keys()))
     elif args.ants is not None:
-        selected_ants: typing.List[Ant] = []
+        ant_names: typing.List[str] = []
         for name in args.ants.split("+"):
             temp = fnmatch.filter(ants.keys(), name)
             if len(temp) == 0:
                 print('Can not find ant by the name "{:s}"'.format(name))
                 exit(-1)
             else:
-                selected_ants.extend([ants[k]() for k in temp])
+                ant_names.extend(temp)
+
+        if args.workers > 1:
+            try:
+                run_workers(ant_names, settings.ANT_PACKAGES, args.workers)
+            except RuntimeError as e:
+                print(e)
+                exit(-1)
+            return
 
+        selected_ants: typing.List["Ant"] = [
+            load_ant(ants, name)() for name in ant_names
+        ]
         loop = asyncio.get_event_loop()
         loop.add_signal_handler(
             signal.SIGINT, functools.partial(shutdown_ant, selected_ants)
@@ -0,0 +1,210 @@
+"""Large file downloading with parallel http Range chunks and resuming"""
+import typing
+import os
+import asyncio
+import hashlib
+import logging
+
+import aiofiles
+import httpx
+import ujson
+
+__all__ = ["Downloader"]
+
+
+class Downloader:
+    """Download one file by parallel Range chunks into a preallocated "*.part" file,
+    done chunks are recorded in "*.part.json" so an interrupted download is resumed.
+    Files of servers without Range support(or rejecting HEAD) are downloaded in
+    one stream.
+
+    "request" is a coroutine function like "Ant.request", so chunks share the
+    pooled client, pipelines, host limits and retries of the ant, its requests are
+    sent with "dont_filter" to be retried and resumed. Bytes are written as they
+    are received(not decoded by "Content-Encoding"), identity encoding is asked.
+    """
+
+    def __init__(
+        self,
+        request: typing.Callable[..., typing.Awaitable[httpx.Response]],
+        chunk_size: int = 8 * 1024 * 1024,
+        concurrency: int = 4,
+        buffer_size: int = 64 * 1024,
+    ):
+        self.request = request
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.buffer_size = buffer_size
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def download(
+        self,
+        url: str,
+        file_path: str,
+        checksum: typing.Optional[str] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> int:
+        """Download the url to file path, verify its length and checksum
+        (eg: "sha256:<hex digest>"), return the file size.
+
+        :raise ValueError when the file is not complete or the checksum mismatches
+        """
+        headers = dict(headers or {})
+        if not any(key.lower() == "accept-encoding" for key in headers):
+            headers["Accept-Encoding"] = "identity"
+        part_path = file_path + ".part"
+        state_path = file_path + ".part.json"
+        response = await self.request(
+            url, method="HEAD", headers=headers, dont_filter=True
+        )
+        if response.is_error:  # eg: 405, or 403 of GET only presigned urls
+            self.logger.info(f"Get {response} of HEAD, download {url} in one stream")
+            size = await self._download_stream(url, part_path, headers)
+        else:
+            size = int(response.headers.get("content-length", 0))
+            validator = response.headers.get("etag") or response.headers.get(
+                "last-modified"
+            )
+            if (
+                response.headers.get("accept-ranges") != "bytes"
+                or size <= self.chunk_size
+            ):
+                size = await self._download_stream(url, part_path, headers) or size
+            else:
+                await self._download_chunks(
+                    url, part_path, state_path, size, validator, headers
+                )
+
+        actual_size = os.path.getsize(part_path)
+        if size and actual_size != size:
+            raise ValueError(f"Get {actual_size} bytes from {url}, expect {size}")
+        if checksum is not None:
+            algorithm, expected = checksum.split(":", 1)
+            digest = await asyncio.get_event_loop().run_in_executor(
+                None, self.hash_file, part_path, algorithm
+            )
+            if digest != expected.lower():
+                os.remove(part_path)
+                self._remove(state_path)
+                raise ValueError(
+                    f"The {algorithm} of {url} is {digest}, not {expected}"
+                )
+        os.replace(part_path, file_path)
+        self._remove(state_path)
+        return actual_size
+
+    async def _download_stream(
+        self, url: str, part_path: str, headers: typing.Dict[str, str]
+    ) -> int:
+        """Download the url in one GET stream, return its content length(0 when
+        it is unknown)
+        """
+        response = await self.request(
+            url, headers=headers, stream=True, dont_filter=True
+        )
+        try:
+            response.raise_for_status()
+            size = int(response.headers.get("content-length", 0))
+            async with aiofiles.open(part_path, "wb") as file:  # type: ignore
+                async for chunk in response.aiter_raw(self.buffer_size):
+                    await file.write(chunk)
+        finally:
+            await response.aclose()
+        return size
+
+    async def _download_chunks(
+        self,
+        url: str,
+        part_path: str,
+        state_path: str,
+        size: int,
+        validator: typing.Optional[str],
+        headers: typing.Dict[str, str],
+    ):
+        state = self._load_state(state_path)
+        if (
+            state is None
+            or not os.path.exists(part_path)
+            or (state["url"], state["size"], state["validator"])
+            != (url, size, validator)
+        ):
+            state = {"url": url, "size": size, "validator": validator, "done": []}
+            with open(part_path, "wb") as f:  # preallocate
+                f.truncate(size)
+            self._save_state(state_path, state)
+        else:
+            self.logger.info(f"Resume {url} with {len(state['done'])} chunks done")
+
+        done = set(state["done"])
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def download_chunk(index: int):
+            start = index * self.chunk_size
+            end = min(size, start + self.chunk_size) - 1
+            async with semaphore:
+                response = await self.request(
+                    url,
+                    headers={**headers, "Range": f"bytes={start}-{end}"},
+                    stream=True,
+                    dont_filter=True,
+                )
+                try:
+                    content_range = response.headers.get("content-range", "")
+                    if response.status_code != 206 or not content_range.startswith(
+                        f"bytes {start}-{end}/"
+                    ):
+                        raise ValueError(
+                            f"Get {response} with range {content_range!r} for "
+                            f"bytes {start}-{end} of {url}"
+                        )
+                    written = 0
+                    async with aiofiles.open(part_path, "r+b") as file:  # type: ignore
+                        await file.seek(start)
+                        async for chunk in response.aiter_raw(self.buffer_size):
+                            await file.write(chunk)
+                            written += len(chunk)
+                    if written != end - start + 1:
+                        raise ValueError(f"Chunk {start}-{end} of {url} is incomplete")
+                finally:
+                    await response.aclose()
+            state["done"].append(index)
+            self._save_state(state_path, state)
+
+        chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+        # let other chunks done for resuming
+        results = await asyncio.gather(
+            *(download_chunk(i) for i in range(chunk_count) if i not in done),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    @staticmethod
+    def hash_file(file_path: str, algorithm: str) -> str:
+        digest = hashlib.new(algorithm)
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _load_state(state_path: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        try:
+            with open(state_path) as f:
+                return ujson.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_state(state_path: str, state: typing.Dict[str, typing.Any]):
+        with open(state_path + ".tmp", "w") as f:
+            ujson.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
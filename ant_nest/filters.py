@@ -0,0 +1,190 @@
+"""Fingerprint filters for request deduplication"""
+import typing
+import math
+import hashlib
+import sqlite3
+import os
+
+
+__all__ = [
+    "Filter",
+    "MemoryFilter",
+    "BloomFilter",
+    "SqliteFilter",
+    "RedisFilter",
+    "create_filter",
+]
+
+
+class Filter:
+    def add(self, fingerprint: bytes) -> bool:
+        """Add one fingerprint, return False if it has been added before,
+        can be a coroutine function in subclasses"""
+        raise NotImplementedError()
+
+    def close(self):
+        """Release resources"""
+
+
+class MemoryFilter(Filter):
+    """Exact filter, keep all fingerprints in memory"""
+
+    def __init__(self):
+        self._fingerprints: typing.Set[bytes] = set()
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def add(self, fingerprint: bytes) -> bool:
+        if fingerprint in self._fingerprints:
+            return False
+        else:
+            self._fingerprints.add(fingerprint)
+            return True
+
+
+class _Bloom:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.count = 0
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def _positions(self, fingerprint: bytes) -> typing.Iterator[int]:
+        # double hashing with two halves of the fingerprint
+        h1 = int.from_bytes(fingerprint[:8], "little")
+        h2 = int.from_bytes(fingerprint[8:16], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(fingerprint)
+        )
+
+    def add(self, fingerprint: bytes):
+        for position in self._positions(fingerprint):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class BloomFilter(Filter):
+    """Scalable bloom filter with fixed memory per fingerprint,
+    false positive(a new fingerprint is seen as added) rate is below "error_rate".
+
+    When current filter is full, a bigger one with a tighter error rate is added.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000000,
+        error_rate: float = 0.001,
+        growth: int = 2,
+        tightening: float = 0.5,
+    ):
+        if not 0 < error_rate < 1:
+            raise ValueError("The error rate should between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self._filters: typing.List[_Bloom] = []
+        self._add_filter()
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self._filters)
+
+    def _add_filter(self):
+        n = len(self._filters)
+        self._filters.append(
+            _Bloom(
+                self.capacity * self.growth**n,
+                self.error_rate * (1 - self.tightening) * self.tightening**n,
+            )
+        )
+
+    def add(self, fingerprint: bytes) -> bool:
+        if len(fingerprint) < 16:
+            fingerprint = hashlib.blake2b(fingerprint, digest_size=16).digest()
+        for f in self._filters:
+            if fingerprint in f:
+                return False
+
+        f = self._filters[-1]
+        f.add(fingerprint)
+        if f.count >= f.capacity:
+            self._add_filter()
+        return True
+
+
+class SqliteFilter(Filter):
+    """Exact filter backed by one sqlite file, survives restarts"""
+
+    def __init__(self, path: str, commit_interval: int = 1000):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._uncommitted = 0
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints "
+            "(fingerprint BLOB PRIMARY KEY) WITHOUT ROWID"
+        )
+        self._connection.commit()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[
+            0
+        ]
+
+    def add(self, fingerprint: bytes) -> bool:
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO fingerprints VALUES (?)", (fingerprint,)
+        )
+        if cursor.rowcount == 0:
+            return False
+
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_interval:
+            self._connection.commit()
+            self._uncommitted = 0
+        return True
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+class RedisFilter(Filter):
+    """Exact filter shared by processes and machines through one redis set"""
+
+    def __init__(self, url: str, key: str = "ant_nest:fingerprints"):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url)
+        self.key = key
+
+    async def add(self, fingerprint: bytes) -> bool:  # type: ignore
+        return bool(await self.redis.sadd(self.key, fingerprint))
+
+    async def close(self):
+        await self.redis.close()
+
+
+def create_filter(url: str, name: str) -> Filter:
+    """Create shared filter for the ant by url, eg: "redis://127.0.0.1:6379/0"
+    for many machines or "sqlite:////var/lib/ant_nest" for processes of one host
+    """
+    if url.startswith("sqlite://"):
+        # commit every fingerprint, so other processes see it at once
+        return SqliteFilter(
+            os.path.join(url[len("sqlite://") :], name + ".filter.sqlite"),
+            commit_interval=1,
+        )
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisFilter(url, key=f"ant_nest:{name}:fingerprints")
+    else:
+        raise ValueError("The shared state url {:s} is not supported!".format(url))
@@ -0,0 +1,423 @@
+"""Crawl frontier: pending requests with priority and depth"""
+import typing
+import heapq
+import itertools
+import sqlite3
+import time
+import os
+
+import ujson
+
+from .utils import host_hash
+
+__all__ = ["Entry", "Frontier", "SqliteFrontier", "RedisFrontier", "create_frontier"]
+
+
+class Entry:
+    """One pending request, "callback" is the name of ant`s coroutine method"""
+
+    def __init__(
+        self,
+        callback: str,
+        url: str,
+        priority: int = 0,
+        depth: int = 0,
+        kwargs: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        id: typing.Any = None,
+    ):
+        self.callback = callback
+        self.url = url
+        self.priority = priority
+        self.depth = depth
+        self.kwargs = kwargs or {}
+        self.id = id
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({self.callback}, {self.url}, "
+            f"priority={self.priority}, depth={self.depth})"
+        )
+
+
+class Frontier:
+    """In memory frontier, entries with higher priority are popped first,
+    all methods can be coroutine functions in subclasses.
+    """
+
+    def __init__(self):
+        self._heap: typing.List[typing.Tuple[int, int, Entry]] = []
+        self._ids = itertools.count()
+        self._in_flight: typing.Dict[typing.Any, Entry] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap) + len(self._in_flight)
+
+    def size(self) -> int:
+        """Get the count of pending and in-flight entries"""
+        return len(self)
+
+    def resume(self) -> int:
+        """Get ready for popping, return the count of entries left from last run"""
+        return len(self)
+
+    def push(self, entry: Entry):
+        if entry.id is None:
+            entry.id = next(self._ids)
+        heapq.heappush(self._heap, (-entry.priority, entry.id, entry))
+
+    def pop(self) -> typing.Optional[Entry]:
+        """Pop the most important entry and hold it until done or released"""
+        if not self._heap:
+            return None
+        entry = heapq.heappop(self._heap)[2]
+        self._in_flight[entry.id] = entry
+        return entry
+
+    def done(self, entry: Entry):
+        self._in_flight.pop(entry.id, None)
+
+    def release(self, entry: Entry):
+        """Put back one popped entry"""
+        self._in_flight.pop(entry.id, None)
+        heapq.heappush(self._heap, (-entry.priority, entry.id, entry))
+
+    def renew(self, entry: Entry):
+        """Extend the lease of one popped entry, for frontiers with leases"""
+
+    def claim_seeding(self) -> bool:
+        """Whether this node should seed the empty frontier by "Ant.run", only one
+        of nodes sharing the frontier gets True.
+        """
+        return True
+
+    def close(self):
+        """Checkpoint and release resources"""
+
+
+class SqliteFrontier(Frontier):
+    """Frontier persisted in one sqlite file, popped but not done entries are
+    pending again after restarting, so a stopped or crashed crawl can be resumed.
+
+    The file can be shared by many processes of one host(sqlite WAL mode doesn`t
+    work on network filesystems), each of them pops entries of one shard(by the
+    hash of url`s host) only.
+    With "visibility_timeout", popped entries are leased for that seconds(renewed
+    by "renew" while they are crawled), entries held by crashed processes are
+    popped again after their lease expired.
+    """
+
+    PENDING = 0
+    IN_FLIGHT = 1
+
+    def __init__(
+        self,
+        path: str,
+        shard: int = 0,
+        shard_count: int = 1,
+        visibility_timeout: typing.Optional[float] = None,
+    ):
+        super().__init__()
+        self.path = path
+        self.shard = shard
+        self.shard_count = shard_count
+        self.visibility_timeout = visibility_timeout
+        self._connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, status INTEGER NOT NULL, "
+            "priority INTEGER NOT NULL, depth INTEGER NOT NULL, "
+            "host_hash INTEGER NOT NULL, lease_until REAL NOT NULL DEFAULT 0, "
+            "callback TEXT NOT NULL, url TEXT NOT NULL, kwargs TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_order "
+            "ON entries (status, priority DESC, id)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)"
+        )
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def resume(self) -> int:
+        if self.visibility_timeout is None:  # leased entries are popped again
+            self._connection.execute(
+                "UPDATE entries SET status = ? WHERE status = ? AND host_hash % ? = ?",
+                (self.PENDING, self.IN_FLIGHT, self.shard_count, self.shard),
+            )
+        return len(self)
+
+    def push(self, entry: Entry):
+        cursor = self._connection.execute(
+            "INSERT INTO entries "
+            "(status, priority, depth, host_hash, callback, url, kwargs) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.PENDING,
+                entry.priority,
+                entry.depth,
+                host_hash(entry.url),
+                entry.callback,
+                entry.url,
+                ujson.dumps(entry.kwargs),
+            ),
+        )
+        entry.id = cursor.lastrowid
+
+    def pop(self) -> typing.Optional[Entry]:
+        now = time.time()
+        condition = "status = ?"
+        params: typing.Tuple = (self.PENDING,)
+        if self.visibility_timeout is not None:
+            condition = "(status = ? OR (status = ? AND lease_until < ?))"
+            params = (self.PENDING, self.IN_FLIGHT, now)
+            now += self.visibility_timeout
+        # select and lease one entry atomically among processes
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT id, priority, depth, callback, url, kwargs FROM entries "
+                f"WHERE {condition} AND host_hash % ? = ? "
+                "ORDER BY priority DESC, id LIMIT 1",
+                params + (self.shard_count, self.shard),
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE entries SET status = ?, lease_until = ? WHERE id = ?",
+                    (self.IN_FLIGHT, now, row[0]),
+                )
+        finally:
+            self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        return Entry(
+            row[3],
+            row[4],
+            priority=row[1],
+            depth=row[2],
+            kwargs=ujson.loads(row[5]),
+            id=row[0],
+        )
+
+    def done(self, entry: Entry):
+        self._connection.execute("DELETE FROM entries WHERE id = ?", (entry.id,))
+
+    def release(self, entry: Entry):
+        self._connection.execute(
+            "UPDATE entries SET status = ? WHERE id = ?", (self.PENDING, entry.id)
+        )
+
+    def renew(self, entry: Entry):
+        if self.visibility_timeout is None:
+            return
+        self._connection.execute(
+            "UPDATE entries SET lease_until = ? WHERE id = ? AND status = ?",
+            (time.time() + self.visibility_timeout, entry.id, self.IN_FLIGHT),
+        )
+
+    def claim_seeding(self) -> bool:
+        if self.visibility_timeout is None:  # not shared among nodes
+            return True
+        # the claim expires, so a node crashed in seeding doesn`t block others
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.execute(
+                "DELETE FROM meta WHERE key = 'seeding' AND value < ?",
+                (now - self.visibility_timeout,),
+            )
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('seeding', ?)", (now,)
+            )
+        finally:
+            self._connection.execute("COMMIT")
+        return cursor.rowcount == 1
+
+    def close(self):
+        if len(self) == 0:  # crawled, seed again in next run
+            self._connection.execute("DELETE FROM meta WHERE key = 'seeding'")
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._connection.close()
+
+
+class RedisFrontier(Frontier):
+    """Frontier shared by processes and machines through redis, popped entries
+    are leased for "visibility_timeout" seconds(renewed by "renew" while they are
+    crawled), entries held by crashed nodes are popped again after their lease
+    expired.
+    """
+
+    # reclaim expired leases, then lease the most important entry of one shard
+    POP_SCRIPT = """
+local expired = redis.call("ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[1], "LIMIT", 0, 100)
+for _, id in ipairs(expired) do
+    redis.call("ZREM", KEYS[2], id)
+    local shard = redis.call("HGET", KEYS[4], id)
+    redis.call("ZADD", ARGV[3] .. shard, redis.call("HGET", KEYS[3], id), id)
+end
+local ids = redis.call("ZRANGE", KEYS[1], 0, 0)
+if #ids == 0 then
+    return false
+end
+redis.call("ZREM", KEYS[1], ids[1])
+redis.call("ZADD", KEYS[2], ARGV[2], ids[1])
+return {ids[1], redis.call("HGET", KEYS[5], ids[1])}
+"""
+    # put back one entry only if it`s still leased(not reclaimed or done)
+    RELEASE_SCRIPT = """
+local score = redis.call("HGET", KEYS[2], ARGV[1])
+if not score or redis.call("ZREM", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call("ZADD", KEYS[3], score, ARGV[1])
+return 1
+"""
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str = "ant_nest",
+        shard: int = 0,
+        shard_count: int = 1,
+        visibility_timeout: float = 300,
+    ):
+        from redis import asyncio as aioredis
+
+        super().__init__()
+        self.redis = aioredis.from_url(url)
+        self.prefix = prefix
+        self.shard = shard
+        self.shard_count = shard_count
+        self.visibility_timeout = visibility_timeout
+        self._pop_script = self.redis.register_script(self.POP_SCRIPT)
+        self._release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    async def size(self) -> int:  # type: ignore
+        count = await self.redis.zcard(self._key("leases"))
+        for shard in range(self.shard_count):
+            count += await self.redis.zcard(self._key(f"pending:{shard}"))
+        return count
+
+    async def resume(self) -> int:  # type: ignore
+        return await self.size()
+
+    async def push(self, entry: Entry):  # type: ignore
+        entry.id = str(await self.redis.incr(self._key("ids")))
+        shard = host_hash(entry.url) % self.shard_count
+        # higher priority first, then first in first out
+        score = -entry.priority * 2**40 + int(entry.id)
+        data = ujson.dumps(
+            {
+                "callback": entry.callback,
+                "url": entry.url,
+                "priority": entry.priority,
+                "depth": entry.depth,
+                "kwargs": entry.kwargs,
+            }
+        )
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("entries"), entry.id, data)
+            pipe.hset(self._key("scores"), entry.id, score)
+            pipe.hset(self._key("shards"), entry.id, shard)
+            pipe.zadd(self._key(f"pending:{shard}"), {entry.id: score})
+            await pipe.execute()
+
+    async def pop(self) -> typing.Optional[Entry]:  # type: ignore
+        now = time.time()
+        result = await self._pop_script(
+            keys=[
+                self._key(f"pending:{self.shard}"),
+                self._key("leases"),
+                self._key("scores"),
+                self._key("shards"),
+                self._key("entries"),
+            ],
+            args=[now, now + self.visibility_timeout, self._key("pending:")],
+        )
+        if not result:
+            return None
+        data = ujson.loads(result[1])
+        return Entry(
+            data["callback"],
+            data["url"],
+            priority=data["priority"],
+            depth=data["depth"],
+            kwargs=data["kwargs"],
+            id=result[0].decode(),
+        )
+
+    async def done(self, entry: Entry):  # type: ignore
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self._key("leases"), entry.id)
+            for name in ("entries", "scores", "shards"):
+                pipe.hdel(self._key(name), entry.id)
+            await pipe.execute()
+
+    async def release(self, entry: Entry):  # type: ignore
+        shard = host_hash(entry.url) % self.shard_count
+        await self._release_script(
+            keys=[
+                self._key("leases"),
+                self._key("scores"),
+                self._key(f"pending:{shard}"),
+            ],
+            args=[entry.id],
+        )
+
+    async def renew(self, entry: Entry):  # type: ignore
+        await self.redis.zadd(
+            self._key("leases"),
+            {entry.id: time.time() + self.visibility_timeout},
+            xx=True,
+        )
+
+    async def claim_seeding(self) -> bool:  # type: ignore
+        # the claim expires, so a node crashed in seeding doesn`t block others
+        return bool(
+            await self.redis.set(
+                self._key("seeding"),
+                1,
+                nx=True,
+                px=int(self.visibility_timeout * 1000),
+            )
+        )
+
+    async def close(self):  # type: ignore
+        if await self.size() == 0:  # crawled, seed again in next run
+            await self.redis.delete(self._key("seeding"))
+        await self.redis.close()
+
+
+def create_frontier(
+    url: str,
+    name: str,
+    shard: int = 0,
+    shard_count: int = 1,
+    visibility_timeout: float = 300,
+) -> Frontier:
+    """Create shared frontier for the ant by url, eg: "redis://127.0.0.1:6379/0"
+    for many machines or "sqlite:////var/lib/ant_nest" for processes of one host
+    """
+    if url.startswith("sqlite://"):
+        return SqliteFrontier(
+            os.path.join(url[len("sqlite://") :], name + ".frontier.sqlite"),
+            shard=shard,
+            shard_count=shard_count,
+            visibility_timeout=visibility_timeout,
+        )
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisFrontier(
+            url,
+            prefix=f"ant_nest:{name}",
+            shard=shard,
+            shard_count=shard_count,
+            visibility_timeout=visibility_timeout,
+        )
+    else:
+        raise ValueError("The shared state url {:s} is not supported!".format(url))
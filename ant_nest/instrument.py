@@ -0,0 +1,253 @@
+"""Timing hooks around pipeline stages, parsers and field extractors"""
+import typing
+import contextlib
+import contextvars
+import time
+import heapq
+import itertools
+import threading
+import random
+import logging
+import os
+import cProfile
+import pstats
+import io
+
+if typing.TYPE_CHECKING:
+    from .reporter import Reporter
+
+__all__ = [
+    "Hook",
+    "TimingHook",
+    "ProfileHook",
+    "Instrument",
+    "current_instrument",
+    "use_instrument",
+]
+
+
+class Hook:
+    """Called around every instrumented stage, "before" returns a state passed to
+    "after". Extractors in thread executors call hooks out of the event loop.
+
+    "sync_only" hooks are skipped for coroutine stages, whose cpu time is None.
+    Errors of hooks are logged, the stage runs without the failed hook.
+    """
+
+    sync_only = False
+
+    def before(self, stage: str, obj: typing.Any) -> typing.Any:
+        return None
+
+    def after(
+        self,
+        stage: str,
+        obj: typing.Any,
+        state: typing.Any,
+        wall: float,
+        cpu: typing.Optional[float],
+    ):
+        pass
+
+    def close(self):
+        pass
+
+
+class TimingHook(Hook):
+    """Observe wall time of stages as "<stage>" and cpu time as "<stage>:cpu"
+    histograms of the reporter.
+    """
+
+    BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, reporter: "Reporter"):
+        self.reporter = reporter
+        self._lock = threading.Lock()
+
+    def after(
+        self,
+        stage: str,
+        obj: typing.Any,
+        state: typing.Any,
+        wall: float,
+        cpu: typing.Optional[float],
+    ):
+        with self._lock:
+            self.reporter.observe(stage, wall, buckets=self.BUCKETS)
+            if cpu is not None:
+                self.reporter.observe(stage + ":cpu", cpu, buckets=self.BUCKETS)
+
+
+class ProfileHook(Hook):
+    """Profile sampled calls of sync stages by cProfile, keep the slowest "top"
+    ones and write them as "<rank>-<stage>.prof" to "profile_dir" on closing.
+    """
+
+    sync_only = True
+
+    def __init__(
+        self,
+        top: int = 10,
+        sample_rate: float = 0.01,
+        profile_dir: typing.Optional[str] = None,
+    ):
+        self.top = top
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.profiles: typing.List[
+            typing.Tuple[float, int, str, str, cProfile.Profile]
+        ] = []  # min heap of (wall, id, stage, obj repr, profile)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def before(self, stage: str, obj: typing.Any) -> typing.Any:
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active, eg: in other threads
+            return None
+        return profile
+
+    def after(
+        self,
+        stage: str,
+        obj: typing.Any,
+        state: typing.Any,
+        wall: float,
+        cpu: typing.Optional[float],
+    ):
+        if state is None:
+            return
+        state.disable()
+        with self._lock:
+            record = (wall, next(self._ids), stage, repr(obj)[:200], state)
+            if len(self.profiles) < self.top:
+                heapq.heappush(self.profiles, record)
+            elif wall > self.profiles[0][0]:
+                heapq.heapreplace(self.profiles, record)
+
+    def slowest(self) -> typing.List[typing.Tuple[float, str, str, cProfile.Profile]]:
+        """Get (wall, stage, obj repr, profile) of kept calls, the slowest first"""
+        return [
+            (wall, stage, obj, profile)
+            for wall, _, stage, obj, profile in sorted(self.profiles, reverse=True)
+        ]
+
+    def close(self):
+        for rank, (wall, stage, obj, profile) in enumerate(self.slowest()):
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(
+                10
+            )
+            self.logger.info(
+                f"{stage} took {wall:.6f}s with {obj}\n{stream.getvalue()}"
+            )
+            if self.profile_dir is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profile.dump_stats(
+                    os.path.join(
+                        self.profile_dir,
+                        "{:d}-{:s}.prof".format(rank, stage.replace(":", "-")),
+                    )
+                )
+
+
+class Instrument:
+    """Call hooks before and after stages, disabled by not creating one at all,
+    so uninstrumented pipelines and extractors run as before.
+    """
+
+    def __init__(self, hooks: typing.Optional[typing.List[Hook]] = None):
+        self.hooks: typing.List[Hook] = list(hooks or [])
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def call(
+        self, stage: str, func: typing.Callable, obj: typing.Any, *args: typing.Any
+    ) -> typing.Any:
+        """Call one sync stage with wall and cpu(of the current thread) timing"""
+        states: typing.List[typing.Tuple[Hook, typing.Any]] = []
+        try:
+            states = self._before(self.hooks, stage, obj)
+            start_time = time.perf_counter()
+            start_cpu = time.thread_time()
+            return func(obj, *args)
+        finally:
+            if states:
+                cpu = time.thread_time() - start_cpu
+                wall = time.perf_counter() - start_time
+                self._after(states, stage, obj, wall, cpu)
+
+    async def call_async(
+        self, stage: str, func: typing.Callable, obj: typing.Any
+    ) -> typing.Any:
+        """Await one coroutine stage with wall timing only, other tasks run and
+        use cpu while it is waiting.
+        """
+        hooks = [hook for hook in self.hooks if not hook.sync_only]
+        states: typing.List[typing.Tuple[Hook, typing.Any]] = []
+        try:
+            states = self._before(hooks, stage, obj)
+            start_time = time.perf_counter()
+            return await func(obj)
+        finally:
+            if states:
+                self._after(states, stage, obj, time.perf_counter() - start_time, None)
+
+    def _before(
+        self, hooks: typing.List[Hook], stage: str, obj: typing.Any
+    ) -> typing.List[typing.Tuple[Hook, typing.Any]]:
+        states = []
+        for hook in hooks:
+            try:
+                states.append((hook, hook.before(stage, obj)))
+            except Exception as e:
+                self.logger.warning(f"Skip {hook!r} for {stage}: {e!r}")
+        return states
+
+    def _after(
+        self,
+        states: typing.List[typing.Tuple[Hook, typing.Any]],
+        stage: str,
+        obj: typing.Any,
+        wall: float,
+        cpu: typing.Optional[float],
+    ):
+        for hook, state in states:
+            try:
+                hook.after(stage, obj, state, wall, cpu)
+            except Exception as e:
+                self.logger.warning(f"Skip {hook!r} for {stage}: {e!r}")
+
+    def wrap(
+        self, stage: str, func: typing.Callable, is_sync: bool = True
+    ) -> typing.Callable:
+        if is_sync:
+            return lambda obj: self.call(stage, func, obj)
+        return lambda obj: self.call_async(stage, func, obj)
+
+    def close(self):
+        for hook in self.hooks:
+            hook.close()
+
+
+# the instrument of extractors, set by the ant around extracting
+_current_instrument: "contextvars.ContextVar[typing.Optional[Instrument]]" = (
+    contextvars.ContextVar("current_instrument", default=None)
+)
+
+
+def current_instrument() -> typing.Optional[Instrument]:
+    return _current_instrument.get()
+
+
+@contextlib.contextmanager
+def use_instrument(instrument: typing.Optional[Instrument]):
+    """Instrument extractors called in the block(of the current thread)"""
+    token = _current_instrument.set(instrument)
+    try:
+        yield instrument
+    finally:
+        _current_instrument.reset(token)
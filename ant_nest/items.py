@@ -1,10 +1,15 @@
 """Provide Ant`s Item and Extractor."""
 import typing
+import weakref
+import functools
+import itertools
+import re
 from collections.abc import MutableMapping
 
 import httpx
 
 from .exceptions import ItemGetValueError
+from .instrument import Instrument, current_instrument
 
 
 class CustomNoneType:
@@ -33,9 +38,167 @@ def get_value(item: Item, key: str) -> typing.Any:
         raise ItemGetValueError from e
 
 
+def parse_html(res: httpx.Response) -> typing.Any:
+    from lxml import html
+
+    return html.fromstring(res.text)
+
+
+def parse_xml(res: httpx.Response) -> typing.Any:
+    from lxml import etree
+
+    return etree.fromstring(res.content)
+
+
+def parse_soup(res: httpx.Response) -> typing.Any:
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(res.text, "html.parser")
+
+
+def parse_json(res: httpx.Response) -> typing.Any:
+    return res.json()
+
+
+PARSERS: typing.Dict[str, typing.Callable[[httpx.Response], typing.Any]] = {
+    "html": parse_html,
+    "xml": parse_xml,
+    "soup": parse_soup,
+    "json": parse_json,
+}
+# parsed documents, live as long as their response
+_documents: "weakref.WeakKeyDictionary[httpx.Response, typing.Dict[str, typing.Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_document(obj: typing.Any, parser: typing.Optional[str] = "html") -> typing.Any:
+    """Parse response by the parser name once, then get parsed document from cache.
+    Other objs(eg: nodes from one parsed document) are returned directly.
+    """
+    if parser is None or not isinstance(obj, httpx.Response):
+        return obj
+    documents = _documents.setdefault(obj, {})
+    try:
+        return documents[parser]
+    except KeyError:
+        document = documents[parser] = PARSERS[parser](obj)
+        return document
+
+
+# compiled selectors are shared by all extractors
+SELECTOR_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_xpath(path: str) -> typing.Any:
+    from lxml import etree
+
+    return etree.XPath(path)
+
+
+@functools.lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_css(selector: str) -> typing.Any:
+    from lxml.cssselect import CSSSelector
+
+    return CSSSelector(selector)
+
+
+@functools.lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def compile_regex(pattern: str, flags: int = 0) -> typing.Pattern:
+    return re.compile(pattern, flags)
+
+
+def get_text(obj: typing.Any) -> str:
+    if isinstance(obj, httpx.Response):
+        return obj.text
+    elif isinstance(obj, str):
+        return obj
+    else:  # lxml element
+        from lxml import etree
+
+        return etree.tostring(obj, encoding="unicode")
+
+
+def _pick(values: typing.Sequence, many: bool, default: typing.Any) -> typing.Any:
+    if many:
+        return values
+    return values[0] if len(values) > 0 else default
+
+
+class _Selector:
+    """Field extractor by one selector string, compiled selectors are not
+    picklable, so they are compiled again after sent to other processes.
+    """
+
+    def __init__(self, selector: str, many: bool, default: typing.Any):
+        self.selector = selector
+        self.many = many
+        self.default = default
+        self._compiled = self.compile()
+
+    def compile(self) -> typing.Any:
+        raise NotImplementedError
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        state = self.__dict__.copy()
+        del state["_compiled"]
+        return state
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]):
+        self.__dict__.update(state)
+        self._compiled = self.compile()
+
+
+class _XPathSelector(_Selector):
+    def compile(self) -> typing.Any:
+        return compile_xpath(self.selector)
+
+    def __call__(self, obj: typing.Any) -> typing.Any:
+        return _pick(self._compiled(get_document(obj, "html")), self.many, self.default)
+
+
+class _CssSelector(_Selector):
+    def compile(self) -> typing.Any:
+        return compile_css(self.selector)
+
+    def __call__(self, obj: typing.Any) -> typing.Any:
+        return _pick(self._compiled(get_document(obj, "html")), self.many, self.default)
+
+
+class _RegexSelector(_Selector):
+    def __init__(self, selector: str, many: bool, default: typing.Any, flags: int = 0):
+        self.flags = flags
+        super().__init__(selector, many, default)
+
+    def compile(self) -> typing.Any:
+        return compile_regex(self.selector, self.flags)
+
+    def __call__(self, obj: typing.Any) -> typing.Any:
+        return _pick(self._compiled.findall(get_text(obj)), self.many, self.default)
+
+
 class Extractor:
-    def __init__(self, item_cls: typing.Type[Item]):
+    """Extract item from response
+
+    With a parser name("html", "xml", "soup", "json" or any key in PARSERS), the
+    response is parsed only once and every extractor get the parsed document.
+    With an executor name("thread" or "process"), "Ant.extract" runs it out of
+    the event loop, the item class and custom extractors should be picklable for
+    "process" executor.
+    In "use_instrument" blocks(set by the ant), parsing and every field extractor
+    are timed as stages "parser:<parser>" and "extractor:<item class name>.<key>".
+    """
+
+    def __init__(
+        self,
+        item_cls: typing.Type[Item],
+        parser: typing.Optional[str] = None,
+        executor: typing.Optional[str] = None,
+    ):
         self.item_cls = item_cls
+        self.parser = parser
+        self.executor = executor
         self.extractors: typing.Dict[
             str, typing.Callable[[typing.Any], typing.Any]
         ] = dict()
@@ -45,32 +208,191 @@ class Extractor:
     ):
         self.extractors[key] = extractor
 
+    def add_xpath(
+        self, key: str, path: str, many: bool = False, default: typing.Any = None
+    ):
+        """Extract the first matched value(or all values with "many") by xpath"""
+        self.add_extractor(key, _XPathSelector(path, many, default))
+
+    def add_css(
+        self, key: str, selector: str, many: bool = False, default: typing.Any = None
+    ):
+        """Extract the first matched element(or all elements with "many") by css"""
+        self.add_extractor(key, _CssSelector(selector, many, default))
+
+    def add_regex(
+        self,
+        key: str,
+        pattern: str,
+        many: bool = False,
+        default: typing.Any = None,
+        flags: int = 0,
+    ):
+        """Extract the first matched string(or all strings with "many") by regex"""
+        self.add_extractor(key, _RegexSelector(pattern, many, default, flags=flags))
+
     def extract(self, res: httpx.Response) -> Item:
         item = self.item_cls()
-        for key, extractor in self.extractors.items():
-            set_value(item, key, extractor(res))
+        instrument = current_instrument()
+        if instrument is None:
+            document = get_document(res, self.parser)
+            for key, extractor in self.extractors.items():
+                set_value(item, key, extractor(document))
+        else:
+            document = self._parse(res, instrument)
+            for key, extractor in self.extractors.items():
+                set_value(
+                    item, key, instrument.call(self._stage(key), extractor, document)
+                )
 
         return item
 
+    def _parse(self, res: typing.Any, instrument: Instrument) -> typing.Any:
+        if self.parser is None or not isinstance(res, httpx.Response):
+            return res
+        return instrument.call("parser:" + self.parser, get_document, res, self.parser)
+
+    def _stage(self, key: str) -> str:
+        return f"extractor:{self.item_cls.__name__}.{key}"
+
 
 class NestExtractor(Extractor):
     def __init__(
         self,
         item_class: typing.Type[Item],
-        root_extractor: typing.Callable[[httpx.Response], typing.Sequence],
+        root_extractor: typing.Callable[[typing.Any], typing.Sequence],
+        parser: typing.Optional[str] = None,
+        executor: typing.Optional[str] = None,
     ):
         self.root_extractor = root_extractor
-        super().__init__(item_class)
+        super().__init__(item_class, parser=parser, executor=executor)
 
     def extract_items(self, res: httpx.Response) -> typing.Generator[Item, None, None]:
-        for node in self.root_extractor(res):
+        instrument = current_instrument()
+        if instrument is None:
+            nodes = self.root_extractor(get_document(res, self.parser))
+        else:
+            nodes = instrument.call(
+                self._stage("<root>"), self.root_extractor, self._parse(res, instrument)
+            )
+        for node in nodes:
             yield super().extract(node)
 
 
+class ColumnExtractor(Extractor):
+    """Extract many items by columns
+
+    Every extractor is called only once with the whole document and return one
+    column(a sequence of values aligned by node), columns are zipped into items.
+    eg: add_xpath(key, '//div[@class="row"]/p/text()'), selectors get all matched
+    values by default.
+
+    Rows missing some fields make columns ragged, with "root_extractor"(returns
+    row nodes) every lxml value is put to the row node containing it, the first
+    value in one row is kept and missing values are None.
+    """
+
+    def __init__(
+        self,
+        item_cls: typing.Type[Item],
+        parser: typing.Optional[str] = None,
+        executor: typing.Optional[str] = None,
+        root_extractor: typing.Optional[
+            typing.Callable[[typing.Any], typing.Sequence]
+        ] = None,
+    ):
+        super().__init__(item_cls, parser=parser, executor=executor)
+        self.root_extractor = root_extractor
+
+    def add_xpath(
+        self, key: str, path: str, many: bool = True, default: typing.Any = None
+    ):
+        super().add_xpath(key, path, many=many, default=default)
+
+    def add_css(
+        self, key: str, selector: str, many: bool = True, default: typing.Any = None
+    ):
+        super().add_css(key, selector, many=many, default=default)
+
+    def add_regex(
+        self,
+        key: str,
+        pattern: str,
+        many: bool = True,
+        default: typing.Any = None,
+        flags: int = 0,
+    ):
+        super().add_regex(key, pattern, many=many, default=default, flags=flags)
+
+    def extract_items(self, res: httpx.Response) -> typing.Generator[Item, None, None]:
+        instrument = current_instrument()
+        if instrument is None:
+            document = get_document(res, self.parser)
+            columns = [
+                (key, extractor(document)) for key, extractor in self.extractors.items()
+            ]
+        else:
+            document = self._parse(res, instrument)
+            columns = [
+                (key, instrument.call(self._stage(key), extractor, document))
+                for key, extractor in self.extractors.items()
+            ]
+        for key, column in columns:
+            # eg: the first matched string, whose characters are not values
+            if isinstance(column, (str, bytes)) or not isinstance(
+                column, typing.Sequence
+            ):
+                raise ValueError(f"Column {key} is not a sequence: {column!r}")
+        if self.root_extractor is not None:
+            if instrument is None:
+                rows = self.root_extractor(document)
+            else:
+                rows = instrument.call(
+                    self._stage("<root>"), self.root_extractor, document
+                )
+            columns = [(key, _align(rows, key, column)) for key, column in columns]
+        lengths = set(len(column) for _, column in columns)
+        if len(lengths) > 1:
+            raise ValueError(
+                "Columns are not aligned: "
+                + ", ".join(f"{key}({len(column)})" for key, column in columns)
+            )
+
+        for values in zip(*(column for _, column in columns)):
+            item = self.item_cls()
+            for (key, _), value in zip(columns, values):
+                set_value(item, key, value)
+            yield item
+
+
+def _align(rows: typing.Sequence, key: str, column: typing.Sequence) -> typing.List:
+    """Put lxml values(elements or smart strings) of one column to their rows"""
+    indexes = {row: i for i, row in enumerate(rows)}
+    values: typing.List[typing.Any] = [None] * len(rows)
+    found = [False] * len(rows)
+    for value in column:
+        node = value if hasattr(value, "iterancestors") else None
+        if node is None and hasattr(value, "getparent"):  # smart string
+            node = value.getparent()
+        if node is None:
+            raise ValueError(f"Values of {key} can`t be aligned to rows: {value!r}")
+        for ancestor in itertools.chain((node,), node.iterancestors()):
+            index = indexes.get(ancestor)
+            if index is not None:
+                if not found[index]:
+                    values[index] = value
+                    found[index] = True
+                break
+    return values
+
+
 __all__ = [
     "Item",
     "Extractor",
     "NestExtractor",
+    "ColumnExtractor",
+    "PARSERS",
+    "get_document",
     "get_value",
     "set_value",
 ]
@@ -0,0 +1,123 @@
+"""Per host concurrency and rate limit"""
+import typing
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from .utils import parse_retry_after
+
+__all__ = ["HostLimiter"]
+
+
+class _Host:
+    def __init__(self, concurrency: int, burst: int):
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.users = 0  # waiting and in-flight requests
+
+
+class HostLimiter:
+    """Limit in-flight requests count and requests per second(token bucket) by host,
+    0 means no limit.
+
+    A host is paused after a response with "backoff_statuses", by its "Retry-After"
+    header or an exponential backoff delay, at most "max_backoff" seconds.
+
+    States of idle hosts(no requests, not paused and a full bucket) are evicted,
+    backoff delays are kept "max_backoff" seconds after the pause.
+    """
+
+    SWEEP_SIZE = 1024  # sweep idle hosts when hosts are more than it
+
+    def __init__(
+        self,
+        concurrency: int = 0,
+        rate: float = 0,
+        burst: int = 1,
+        backoff_statuses: typing.Container[int] = (429, 503),
+        max_backoff: float = 60,
+    ):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.backoff_statuses = backoff_statuses
+        self.max_backoff = max_backoff
+        self._hosts: typing.Dict[str, _Host] = {}
+        self._sweep_size = self.SWEEP_SIZE
+
+    def _get(self, host: str) -> _Host:
+        h = self._hosts.get(host)
+        if h is None:
+            if len(self._hosts) >= self._sweep_size:
+                self._sweep()
+            h = self._hosts[host] = _Host(self.concurrency, self.burst)
+        return h
+
+    def _is_idle(self, h: _Host, now: float) -> bool:
+        if h.users or now < h.paused_until + (self.max_backoff if h.backoff else 0):
+            return False
+        return (
+            self.rate <= 0 or h.tokens + (now - h.updated_at) * self.rate >= self.burst
+        )
+
+    def _sweep(self):
+        """Evict all idle hosts, eg: paused hosts without later requests"""
+        now = time.monotonic()
+        for host, h in list(self._hosts.items()):
+            if self._is_idle(h, now):
+                del self._hosts[host]
+        self._sweep_size = max(self.SWEEP_SIZE, len(self._hosts) * 2)
+
+    @asynccontextmanager
+    async def limit(self, host: str):
+        h = self._get(host)
+        h.users += 1
+        try:
+            if h.semaphore is not None:
+                await h.semaphore.acquire()
+            try:
+                await self._wait(h)
+                yield
+            finally:
+                if h.semaphore is not None:
+                    h.semaphore.release()
+        finally:
+            h.users -= 1
+            if self._hosts.get(host) is h and self._is_idle(h, time.monotonic()):
+                del self._hosts[host]
+
+    async def _wait(self, h: _Host):
+        while True:
+            now = time.monotonic()
+            if now < h.paused_until:
+                await asyncio.sleep(h.paused_until - now)
+                continue
+            if self.rate <= 0:
+                return
+            h.tokens = min(self.burst, h.tokens + (now - h.updated_at) * self.rate)
+            h.updated_at = now
+            if h.tokens >= 1:
+                h.tokens -= 1
+                return
+            await asyncio.sleep((1 - h.tokens) / self.rate)
+
+    def feedback(self, host: str, response: httpx.Response):
+        """Slow down the host by response"""
+        if response.status_code in self.backoff_statuses:
+            h = self._get(host)
+            delay = parse_retry_after(response.headers.get("retry-after"))
+            if delay is None:
+                h.backoff = min(self.max_backoff, h.backoff * 2 or 1)
+                delay = h.backoff
+            delay = min(delay, self.max_backoff)
+            h.paused_until = max(h.paused_until, time.monotonic() + delay)
+        elif host in self._hosts:
+            h = self._hosts[host]
+            h.backoff = 0
+            if self._is_idle(h, time.monotonic()):
+                del self._hosts[host]
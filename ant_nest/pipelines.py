@@ -5,16 +5,35 @@ import ujson
 import os
 import random
 import re
+import asyncio
+import gzip
+import time
+import functools
+import hashlib
+import inspect
+import sqlite3
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
 
 import aiofiles
-from httpx import Request, Response
+from httpx import Request, Response, ResponseNotRead
 
 from .items import Item, set_value, get_value
 from .exceptions import Dropped
-from .utils import run_cor_func
+from .filters import Filter, MemoryFilter
+from .instrument import Instrument
+from .utils import run_cor_func, request_fingerprint, canonicalize_url, OffloadExecutor
 
 
 class Pipeline:
+    # run sync "process" method in "thread" or "process" executor of the ant
+    executor: typing.Optional[str] = None
+    # "process" is not a coroutine function but returns awaitable objects
+    awaitable: bool = False
+    # item pipelines can define "process_batch(objs) -> objs" to process micro
+    # batches of items(eg: bulk writes), raise Dropped in it to drop the batch
+
     def __init__(self):
         self.logger = logging.getLogger(self.__class__.__name__)
 
@@ -26,10 +45,228 @@ class Pipeline:
 
     def process(self, obj: typing.Any) -> typing.Any:
         """Process objs, this method can be coroutine function
-        Raise Dropped when drop one obj
+        Raise Dropped when drop one obj, request pipelines can return one response
+        to skip sending
+
+        :raise Dropped
+        """
+        return obj
+
+
+class PipelineChain:
+    """Pipelines compiled once for processing many objs: runs of sync stages are
+    called back to back, only coroutine and offloaded stages are awaited. Like
+    "run_cor_func", awaitable objs returned by sync "process" are awaited too.
+
+    With an instrument, every pipeline is one stage named "pipeline:<class name>".
+    With "stop_on" types, the rest pipelines are skipped once one stage returns an
+    obj of them, eg: request pipelines returning a cached response.
+    """
+
+    def __init__(
+        self,
+        pipelines: typing.List[Pipeline],
+        executors: typing.Optional[typing.Dict[str, OffloadExecutor]] = None,
+        instrument: typing.Optional[Instrument] = None,
+        stop_on: typing.Tuple[type, ...] = (),
+    ):
+        self.pipelines = list(pipelines)
+        self.instrument = instrument
+        self.stop_on = stop_on
+        self._runs: typing.List[typing.Tuple[bool, typing.Callable]] = []
+        sync_funcs: typing.List[typing.Callable] = []
+        func: typing.Callable
+        for pipeline in pipelines:
+            if pipeline.executor is not None:
+                func = functools.partial(
+                    (executors or {})[pipeline.executor].run, pipeline.process
+                )
+            elif asyncio.iscoroutinefunction(pipeline.process) or pipeline.awaitable:
+                func = pipeline.process
+            elif instrument is not None:
+                func = instrument.wrap(self._stage(pipeline), pipeline.process)
+                self._runs.append((True, func))
+                continue
+            else:
+                sync_funcs.append(pipeline.process)
+                continue
+            if instrument is not None:
+                func = instrument.wrap(self._stage(pipeline), func, is_sync=False)
+            if sync_funcs:
+                self._runs.append((True, self._chain(sync_funcs, stop_on)))
+                sync_funcs = []
+            self._runs.append((False, func))
+        if sync_funcs:
+            self._runs.append((True, self._chain(sync_funcs, stop_on)))
+
+        # for batches: pipelines with "process_batch" and chains of the others
+        self.batched = any(hasattr(pipeline, "process_batch") for pipeline in pipelines)
+        self._batch_stages: typing.List[typing.Tuple[bool, typing.Callable]] = []
+        others: typing.List[Pipeline] = []
+        for pipeline in pipelines if self.batched else []:
+            if hasattr(pipeline, "process_batch"):
+                if others:
+                    self._batch_stages.append(
+                        (False, PipelineChain(others, executors, instrument, stop_on))
+                    )
+                    others = []
+                func = getattr(pipeline, "process_batch")
+                if instrument is not None:
+                    func = instrument.wrap(
+                        self._stage(pipeline) + ".process_batch",
+                        func,
+                        is_sync=not asyncio.iscoroutinefunction(func),
+                    )
+                self._batch_stages.append((True, func))
+            else:
+                others.append(pipeline)
+        if others:
+            self._batch_stages.append(
+                (False, PipelineChain(others, executors, instrument, stop_on))
+            )
+
+    @staticmethod
+    def _stage(pipeline: Pipeline) -> str:
+        return "pipeline:" + pipeline.__class__.__name__
+
+    @staticmethod
+    def _chain(
+        funcs: typing.List[typing.Callable], stop_on: typing.Tuple[type, ...] = ()
+    ) -> typing.Callable:
+        if len(funcs) == 1:
+            return funcs[0]
+
+        def run(obj: typing.Any) -> typing.Any:
+            for i, func in enumerate(funcs):
+                obj = func(obj)
+                if inspect.isawaitable(obj):  # awaited by the caller
+                    return PipelineChain._resume(obj, funcs[i + 1 :], stop_on)
+                if isinstance(obj, stop_on):
+                    break
+            return obj
+
+        return run
+
+    @staticmethod
+    async def _resume(
+        obj: typing.Awaitable,
+        funcs: typing.List[typing.Callable],
+        stop_on: typing.Tuple[type, ...],
+    ) -> typing.Any:
+        """Await the obj returned by one sync stage, then run the rest stages"""
+        obj = await obj
+        for func in funcs:
+            if isinstance(obj, stop_on):
+                break
+            obj = func(obj)
+            if inspect.isawaitable(obj):
+                obj = await obj
+        return obj
+
+    def is_stale(
+        self,
+        pipelines: typing.List[Pipeline],
+        instrument: typing.Optional[Instrument] = None,
+    ) -> bool:
+        """Whether the chain is compiled from other or changed pipelines, or with
+        another instrument
+        """
+        return pipelines != self.pipelines or instrument is not self.instrument
+
+    async def __call__(self, obj: typing.Any) -> typing.Any:
+        """Process one obj by all pipelines
 
         :raise Dropped
         """
+        for is_sync, run in self._runs:
+            obj = run(obj) if is_sync else await run(obj)
+            if is_sync and inspect.isawaitable(obj):
+                obj = await obj
+            if isinstance(obj, self.stop_on):
+                break
+        return obj
+
+    async def process_batch(
+        self, objs: typing.List[typing.Any]
+    ) -> typing.List[typing.Any]:
+        """Process objs by all pipelines, pipelines without "process_batch" get objs
+        one by one. Return results in order, dropped or failed objs are replaced by
+        their exceptions.
+        """
+        if not self.batched:
+            return [await self._process_or_raised(self, obj) for obj in objs]
+
+        results: typing.List[typing.Any] = list(objs)
+        for is_batch, run in self._batch_stages:
+            alive = [
+                i for i, obj in enumerate(results) if not isinstance(obj, Exception)
+            ]
+            if not alive:
+                break
+            if is_batch:
+                try:
+                    processed = await run_cor_func(run, [results[i] for i in alive])
+                    if len(processed) != len(alive):
+                        raise ValueError(
+                            "process_batch should return objs as many as received"
+                        )
+                except Exception as e:
+                    processed = [e] * len(alive)
+                for i, obj in zip(alive, processed):
+                    results[i] = obj
+            else:
+                for i in alive:
+                    results[i] = await self._process_or_raised(run, results[i])
+        return results
+
+    @staticmethod
+    async def _process_or_raised(chain: typing.Callable, obj: typing.Any) -> typing.Any:
+        try:
+            return await chain(obj)
+        except Exception as e:
+            return e
+
+
+class FanOutPipeline(Pipeline):
+    """Send every obj to independent terminal pipelines(eg: file, database and
+    print sinks) concurrently, so the latency is the slowest one`s, not the sum.
+
+    Branch errors are logged without affecting other branches, Dropped is raised
+    only if all branches drop the obj. Branches share the obj and should not
+    change it, their "executor" is ignored.
+    """
+
+    def __init__(self, *pipelines: Pipeline):
+        super().__init__()
+        self.pipelines = pipelines
+
+    async def _gather(self, method: str, *args: typing.Any) -> typing.List[typing.Any]:
+        return await asyncio.gather(
+            *(
+                run_cor_func(getattr(pipeline, method), *args)
+                for pipeline in self.pipelines
+            ),
+            return_exceptions=True,
+        )
+
+    def _log_errors(self, results: typing.List[typing.Any], method: str):
+        for pipeline, result in zip(self.pipelines, results):
+            if isinstance(result, Exception) and not isinstance(result, Dropped):
+                self.logger.error(
+                    f"{pipeline.__class__.__name__}.{method} failed: {result!r}"
+                )
+
+    async def on_spider_open(self):
+        self._log_errors(await self._gather("on_spider_open"), "on_spider_open")
+
+    async def on_spider_close(self):
+        self._log_errors(await self._gather("on_spider_close"), "on_spider_close")
+
+    async def process(self, obj: typing.Any) -> typing.Any:
+        results = await self._gather("process", obj)
+        if results and all(isinstance(result, Dropped) for result in results):
+            raise results[0]
+        self._log_errors(results, "process")
         return obj
 
 
@@ -44,17 +281,50 @@ class ResponseFilterErrorPipeline(Pipeline):
 
 # Request pipelines
 class RequestDuplicateFilterPipeline(Pipeline):
-    def __init__(self):
-        self.__request_urls = set()
+    """Drop requests with same fingerprint(method, canonical url and body),
+    fingerprints are kept in an exact set by default, use BloomFilter for huge crawls
+    or SqliteFilter to survive restarts. The default filter is replaced by a shared
+    one(redis or sqlite) when "SHARED_STATE" url is set. Requests with "dont_filter"
+    extension are passed without being added.
+    """
+
+    def __init__(self, fingerprint_filter: typing.Optional[Filter] = None):
+        self.default_filter = fingerprint_filter is None
+        self.fingerprint_filter = (
+            fingerprint_filter if fingerprint_filter is not None else MemoryFilter()
+        )
         super().__init__()
 
-    def process(self, obj: Request) -> Request:
-        if obj.url in self.__request_urls:
+    @property  # type: ignore
+    def awaitable(self) -> bool:  # type: ignore
+        return asyncio.iscoroutinefunction(self.fingerprint_filter.add)
+
+    def process(self, obj: Request) -> typing.Union[Request, typing.Awaitable[Request]]:
+        if obj.extensions.get("dont_filter"):
+            # awaitable when the filter is shared
+            return self._pass(obj) if self.awaitable else obj
+        added = self.fingerprint_filter.add(request_fingerprint(obj))
+        if asyncio.iscoroutine(added):
+            return self._check(added, obj)
+        return self._check_added(added, obj)
+
+    @staticmethod
+    async def _pass(obj: Request) -> Request:
+        return obj
+
+    async def _check(self, added: typing.Awaitable[bool], obj: Request) -> Request:
+        return self._check_added(await added, obj)
+
+    @staticmethod
+    def _check_added(added: bool, obj: Request) -> Request:
+        if not added:
             raise Dropped("Request duplicate!")
         else:
-            self.__request_urls.add(obj.url)
             return obj
 
+    def on_spider_close(self) -> typing.Optional[typing.Awaitable]:
+        return self.fingerprint_filter.close()  # awaitable for shared filters
+
 
 class RequestUserAgentPipeline(Pipeline):
     user_agent = (
@@ -181,6 +451,328 @@ class RequestRandomMobileUserAgentPipeline(Pipeline):
     }
 
 
+# Request and response pipelines
+class HttpCachePipeline(Pipeline):
+    """Cache responses on disk, put the same pipeline obj in both request and
+    response pipelines.
+
+    Fresh(younger than "ttl") responses are returned by request pipelines without
+    sending, stale ones are revalidated by "If-None-Match" and "If-Modified-Since"
+    headers and a 304 response is replaced by the cached response.
+    Entries older than "max_age" are removed and the oldest are removed when the
+    total size is bigger than "max_size" during opening and closing.
+    """
+
+    DROPPED_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+    def __init__(
+        self,
+        cache_dir: str = ".http_cache",
+        ttl: float = 3600,
+        max_age: float = 7 * 24 * 3600,
+        max_size: int = 1024 * 1024 * 1024,
+        methods: typing.Container[str] = ("GET", "HEAD"),
+        statuses: typing.Container[int] = (200, 203, 300, 301, 308, 404, 410),
+    ):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.methods = methods
+        self.statuses = statuses
+
+    def _get_path(self, request: Request) -> str:
+        key = request_fingerprint(request).hex()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    async def _load(
+        self, path: str
+    ) -> typing.Tuple[typing.Optional[typing.Dict], typing.Optional[bytes]]:
+        try:
+            async with aiofiles.open(path + ".json") as f:  # type: ignore
+                meta = ujson.loads(await f.read())
+            async with aiofiles.open(path + ".body", "rb") as f:  # type: ignore
+                body = await f.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, body
+
+    async def _save(self, path: str, meta: typing.Dict, body: typing.Optional[bytes]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if body is not None:
+            async with aiofiles.open(path + ".body.tmp", "wb") as f:  # type: ignore
+                await f.write(body)
+            os.replace(path + ".body.tmp", path + ".body")
+        async with aiofiles.open(path + ".json.tmp", "w") as f:  # type: ignore
+            await f.write(ujson.dumps(meta))
+        os.replace(path + ".json.tmp", path + ".json")
+
+    def _build_response(
+        self, request: Request, meta: typing.Dict, body: bytes
+    ) -> Response:
+        return Response(
+            meta["status_code"],
+            headers=meta["headers"],
+            content=body,
+            request=request,
+            extensions={"from_cache": True},
+        )
+
+    async def process(
+        self, obj: typing.Union[Request, Response]
+    ) -> typing.Union[Request, Response]:
+        if isinstance(obj, Request):
+            return await self.process_request(obj)
+        else:
+            return await self.process_response(obj)
+
+    async def process_request(self, obj: Request) -> typing.Union[Request, Response]:
+        if obj.method not in self.methods:
+            return obj
+        meta, body = await self._load(self._get_path(obj))
+        if meta is None or body is None:
+            return obj
+
+        if time.time() - meta["stored_at"] < self.ttl:
+            return self._build_response(obj, meta, body)
+        headers = dict(meta["headers"])
+        if "etag" in headers:
+            obj.headers["If-None-Match"] = headers["etag"]
+        if "last-modified" in headers:
+            obj.headers["If-Modified-Since"] = headers["last-modified"]
+        return obj
+
+    async def process_response(self, obj: Response) -> Response:
+        if obj.extensions.get("from_cache") or obj.request.method not in self.methods:
+            return obj
+
+        path = self._get_path(obj.request)
+        if obj.status_code == 304:
+            meta, body = await self._load(path)
+            if meta is None or body is None:
+                return obj
+            headers = dict(meta["headers"])
+            headers.update(
+                (k, v) for k, v in obj.headers.items() if k not in self.DROPPED_HEADERS
+            )
+            meta["headers"] = list(headers.items())
+            meta["stored_at"] = time.time()
+            await self._save(path, meta, None)
+            return self._build_response(obj.request, meta, body)
+        elif obj.status_code in self.statuses:
+            if "no-store" in obj.headers.get("cache-control", ""):
+                return obj
+            try:
+                body = obj.content
+            except ResponseNotRead:  # in streaming
+                return obj
+            meta = {
+                "url": str(obj.request.url),
+                "status_code": obj.status_code,
+                "headers": [
+                    (k, v)
+                    for k, v in obj.headers.items()
+                    if k not in self.DROPPED_HEADERS
+                ],
+                "stored_at": time.time(),
+            }
+            await self._save(path, meta, body)
+        return obj
+
+    def evict(self):
+        """Remove entries by age and size"""
+        entries = []
+        now = time.time()
+        for directory, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, file_name[: -len(".json")])
+                try:
+                    stat = os.stat(path + ".json")
+                    size = stat.st_size + os.stat(path + ".body").st_size
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, size, path))
+
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total_size <= self.max_size:
+                break
+            for suffix in (".json", ".body"):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def on_spider_open(self):
+        self.evict()
+
+    def on_spider_close(self):
+        self.evict()
+
+
+class ContentStorePipeline(Pipeline):
+    """Store response bodies once by their digest(content addressed), put the same
+    pipeline obj in both request and response pipelines.
+
+    Bodies of GET responses(with status 200 and content type starts with one of
+    "content_types") are hashed while writing to "store_dir/<digest[:2]>/<digest>",
+    identical bodies of different urls are stored once. Urls are indexed with their
+    digests, requests of indexed urls are responded by the stored bodies without
+    sending. Responses have "store_path" and "digest" extensions, streaming
+    responses are replaced by ones streaming from the stored file.
+    """
+
+    def __init__(
+        self,
+        store_dir: str = ".content_store",
+        algorithm: str = "sha256",
+        content_types: typing.Optional[typing.Sequence[str]] = None,
+        buffer_size: int = 64 * 1024,
+    ):
+        super().__init__()
+        self.store_dir = store_dir
+        self.algorithm = algorithm
+        self.content_types = tuple(content_types) if content_types else None
+        self.buffer_size = buffer_size
+        self._connection: typing.Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.store_dir, "index.sqlite"), isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls "
+                "(url TEXT PRIMARY KEY, digest TEXT NOT NULL, content_type TEXT)"
+            )
+        return self._connection
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self.store_dir, digest[:2], digest)
+
+    def _build_response(
+        self,
+        request: Request,
+        digest: str,
+        content_type: typing.Optional[str],
+        from_store: bool = False,
+    ) -> Response:
+        path = self.get_path(digest)
+        headers = {"content-length": str(os.path.getsize(path))}
+        if content_type:
+            headers["content-type"] = content_type
+
+        async def read_chunks() -> typing.AsyncIterator[bytes]:
+            async with aiofiles.open(path, "rb") as f:  # type: ignore
+                while True:
+                    chunk = await f.read(self.buffer_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        extensions: typing.Dict[str, typing.Any] = {
+            "store_path": path,
+            "digest": digest,
+        }
+        if from_store:
+            extensions = {**extensions, "from_store": True}
+        return Response(
+            200,
+            headers=headers,
+            content=read_chunks(),
+            request=request,
+            extensions=extensions,
+        )
+
+    async def process(
+        self, obj: typing.Union[Request, Response]
+    ) -> typing.Union[Request, Response]:
+        if isinstance(obj, Request):
+            return self.process_request(obj)
+        else:
+            return await self.process_response(obj)
+
+    def process_request(self, obj: Request) -> typing.Union[Request, Response]:
+        if obj.method != "GET" or "range" in obj.headers:
+            return obj
+        row = self.connection.execute(
+            "SELECT digest, content_type FROM urls WHERE url = ?",
+            (canonicalize_url(obj.url),),
+        ).fetchone()
+        if row is None or not os.path.exists(self.get_path(row[0])):
+            return obj
+        return self._build_response(obj, row[0], row[1], from_store=True)
+
+    async def process_response(self, obj: Response) -> Response:
+        content_type = obj.headers.get("content-type")
+        if (
+            obj.extensions.get("from_store")
+            or obj.request.method != "GET"
+            or obj.status_code != 200
+            or (
+                self.content_types is not None
+                and not (content_type or "").startswith(self.content_types)
+            )
+        ):
+            return obj
+
+        digest = hashlib.new(self.algorithm)
+        os.makedirs(self.store_dir, exist_ok=True)
+        temp_path = os.path.join(self.store_dir, f"{os.getpid()}.{id(obj)}.tmp")
+        try:
+            body: typing.Optional[bytes] = obj.content
+        except ResponseNotRead:  # hash and write in streaming
+            body = None
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:  # type: ignore
+                if body is not None:
+                    digest.update(body)
+                    await f.write(body)
+                else:
+                    try:
+                        async for chunk in obj.aiter_bytes(self.buffer_size):
+                            digest.update(chunk)
+                            await f.write(chunk)
+                    finally:
+                        await obj.aclose()
+            path = self.get_path(digest.hexdigest())
+            if os.path.exists(path):  # stored once
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO urls VALUES (?, ?, ?)",
+            (canonicalize_url(obj.request.url), digest.hexdigest(), content_type),
+        )
+        if body is None:
+            return self._build_response(obj.request, digest.hexdigest(), content_type)
+        obj.extensions = {
+            **obj.extensions,
+            "store_path": path,
+            "digest": digest.hexdigest(),
+        }
+        return obj
+
+    def on_spider_close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
 # Item pipelines
 class ItemPrintPipeline(Pipeline):
     def process(self, obj: Item) -> Item:
@@ -212,11 +804,21 @@ class ItemFieldReplacePipeline(Pipeline):
 class ItemBaseFileDumpPipeline(Pipeline):
     @classmethod
     async def dump(
-        cls, file_path: str, data: typing.Any, buffer_size: int = 1024 * 1024
+        cls,
+        file_path: str,
+        data: typing.Any,
+        buffer_size: int = 1024 * 1024,
+        append: bool = False,
     ):
         """Dump data(binary or text, stream or normal, async or not) to disk file.
-        typing.IO data will be closed.
+        typing.IO data and streaming responses will be closed.
         """
+        if isinstance(data, Response) or (
+            hasattr(data, "__aiter__") and not hasattr(data, "read")
+        ):
+            await cls._dump_async_iterable(file_path, data, buffer_size, append)
+            return
+
         chunk = None
         if isinstance(data, str):
             file_mode = "w"
@@ -234,6 +836,9 @@ class ItemBaseFileDumpPipeline(Pipeline):
                 "The type {:s} is not supported".format(type(data).__class__.__name__)
             )
 
+        if append:
+            file_mode = file_mode.replace("w", "a")
+
         async with aiofiles.open(file_path, file_mode) as file:  # type: ignore
             if chunk is not None:  # in streaming
                 await file.write(chunk)
@@ -249,6 +854,25 @@ class ItemBaseFileDumpPipeline(Pipeline):
             else:
                 await file.write(data)
 
+    @staticmethod
+    async def _dump_async_iterable(
+        file_path: str, data: typing.Any, buffer_size: int, append: bool
+    ):
+        """Dump binary chunks of one async iterable or streaming response"""
+        if isinstance(data, Response):
+            chunks = data.aiter_bytes(buffer_size)
+        else:
+            chunks = data
+        try:
+            async with aiofiles.open(
+                file_path, "ab" if append else "wb"
+            ) as file:  # type: ignore
+                async for chunk in chunks:
+                    await file.write(chunk)
+        finally:
+            if isinstance(data, Response):
+                await data.aclose()
+
 
 class ItemJsonDumpPipeline(ItemBaseFileDumpPipeline):
     """Dump item to json during pipeline closing"""
@@ -271,4 +895,380 @@ class ItemJsonDumpPipeline(ItemBaseFileDumpPipeline):
             await self.dump(os.path.join(self.file_dir, file_name + ".json"), data)
 
 
+class ItemJsonLinesDumpPipeline(ItemBaseFileDumpPipeline):
+    """Dump items to JSON Lines files(one file per item class) in streaming
+
+    Items are buffered and appended to files when the buffer is full or every
+    "flush_interval" seconds, files can be compressed("gzip" or "zstd") and
+    rotated when bigger than "max_file_size".
+    """
+
+    EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(
+        self,
+        *,
+        to_dict: typing.Callable[[Item], typing.Dict],
+        file_dir: str = ".",
+        buffer_size: int = 1024 * 1024,
+        flush_interval: float = 1,
+        compression: typing.Optional[str] = None,
+        max_file_size: typing.Optional[int] = None,
+    ):
+        if compression not in self.EXTENSIONS:
+            raise ValueError(
+                "The compression {:s} is not supported!".format(str(compression))
+            )
+        super().__init__()
+        self.to_dict = to_dict
+        self.file_dir = file_dir
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.max_file_size = max_file_size
+        self.buffers: typing.DefaultDict[str, typing.List[str]] = defaultdict(list)
+        self.buffer_sizes: typing.DefaultDict[str, int] = defaultdict(int)
+        self.file_indexes: typing.DefaultDict[str, int] = defaultdict(int)
+        self.file_sizes: typing.DefaultDict[str, int] = defaultdict(int)
+        self._lock: typing.Optional[asyncio.Lock] = None
+        self._flush_task: typing.Optional[asyncio.Future] = None
+
+    def get_file_path(self, name: str) -> str:
+        if self.max_file_size is not None:
+            name += "." + str(self.file_indexes[name])
+        return os.path.join(
+            self.file_dir, name + ".jsonl" + self.EXTENSIONS[self.compression]
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        # compressed chunks are appended as independent gzip members or zstd frames
+        if self.compression == "gzip":
+            return gzip.compress(data)
+        elif self.compression == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor().compress(data)
+        else:
+            return data
+
+    async def flush(self, name: str):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            lines = self.buffers.pop(name, None)
+            self.buffer_sizes.pop(name, None)
+            if not lines:
+                return
+            data = self.compress("".join(lines).encode())
+            await self.dump(self.get_file_path(name), data, append=True)
+            self.file_sizes[name] += len(data)
+            if (
+                self.max_file_size is not None
+                and self.file_sizes[name] >= self.max_file_size
+            ):
+                self.file_indexes[name] += 1
+                self.file_sizes[name] = 0
+
+    async def flush_all(self):
+        for name in list(self.buffers.keys()):
+            await self.flush(name)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # not interrupted by closing
+            await asyncio.shield(self.flush_all())
+
+    async def process(self, obj: Item) -> Item:
+        name = obj.__class__.__name__
+        line = ujson.dumps(self.to_dict(obj)) + "\n"
+        self.buffers[name].append(line)
+        self.buffer_sizes[name] += len(line)
+        if self.buffer_sizes[name] >= self.buffer_size:
+            await self.flush(name)
+        return obj
+
+    def on_spider_open(self):
+        self._flush_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def on_spider_close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush_all()
+
+
+class ItemColumnarDumpPipeline(ItemBaseFileDumpPipeline):
+    """Dump items to columnar files(one file per item class): "csv" or "parquet"
+    (requires pyarrow), files of earlier runs are overwritten.
+
+    Items are kept in column buffers, then written as one row group(or csv rows)
+    when "row_group_size" items are buffered. Columns come from the first
+    "to_dict" output, unknown fields are ignored and missing ones are null.
+    Parquet column types are given by "schemas"(item class name -> column name ->
+    pyarrow type) or inferred from the first row group, columns null in all its
+    rows are strings. Buffered rows are kept when writing fails.
+    """
+
+    FORMATS = ("csv", "parquet")
+
+    def __init__(
+        self,
+        *,
+        to_dict: typing.Callable[[Item], typing.Dict],
+        file_dir: str = ".",
+        format: str = "csv",
+        row_group_size: int = 10000,
+        compression: str = "snappy",
+        schemas: typing.Optional[typing.Dict[str, typing.Dict[str, typing.Any]]] = None,
+    ):
+        if format not in self.FORMATS:
+            raise ValueError("The format {:s} is not supported!".format(str(format)))
+        if format == "parquet":
+            import pyarrow  # noqa, fail early without pyarrow
+        super().__init__()
+        self.to_dict = to_dict
+        self.file_dir = file_dir
+        self.format = format
+        self.row_group_size = row_group_size
+        self.compression = compression  # for parquet
+        self.schemas = dict(schemas or {})  # for parquet
+        self.columns: typing.Dict[str, typing.Dict[str, typing.List]] = {}
+        self.row_counts: typing.DefaultDict[str, int] = defaultdict(int)
+        self._writers: typing.Dict[str, typing.Any] = {}  # parquet writers
+        self._csv_files: typing.Set[str] = set()  # csv files opened by this pipeline
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+    def get_file_path(self, name: str) -> str:
+        return os.path.join(self.file_dir, name + "." + self.format)
+
+    @staticmethod
+    def _to_csv(columns: typing.Dict[str, typing.List], header: bool) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if header:
+            writer.writerow(columns.keys())
+        writer.writerows(zip(*columns.values()))
+        return output.getvalue()
+
+    def _write_parquet(self, name: str, columns: typing.Dict[str, typing.List]):
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table(columns)
+        writer = self._writers.get(name)
+        if writer is None:
+            declared = self.schemas.get(name, {})
+            schema = pyarrow.schema(
+                [
+                    pyarrow.field(field.name, declared[field.name])
+                    if field.name in declared
+                    else pyarrow.field(field.name, pyarrow.string())
+                    if pyarrow.types.is_null(field.type)
+                    else field
+                    for field in table.schema
+                ]
+            )
+            table = table.cast(schema)
+            writer = self._writers[name] = pyarrow.parquet.ParquetWriter(
+                self.get_file_path(name), schema, compression=self.compression
+            )
+        else:  # eg: null columns of this group
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+
+    async def flush(self, name: str):
+        columns = self.columns.get(name)
+        count = self.row_counts.pop(name, 0)
+        if not count or columns is None:
+            return
+        self.columns[name] = {column: [] for column in columns}
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:  # keep row groups in order
+            try:
+                if self.format == "csv":
+                    header = name not in self._csv_files
+                    await self.dump(
+                        self.get_file_path(name),
+                        self._to_csv(columns, header),
+                        append=not header,
+                    )
+                    self._csv_files.add(name)
+                else:  # encoding and compressing are CPU heavy
+                    await asyncio.get_event_loop().run_in_executor(
+                        None, self._write_parquet, name, columns
+                    )
+            except Exception:
+                # put rows back before the ones buffered while writing
+                for column, values in self.columns[name].items():
+                    values[:0] = columns[column]
+                self.row_counts[name] += count
+                raise
+
+    async def flush_all(self):
+        for name in list(self.columns.keys()):
+            await self.flush(name)
+
+    async def process(self, obj: Item) -> Item:
+        name = obj.__class__.__name__
+        data = self.to_dict(obj)
+        columns = self.columns.get(name)
+        if columns is None:
+            columns = self.columns[name] = {column: [] for column in data}
+        for column, values in columns.items():
+            values.append(data.get(column))
+        self.row_counts[name] += 1
+        if self.row_counts[name] >= self.row_group_size:
+            await self.flush(name)
+        return obj
+
+    async def on_spider_close(self):
+        await self.flush_all()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+class ItemSqliteDumpPipeline(Pipeline):
+    """Dump items to one sqlite file(WAL mode), one table per item class.
+
+    Table columns are given by "schemas"(table name -> column name -> sqlite type)
+    or inferred from the first item, unknown fields are ignored. Items are written
+    in "executemany" transactions by batch(see "process_batch") or every
+    "batch_size" items, in a dedicated thread. With "key", items with the same key
+    field are upserted.
+    """
+
+    TYPES = ((bool, "INTEGER"), (int, "INTEGER"), (float, "REAL"), (bytes, "BLOB"))
+
+    def __init__(
+        self,
+        *,
+        to_dict: typing.Callable[[Item], typing.Dict],
+        file_path: str = "items.sqlite",
+        schemas: typing.Optional[typing.Dict[str, typing.Dict[str, str]]] = None,
+        key: typing.Optional[str] = None,
+        batch_size: int = 1000,
+    ):
+        super().__init__()
+        self.to_dict = to_dict
+        self.file_path = file_path
+        self.schemas = dict(schemas or {})
+        self.key = key
+        self.batch_size = batch_size
+        self.buffers: typing.DefaultDict[str, typing.List[typing.Dict]] = defaultdict(
+            list
+        )
+        self._statements: typing.Dict[str, str] = {}
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    @classmethod
+    def infer_schema(cls, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, str]:
+        """Get sqlite column types by values, lists and dicts are stored as json"""
+        schema = {}
+        for name, value in data.items():
+            for value_type, column_type in cls.TYPES:
+                if isinstance(value, value_type):
+                    schema[name] = column_type
+                    break
+            else:
+                schema[name] = "TEXT"
+        return schema
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.file_path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        return self._connection
+
+    def _prepare(self, table: str, schema: typing.Dict[str, str]) -> str:
+        """Create the table and get the insert statement"""
+        connection = self._connect()
+        columns = [self._quote(name) for name in schema]
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._quote(table)} ("
+            + ", ".join(f"{c} {t}" for c, t in zip(columns, schema.values()))
+            + ")"
+        )
+        statement = (
+            f"INSERT INTO {self._quote(table)} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+        if self.key is not None:
+            key = self._quote(self.key)
+            connection.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {self._quote(table + '_key')} "
+                f"ON {self._quote(table)} ({key})"
+            )
+            updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != key)
+            statement += f" ON CONFLICT ({key}) DO " + (
+                f"UPDATE SET {updates}" if updates else "NOTHING"
+            )
+        connection.commit()
+        return statement
+
+    def _write(self, table: str, rows: typing.List[typing.Dict]):
+        """Write rows in one transaction, run in the dedicated thread"""
+        if table not in self._statements:
+            schema = self.schemas.setdefault(table, self.infer_schema(rows[0]))
+            self._statements[table] = self._prepare(table, schema)
+        schema = self.schemas[table]
+        values = []
+        for row in rows:
+            value = []
+            for name in schema:
+                field = row.get(name)
+                if isinstance(field, (dict, list, tuple)):
+                    field = ujson.dumps(field)
+                value.append(field)
+            values.append(value)
+        connection = self._connect()
+        with connection:
+            connection.executemany(self._statements[table], values)
+
+    async def _run(self, func: typing.Callable, *args: typing.Any) -> typing.Any:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="SqliteDump")
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    async def flush(self, table: str):
+        rows = self.buffers.pop(table, None)
+        if rows:
+            await self._run(self._write, table, rows)
+
+    async def flush_all(self):
+        for table in list(self.buffers.keys()):
+            await self.flush(table)
+
+    async def process(self, obj: Item) -> Item:
+        table = obj.__class__.__name__
+        self.buffers[table].append(self.to_dict(obj))
+        if len(self.buffers[table]) >= self.batch_size:
+            await self.flush(table)
+        return obj
+
+    async def process_batch(self, objs: typing.List[Item]) -> typing.List[Item]:
+        for obj in objs:
+            self.buffers[obj.__class__.__name__].append(self.to_dict(obj))
+        await self.flush_all()
+        return objs
+
+    async def on_spider_close(self):
+        await self.flush_all()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 __all__ = [var for var in vars().keys() if "Pipeline" in var]
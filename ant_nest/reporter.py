@@ -2,6 +2,12 @@ import typing
 from collections import defaultdict
 import logging
 import asyncio
+import bisect
+import os
+import time
+
+import httpx
+import ujson
 
 
 class Record:
@@ -10,36 +16,350 @@ class Record:
         self.count = 0
         self.dropped_last_count = 0
         self.dropped_count = 0
+        self.retried_count = 0
 
-    def add(self, dropped: bool):
-        if dropped:
+    def add(self, dropped: bool, retried: bool = False):
+        if retried:
+            self.retried_count += 1
+        elif dropped:
             self.dropped_count += 1
         else:
             self.count += 1
 
 
+class Histogram:
+    """Histogram with fixed buckets(upper bounds in seconds), the last count is for
+    values above all bounds.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets: typing.Sequence[float] = BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate the quantile by linear interpolation in its bucket"""
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):  # above all bounds
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+# metric families in Prometheus text format and their types
+PROMETHEUS_FAMILIES = {
+    "ant_nest_objects_total": "counter",
+    "ant_nest_bytes_total": "counter",
+    "ant_nest_responses_total": "counter",
+    "ant_nest_latency_seconds": "histogram",
+}
+
+
+def _escape(value: typing.Any) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """Call "on_close" after the wrapped stream is closed, eg: fully read"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: typing.Callable):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self) -> typing.AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
+
+
+def render_prometheus(reporters: typing.Iterable["Reporter"]) -> str:
+    """Render metrics of reporters, every family is written once with samples of
+    all reporters(labeled by ant name) under it, as Prometheus requires.
+    """
+    samples: typing.Dict[str, typing.List[str]] = {
+        name: [] for name in PROMETHEUS_FAMILIES
+    }
+    for reporter in reporters:
+        for name, lines in reporter.prometheus_samples().items():
+            samples[name] += lines
+    lines = []
+    for name, metric_type in PROMETHEUS_FAMILIES.items():
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines += samples[name]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serve metrics of all reporters in Prometheus text format over http,
+    reporters with the same address share one server.
+    """
+
+    _servers: typing.Dict[typing.Tuple[str, int], "MetricsServer"] = {}
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reporters: typing.List["Reporter"] = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+        self._start_task = asyncio.ensure_future(self._start())
+
+    @classmethod
+    def register(cls, reporter: "Reporter", host: str, port: int) -> "MetricsServer":
+        if (host, port) not in cls._servers:
+            cls._servers[(host, port)] = cls(host, port)
+        server = cls._servers[(host, port)]
+        server.reporters.append(reporter)
+        return server
+
+    def unregister(self, reporter: "Reporter"):
+        self.reporters.remove(reporter)
+        if not self.reporters:
+            self._servers.pop((self.host, self.port), None)
+            self._start_task.cancel()
+            if self._server is not None:
+                self._server.close()
+
+    async def _start(self):
+        try:
+            self._server = await asyncio.start_server(
+                self._handle, self.host, self.port
+            )
+        except OSError as e:
+            self.logger.warning(f"Can`t serve metrics on {self.host}:{self.port}: {e}")
+        else:
+            self.logger.info(f"Serve metrics on http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+                status = "200 OK"
+                body = render_prometheus(self.reporters).encode()
+            else:
+                status = "404 Not Found"
+                body = b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
 class Reporter:
-    def __init__(self, slot: float = 60):
+    """Count objects by class name, response statuses per host and transferred
+    bytes, record latency histograms by stage(eg: "send").
+
+    Metrics can be served in Prometheus text format on "prometheus_port" and dumped
+    as json to "snapshot_file"(formatted with ant name and pid) every slot.
+    """
+
+    def __init__(
+        self,
+        slot: float = 60,
+        name: str = "",
+        prometheus_host: str = "127.0.0.1",
+        prometheus_port: typing.Optional[int] = None,
+        snapshot_file: typing.Optional[str] = None,
+    ):
+        self.name = name
         self._records: typing.DefaultDict[str, Record] = defaultdict(Record)
+        self.histograms: typing.DefaultDict[str, Histogram] = defaultdict(Histogram)
+        self.statuses: typing.DefaultDict[typing.Tuple[str, int], int] = defaultdict(
+            int
+        )
+        self.bytes_in = 0
+        self.bytes_out = 0
         self._slot = slot  # report once after one minute by default
         self._log_task = asyncio.ensure_future(self._log())
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.snapshot_file = (
+            snapshot_file.format(name=name, pid=os.getpid()) if snapshot_file else None
+        )
+        self._metrics_server = (
+            MetricsServer.register(self, prometheus_host, prometheus_port)
+            if prometheus_port is not None
+            else None
+        )
+
+    def report(self, obj: typing.Any, dropped: bool = False, retried: bool = False):
+        self._records[obj.__class__.__name__].add(dropped, retried=retried)
+
+    def report_response(self, response: httpx.Response):
+        """Count status by host and transferred bytes of one sent response,
+        bodies of streaming responses are counted when they are closed.
+        """
+        request = response.request
+        self.statuses[(request.url.host, response.status_code)] += 1
+        self.bytes_out += int(request.headers.get("content-length", 0))
+        if response.is_closed or not isinstance(response.stream, httpx.AsyncByteStream):
+            self.bytes_in += response.num_bytes_downloaded
+        else:
+            response.stream = _CountedStream(
+                response.stream, lambda: self._add_bytes_in(response)
+            )
 
-    def report(self, obj: typing.Any, dropped: bool = False):
-        self._records[obj.__class__.__name__].add(dropped)
+    def _add_bytes_in(self, response: httpx.Response):
+        self.bytes_in += response.num_bytes_downloaded
+
+    def observe(
+        self,
+        stage: str,
+        seconds: float,
+        buckets: typing.Optional[typing.Sequence[float]] = None,
+    ):
+        """Observe latency of the stage, "buckets" is used by its first observing"""
+        if buckets is not None and stage not in self.histograms:
+            self.histograms[stage] = Histogram(buckets)
+        self.histograms[stage].observe(seconds)
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Get total counts of all records, eg: send them to the main process"""
+        return {
+            name: {
+                "count": record.count,
+                "dropped_count": record.dropped_count,
+                "retried_count": record.retried_count,
+            }
+            for name, record in self._records.items()
+        }
+
+    def metrics(self) -> typing.Dict[str, typing.Any]:
+        """Get all metrics as a json serializable dict"""
+        statuses: typing.DefaultDict[str, typing.Dict[str, int]] = defaultdict(dict)
+        for (host, status), count in self.statuses.items():
+            statuses[host][str(status)] = count
+        return {
+            "name": self.name,
+            "time": time.time(),
+            "records": self.snapshot(),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "statuses": statuses,
+            "histograms": {
+                stage: histogram.snapshot()
+                for stage, histogram in self.histograms.items()
+            },
+        }
+
+    def prometheus_samples(self) -> typing.Dict[str, typing.List[str]]:
+        """Get sample lines of every metric family in Prometheus text format"""
+        ant = f'ant="{_escape(self.name)}"'
+        samples: typing.Dict[str, typing.List[str]] = {
+            name: [] for name in PROMETHEUS_FAMILIES
+        }
+        for name, record in self._records.items():
+            for state, count in (
+                ("ok", record.count),
+                ("dropped", record.dropped_count),
+                ("retried", record.retried_count),
+            ):
+                samples["ant_nest_objects_total"].append(
+                    f'ant_nest_objects_total{{{ant},type="{_escape(name)}",'
+                    f'state="{state}"}} {count}'
+                )
+        samples["ant_nest_bytes_total"] += [
+            f'ant_nest_bytes_total{{{ant},direction="in"}} {self.bytes_in}',
+            f'ant_nest_bytes_total{{{ant},direction="out"}} {self.bytes_out}',
+        ]
+        for (host, status), count in self.statuses.items():
+            samples["ant_nest_responses_total"].append(
+                f'ant_nest_responses_total{{{ant},host="{_escape(host)}",'
+                f'status="{status}"}} {count}'
+            )
+        lines = samples["ant_nest_latency_seconds"]
+        for stage, histogram in self.histograms.items():
+            labels = f'{ant},stage="{_escape(stage)}"'
+            cumulative = 0
+            for bound, count in zip(
+                histogram.buckets + (float("inf"),), histogram.counts
+            ):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(
+                    f'ant_nest_latency_seconds_bucket{{{labels},le="{le}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"ant_nest_latency_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(
+                f"ant_nest_latency_seconds_count{{{labels}}} {histogram.count}"
+            )
+        return samples
+
+    def prometheus(self) -> str:
+        """Get all metrics in Prometheus text format"""
+        return render_prometheus([self])
+
+    def dump(self):
+        """Write metrics to the snapshot file atomically"""
+        if self.snapshot_file is None:
+            return
+        directory = os.path.dirname(self.snapshot_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = self.snapshot_file + ".tmp"
+        with open(temp_file, "w") as f:
+            ujson.dump(self.metrics(), f)
+        os.replace(temp_file, self.snapshot_file)
 
     def close(self):
         self._log_task.cancel()
+        if self._metrics_server is not None:
+            self._metrics_server.unregister(self)
+        self.dump()
         for name, record in self._records.items():
             self.logger.warning(f"Get {record.count} {name} in total")
             self.logger.warning(f"Drop {record.dropped_count} {name} in total")
+            if record.retried_count:
+                self.logger.warning(f"Retry {record.retried_count} {name} in total")
+        for stage, histogram in self.histograms.items():
+            self.logger.warning(
+                f"{stage} latency p50 {histogram.quantile(0.5):.3f}s "
+                f"p99 {histogram.quantile(0.99):.3f}s in {histogram.count} times"
+            )
 
     async def _log(self):
         while True:
             await asyncio.sleep(self._slot)
             for name, record in self._records.items():
                 count = record.count - record.last_count
-                dropped_count = record.dropped_count - record.last_count
+                dropped_count = record.dropped_count - record.dropped_last_count
                 record.last_count = record.count
                 record.dropped_last_count = record.dropped_count
                 self.logger.info(
@@ -48,3 +368,9 @@ class Reporter:
                 self.logger.info(
                     f"Drop {record.dropped_count} {name} in total with {dropped_count}/{self._slot} rate"
                 )
+            for stage, histogram in self.histograms.items():
+                self.logger.info(
+                    f"{stage} latency p50 {histogram.quantile(0.5):.3f}s "
+                    f"p99 {histogram.quantile(0.99):.3f}s in {histogram.count} times"
+                )
+            self.dump()
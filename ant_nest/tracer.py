@@ -0,0 +1,192 @@
+"""Request spans with phase timings, written as Chrome trace events"""
+import typing
+import contextlib
+import heapq
+import logging
+import os
+import random
+import time
+
+import ujson
+
+__all__ = ["Span", "Tracer", "trace_phase"]
+
+
+class Span:
+    """One "Ant.request" call, phases are recorded as nested events on its lane
+    (one row in trace viewers), "trace" is the httpcore "trace" extension.
+
+    Bodies of streaming responses are read after the span ends, their phases are
+    still recorded but may overlap later spans on the same lane.
+    """
+
+    # names of httpcore trace events, dns resolving is a part of "connect"
+    PHASES = {
+        "connection.connect_tcp": "connect",
+        "connection.connect_unix_socket": "connect",
+        "connection.start_tls": "tls",
+        "http11.send_request_headers": "send_headers",
+        "http11.send_request_body": "send_body",
+        "http11.receive_response_headers": "first_byte",
+        "http11.receive_response_body": "download",
+        "http2.send_request_headers": "send_headers",
+        "http2.send_request_body": "send_body",
+        "http2.receive_response_headers": "first_byte",
+        "http2.receive_response_body": "download",
+    }
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        lane: int,
+        args: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.lane = lane
+        self.args = dict(args or {})
+        self.start_time = time.perf_counter()
+        self.ended = False
+        self._started: typing.Dict[str, float] = {}
+
+    def add_phase(
+        self,
+        name: str,
+        start_time: float,
+        end_time: float,
+        args: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ):
+        self.tracer.add_event(name, "phase", start_time, end_time, self.lane, args)
+
+    async def trace(self, event_name: str, info: typing.Dict[str, typing.Any]):
+        name, _, state = event_name.rpartition(".")
+        now = time.perf_counter()
+        if state == "started":
+            self._started[name] = now
+        elif name in self._started:
+            args = None
+            if state == "failed":
+                args = {"error": repr(info.get("exception"))}
+            self.add_phase(
+                self.PHASES.get(name, name), self._started.pop(name), now, args
+            )
+
+    def end(self, **args: typing.Any):
+        if self.ended:
+            return
+        self.ended = True
+        self.args.update(args)
+        self.tracer.add_event(
+            self.name,
+            "request",
+            self.start_time,
+            time.perf_counter(),
+            self.lane,
+            self.args,
+        )
+        self.tracer.release_lane(self.lane)
+
+
+class Tracer:
+    """Write sampled spans to a Chrome trace file(JSON array format, can be opened
+    by chrome://tracing or Perfetto UI), events are buffered and appended every
+    "buffer_size" events, the file is loadable even without closing.
+
+    Concurrent spans are put on different lanes(thread ids), free lanes are
+    reused, so rows are as many as the max concurrency.
+    """
+
+    def __init__(
+        self, file_path: str, sample_rate: float = 1.0, buffer_size: int = 1000
+    ):
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._events: typing.List[typing.Dict[str, typing.Any]] = []
+        self._free_lanes: typing.List[int] = []
+        self._lane_count = 0
+        self._file: typing.Optional[typing.TextIO] = None
+        self._closed = False
+        self._pid = os.getpid()
+        # timestamps are wall clock based, so files of many processes can be merged
+        self._offset = time.time() - time.perf_counter()
+
+    def start_span(self, name: str, **args: typing.Any) -> typing.Optional[Span]:
+        """Start one span, return None when it`s not sampled"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        if self._free_lanes:
+            lane = heapq.heappop(self._free_lanes)
+        else:
+            lane = self._lane_count
+            self._lane_count += 1
+        return Span(self, name, lane, args)
+
+    def release_lane(self, lane: int):
+        heapq.heappush(self._free_lanes, lane)
+
+    def add_event(
+        self,
+        name: str,
+        category: str,
+        start_time: float,
+        end_time: float,
+        lane: int,
+        args: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ):
+        """Add one complete event, times are from "time.perf_counter"."""
+        if self._closed:  # eg: streaming bodies read after the ant closed
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start_time + self._offset) * 1e6, 3),
+            "dur": round((end_time - start_time) * 1e6, 3),
+            "pid": self._pid,
+            "tid": lane,
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+        if len(self._events) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._events:
+            return
+        if self._file is None:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.file_path, "w")
+            self._file.write("[\n")
+        else:
+            self._file.write(",\n")
+        self._file.write(",\n".join(ujson.dumps(event) for event in self._events))
+        self._file.flush()
+        self._events = []
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        if self._file is not None:
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+            self.logger.info(f"Write request trace to {self.file_path}")
+
+
+@contextlib.contextmanager
+def trace_phase(span: typing.Optional[Span], name: str, **args: typing.Any):
+    """Record the block as one phase of the span, do nothing without span"""
+    if span is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        span.add_phase(name, start_time, time.perf_counter(), args)
@@ -3,22 +3,187 @@ import asyncio
 import tempfile
 import os
 import webbrowser
+import hashlib
+import time
+import random
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
 from contextlib import contextmanager
 from logging import Logger
+from urllib.parse import parse_qsl, urlencode
 
-from tenacity import retry as _retry
-from tenacity.wait import wait_fixed
-from tenacity.stop import stop_after_attempt
+import httpx
 
 
-def retry(
-    retries: int, delay: float
-) -> typing.Callable[[typing.Callable], typing.Callable]:
-    return _retry(
-        wait=wait_fixed(delay), stop=stop_after_attempt(retries + 1), reraise=True
+class RetryBudget:
+    """Limit retries to "ratio" of requests(plus "min_retries") in every "window"
+    seconds, so a failing site can`t trigger a retry storm.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window: float = 60):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self.requests = 0
+        self.retries = 0
+        self._window_start = time.monotonic()
+
+    def _roll(self):
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self.requests = 0
+            self.retries = 0
+            self._window_start = now
+
+    def on_request(self):
+        self._roll()
+        self.requests += 1
+
+    def can_retry(self) -> bool:
+        self._roll()
+        return self.retries < self.min_retries + self.ratio * self.requests
+
+    def on_retry(self):
+        self.retries += 1
+
+
+class RetryPolicy:
+    """Retry on "exceptions" and responses with "statuses", wait by exponential
+    backoff with full jitter or the "Retry-After" header.
+
+    A response is returned without retrying when its "Retry-After" is longer than
+    "max_delay".
+    """
+
+    def __init__(
+        self,
+        retries: int = 0,
+        delay: float = 0.1,
+        max_delay: float = 10,
+        statuses: typing.Container[int] = (429, 500, 502, 503, 504),
+        exceptions: typing.Tuple[typing.Type[Exception], ...] = (httpx.TransportError,),
+        budget: typing.Optional[RetryBudget] = None,
+    ):
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+        self.exceptions = exceptions
+        self.budget = budget
+
+    def get_delay(
+        self, attempt: int, response: typing.Optional[httpx.Response] = None
+    ) -> float:
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.max_delay, self.delay * 2**attempt))
+
+    def _can_retry(self, attempt: int) -> bool:
+        return attempt < self.retries and (
+            self.budget is None or self.budget.can_retry()
+        )
+
+    def __call__(
+        self,
+        func: typing.Callable[..., typing.Awaitable[httpx.Response]],
+        on_retry: typing.Optional[typing.Callable[[int, float], typing.Any]] = None,
+    ) -> typing.Callable[..., typing.Awaitable[httpx.Response]]:
+        """Wrap one send function, "on_retry" is called with attempt and delay"""
+
+        async def wrapper(*args, **kwargs) -> httpx.Response:
+            if self.budget is not None:
+                self.budget.on_request()
+            attempt = 0
+            while True:
+                try:
+                    response = await func(*args, **kwargs)
+                except self.exceptions:
+                    if not self._can_retry(attempt):
+                        raise
+                    delay = self.get_delay(attempt)
+                else:
+                    if (
+                        response.status_code not in self.statuses
+                        or not self._can_retry(attempt)
+                    ):
+                        return response
+                    delay = self.get_delay(attempt, response)
+                    if delay > self.max_delay:
+                        return response
+                    await response.aclose()
+
+                attempt += 1
+                if self.budget is not None:
+                    self.budget.on_retry()
+                if on_retry is not None:
+                    on_retry(attempt, delay)
+                await asyncio.sleep(delay)
+
+        return wrapper
+
+
+def snapshot_response(response: httpx.Response) -> httpx.Response:
+    """Copy a read response without connection and other unpicklable states"""
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        content=response.content,
+        request=httpx.Request(
+            response.request.method,
+            response.request.url,
+            headers=response.request.headers,
+        ),
     )
 
 
+class OffloadExecutor:
+    """Run sync functions out of the event loop, in a thread pool(for lxml which
+    releases the GIL) or a process pool(for pure python work, functions and
+    arguments should be picklable, responses are sent as snapshots).
+
+    At most "queue_size" calls are submitted at the same time.
+    """
+
+    KINDS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: typing.Optional[int] = None,
+        queue_size: typing.Optional[int] = None,
+    ):
+        if kind not in self.KINDS:
+            raise ValueError("The executor {:s} is not supported!".format(kind))
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_size = queue_size or 2 * (max_workers or os.cpu_count() or 1)
+        self._executor: typing.Optional[Executor] = None
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+
+    async def run(self, func: typing.Callable, *args) -> typing.Any:
+        if self._executor is None:
+            self._executor = self.KINDS[self.kind](max_workers=self.max_workers)
+            self._semaphore = asyncio.Semaphore(self.queue_size)
+        if self.kind == "process":
+            args = tuple(
+                snapshot_response(arg) if isinstance(arg, httpx.Response) else arg
+                for arg in args
+            )
+
+        async with self._semaphore:  # type: ignore
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, functools.partial(func, *args)
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 async def run_cor_func(func: typing.Callable, *args, **kwargs) -> typing.Any:
     ret = func(*args, **kwargs)
     if asyncio.iscoroutine(ret):
@@ -27,6 +192,65 @@ async def run_cor_func(func: typing.Callable, *args, **kwargs) -> typing.Any:
     return ret
 
 
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url: typing.Union[str, httpx.URL]) -> str:
+    """Normalize url: lowercase scheme and host, drop default port and fragment,
+    sort query params, so same resources get same url string.
+    """
+    url = httpx.URL(url)
+    host = url.raw_host.decode("ascii")
+    if ":" in host:  # IPv6
+        host = f"[{host}]"
+    if url.port is not None and url.port != DEFAULT_PORTS.get(url.scheme):
+        host += f":{url.port}"
+    if url.userinfo:
+        host = url.userinfo.decode("ascii") + "@" + host
+    path = url.raw_path.split(b"?", 1)[0].decode("ascii") or "/"
+    query = urlencode(
+        sorted(parse_qsl(url.query.decode("ascii"), keep_blank_values=True))
+    )
+
+    return f"{url.scheme}://{host}{path}" + (f"?{query}" if query else "")
+
+
+def request_fingerprint(request: httpx.Request) -> bytes:
+    """Get fixed size(16 bytes) fingerprint by method, canonical url, range header
+    and body"""
+    fingerprint = hashlib.blake2b(digest_size=16)
+    fingerprint.update(request.method.encode("ascii"))
+    fingerprint.update(b" " + canonicalize_url(request.url).encode("ascii"))
+    if "range" in request.headers:  # chunks of one file
+        fingerprint.update(b"\nrange: " + request.headers["range"].encode("latin-1"))
+    try:
+        fingerprint.update(b"\n" + request.content)
+    except httpx.RequestNotRead:  # streaming body
+        pass
+
+    return fingerprint.digest()
+
+
+def host_hash(url: typing.Union[str, httpx.URL]) -> int:
+    """Stable(across processes and machines) 56 bits hash of url`s host"""
+    host = httpx.URL(url).raw_host
+    return int.from_bytes(hashlib.blake2b(host, digest_size=7).digest(), "big")
+
+
+def parse_retry_after(value: typing.Optional[str]) -> typing.Optional[float]:
+    """Get delay seconds from "Retry-After" header(seconds or http date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
 @contextmanager
 def suppress(logger: Logger):
     try:
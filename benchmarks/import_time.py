@@ -0,0 +1,75 @@
+"""Measure CLI startup time: importing ant_nest.cli and listing ants with a cold
+and a warm ant index.
+
+    python benchmarks/import_time.py [-n 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(args, cwd, repeat, setup=None):
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + args,
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            env=dict(os.environ, PYTHONPATH=ROOT, ANT_ENV="production"),
+        )
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as project:
+        with open(os.path.join(project, "settings.py"), "w") as f:
+            f.write(
+                "from ant_nest._settings_example import *\n"
+                "ANT_PACKAGES = ['ants']\n"
+                "ANT_INDEX_FILE = '.ant_index.json'\n"
+            )
+        os.mkdir(os.path.join(project, "ants"))
+        open(os.path.join(project, "ants", "__init__.py"), "w").close()
+        for i in range(20):
+            with open(os.path.join(project, "ants", f"ant{i}.py"), "w") as f:
+                f.write(f"from ant_nest.ant import Ant\n\nclass Ant{i}(Ant):\n")
+                f.write("    async def run(self):\n        pass\n")
+        index_file = os.path.join(project, ".ant_index.json")
+
+        def remove_index():
+            if os.path.exists(index_file):
+                os.remove(index_file)
+
+        cli = ["-c", "from ant_nest.cli import main; main()"]
+        results = {
+            "python startup": measure(["-c", "pass"], project, args.repeat),
+            "import ant_nest.cli": measure(
+                ["-c", "import ant_nest.cli"], project, args.repeat
+            ),
+            "ant_nest -v": measure(cli + ["-v"], project, args.repeat),
+            "ant_nest -l, cold index": measure(
+                cli + ["-l"], project, args.repeat, setup=remove_index
+            ),
+            "ant_nest -l, warm index": measure(cli + ["-l"], project, args.repeat),
+        }
+    for name, duration in results.items():
+        print(f"{name:<28}{duration * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
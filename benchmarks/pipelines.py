@@ -0,0 +1,79 @@
+"""Measure per obj overhead of request, response and item pipelines: the old
+"run_cor_func" loop against the compiled PipelineChain used by Ant._pipe.
+
+    python benchmarks/pipelines.py [-n 100000]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+
+from ant_nest import pipelines as pls
+from ant_nest.utils import run_cor_func
+
+logger = logging.getLogger("benchmark")
+
+
+class AsyncPipeline(pls.Pipeline):
+    async def process(self, obj):
+        return obj
+
+
+async def old_pipe(obj, pipelines):
+    logger.debug("Process obj: " + str(obj))
+    for pipeline in pipelines:
+        obj = await run_cor_func(pipeline.process, obj)
+    return obj
+
+
+async def compiled_pipe(obj, chain):
+    logger.debug("Process obj: %s", obj)
+    return await chain(obj)
+
+
+async def measure(func, obj, pipelines, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        await func(obj, pipelines)
+    return (time.perf_counter() - start) / number * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    request = httpx.Request("GET", "https://test.com")
+    response = httpx.Response(200, request=request, content=b"")
+    cases = {
+        "request": (
+            request,
+            [pls.RequestUserAgentPipeline(), pls.Pipeline(), AsyncPipeline()],
+        ),
+        "response": (
+            response,
+            [pls.ResponseFilterErrorPipeline(), pls.Pipeline(), pls.Pipeline()],
+        ),
+        "item": (
+            {"name": " ant "},
+            [
+                pls.ItemFieldReplacePipeline(["name"], excess_chars=(" ",)),
+                pls.Pipeline(),
+                AsyncPipeline(),
+                pls.Pipeline(),
+            ],
+        ),
+    }
+    print(f"{'pipelines':<12}{'old(us/obj)':>14}{'compiled(us/obj)':>18}")
+    for name, (obj, pipelines) in cases.items():
+        old = await measure(old_pipe, obj, pipelines, args.number)
+        compiled = await measure(
+            compiled_pipe, obj, pls.PipelineChain(pipelines), args.number
+        )
+        print(f"{name:<12}{old:>14.2f}{compiled:>18.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
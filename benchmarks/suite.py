@@ -0,0 +1,280 @@
+"""Benchmark suite: ants against a synthetic site served by httpx.MockTransport.
+
+Measure requests/sec, per obj pipeline overhead, extraction and dump throughput,
+end-to-end pages/sec at different pool limits and peak RSS, results are emitted
+as json to compare between commits:
+
+    python benchmarks/suite.py -o before.json
+    python benchmarks/suite.py -o after.json
+    python benchmarks/suite.py --compare before.json after.json
+"""
+import argparse
+import asyncio
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import ujson
+
+os.environ.setdefault("ANT_ENV", "production")  # no debug logging and asyncio
+
+import httpx  # noqa: E402
+from oxalis.pool import Pool  # noqa: E402
+
+from ant_nest import pipelines as pls  # noqa: E402
+from ant_nest.ant import Ant, CliAnt  # noqa: E402
+from ant_nest.items import Extractor  # noqa: E402
+
+
+class Site:
+    """Synthetic site: pages of "page_size" bytes, page i links to "links" pages
+    (i * links + j) % "pages", responses are delayed "latency" seconds.
+    """
+
+    def __init__(self, pages: int, page_size: int, links: int, latency: float):
+        self.pages = pages
+        self.links = links
+        self.latency = latency
+        self.page_size = page_size
+        self.requested = 0
+
+    def render(self, index: int) -> bytes:
+        links = "".join(
+            f'<a href="/page/{(index * self.links + j) % self.pages}">link</a>'
+            for j in range(1, self.links + 1)
+        )
+        body = f"<html><head><title>Page {index}</title></head><body>{links}"
+        text = "<p>ant nest</p>" * max(0, (self.page_size - len(body)) // 14)
+        return (body + text + "</body></html>").encode()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requested += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        index = int(request.url.path.rsplit("/", 1)[-1])
+        return httpx.Response(
+            200, content=self.render(index), headers={"content-type": "text/html"}
+        )
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=httpx.MockTransport(self.handle), base_url="http://site.test"
+        )
+
+
+async def bench_requests(site: Site, count: int) -> dict:
+    ant = CliAnt()
+    ant.client = site.client()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(ant.request(f"http://site.test/page/{i % site.pages}") for i in range(count))
+    )
+    duration = time.perf_counter() - start
+    await ant.close()
+    return {"requests_per_second": count / duration}
+
+
+async def bench_pipelines(count: int) -> dict:
+    ant = CliAnt()
+    request = httpx.Request("GET", "http://site.test/page/0")
+    response = httpx.Response(200, request=request, content=b"")
+    cases = {
+        "request": (
+            request,
+            [pls.RequestUserAgentPipeline(), pls.RequestDuplicateFilterPipeline()],
+        ),
+        "response": (response, [pls.ResponseFilterErrorPipeline(), pls.Pipeline()]),
+        "item": (
+            {"title": " ant "},
+            [pls.ItemFieldReplacePipeline(["title"], (" ",)), pls.Pipeline()],
+        ),
+    }
+    results = {}
+    for name, (obj, pipelines) in cases.items():
+        if name == "request":  # no duplicate
+            objs = [
+                httpx.Request("GET", f"http://site.test/page/{i}") for i in range(count)
+            ]
+        else:
+            objs = [obj] * count
+        start = time.perf_counter()
+        for obj in objs:
+            await ant._pipe(obj, pipelines)
+        results[f"{name}_us_per_obj"] = (time.perf_counter() - start) / count * 1e6
+    await ant.close()
+    return results
+
+
+async def bench_extraction(site: Site, count: int) -> dict:
+    ant = CliAnt()
+    response = httpx.Response(
+        200, request=httpx.Request("GET", "http://site.test/page/1"), content=b""
+    )
+    content = site.render(1)
+    extractor = Extractor(dict, parser="html")
+    extractor.add_xpath("title", "//title/text()")
+    extractor.add_xpath("links", "//a/@href", many=True)
+    start = time.perf_counter()
+    for _ in range(count):
+        response = httpx.Response(200, request=response.request, content=content)
+        await ant.extract(extractor, response)
+    duration = time.perf_counter() - start
+    await ant.close()
+    return {"pages_per_second": count / duration}
+
+
+async def bench_dump(count: int) -> dict:
+    items = [{"id": i, "title": f"Page {i}", "links": [i, i + 1]} for i in range(count)]
+    results = {}
+    with tempfile.TemporaryDirectory() as file_dir:
+        cases = {
+            "jsonl": pls.ItemJsonLinesDumpPipeline(
+                to_dict=lambda x: x, file_dir=file_dir
+            ),
+            "sqlite": pls.ItemSqliteDumpPipeline(
+                to_dict=lambda x: x, file_path=os.path.join(file_dir, "items.sqlite")
+            ),
+            "csv": pls.ItemColumnarDumpPipeline(to_dict=lambda x: x, file_dir=file_dir),
+        }
+        for name, pipeline in cases.items():
+            await pls.run_cor_func(pipeline.on_spider_open)
+            start = time.perf_counter()
+            for item in items:
+                await pipeline.process(item)
+            await pipeline.on_spider_close()
+            results[f"{name}_items_per_second"] = count / (time.perf_counter() - start)
+    return results
+
+
+class BenchAnt(Ant):
+    def __init__(self, site: Site):
+        super().__init__()
+        self.site = site
+        self.client = site.client()
+        self.extractor = Extractor(dict, parser="html")
+        self.extractor.add_xpath("title", "//title/text()")
+        self.link_extractor = Extractor(dict, parser="html")
+        self.link_extractor.add_xpath("links", "//a/@href", many=True)
+        self.seen: typing.Set[str] = set()
+        self.fetched = 0  # successful responses
+
+    async def run(self):
+        await self.schedule_once("http://site.test/page/0")
+
+    async def schedule_once(self, url: str):
+        # skip seen urls like crawlers do, instead of dropping duplicate requests
+        if url not in self.seen:
+            self.seen.add(url)
+            await self.schedule(self.crawl_page, url)
+
+    async def crawl_page(self, url: str):
+        response = await self.request(url)
+        if response.status_code == 200:
+            self.fetched += 1
+        await self.collect(await self.extract(self.extractor, response))
+        links = (await self.extract(self.link_extractor, response))["links"]
+        for link in links:
+            await self.schedule_once("http://site.test" + link)
+
+
+async def bench_crawl(site: Site, limit: int) -> dict:
+    ant = BenchAnt(site)
+    ant.request_pipelines = [pls.RequestDuplicateFilterPipeline()]
+    ant.pool = Pool(limit=limit)
+    site.requested = 0
+    start = time.perf_counter()
+    await ant.main()
+    duration = time.perf_counter() - start
+    return {"pages": ant.fetched, "pages_per_second": ant.fetched / duration}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(args: argparse.Namespace) -> dict:
+    site = Site(args.pages, args.page_size, args.links, args.latency)
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "time": time.time(),
+            "site": vars(args),
+        },
+        "requests": await bench_requests(site, args.number),
+        "pipelines": await bench_pipelines(args.number * 10),
+        "extraction": await bench_extraction(site, args.number),
+        "dump": await bench_dump(args.number * 10),
+        "crawl": {
+            f"limit_{limit}": await bench_crawl(site, limit) for limit in args.limits
+        },
+    }
+    # kilobytes on linux, bytes on macos
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        max_rss //= 1024
+    results["peak_rss_mb"] = max_rss / 1024
+    return results
+
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)):
+            values[prefix + key] = value
+    return values
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = flatten({k: v for k, v in ujson.load(f).items() if k != "meta"})
+    with open(new_path) as f:
+        new = flatten({k: v for k, v in ujson.load(f).items() if k != "meta"})
+    print(f"{'metric':<48}{'old':>14}{'new':>14}{'change':>10}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+        print(f"{key:<48}{old[key]:>14.2f}{new[key]:>14.2f}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=16 * 1024)
+    parser.add_argument("--links", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("-o", "--output", help="json file, stdout by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output = args.output
+    del args.output, args.compare
+    data = ujson.dumps(asyncio.run(run(args)), indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
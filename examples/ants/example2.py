@@ -1,5 +1,4 @@
 from bs4 import BeautifulSoup
-from lxml import html
 from ant_nest.ant import Ant
 from ant_nest.pipelines import ItemFieldReplacePipeline
 from ant_nest.items import Extractor
@@ -17,42 +16,27 @@ class GithubAnt(Ant):
 
     def __init__(self):
         super().__init__()
-        self.item_extractor = Extractor(dict)
-        self.item_extractor.add_extractor(
-            "title",
-            lambda x: html.fromstring(x.text).xpath("/html/body/div[4]/div/main/div/div[1]/div/div/strong/a/text()")[0],
+        self.item_extractor = Extractor(dict, parser="html")
+        self.item_extractor.add_xpath(
+            "title", "/html/body/div[4]/div/main/div/div[1]/div/div/strong/a/text()"
         )
-        self.item_extractor.add_extractor(
-            "author",
-            lambda x: html.fromstring(x.text).xpath("/html/body/div[4]/div/main/div/div[1]/div/div/span[1]/a/text()")[0],
+        self.item_extractor.add_xpath(
+            "author", "/html/body/div[4]/div/main/div/div[1]/div/div/span[1]/a/text()"
         )
-        self.item_extractor.add_extractor(
+        self.item_extractor.add_xpath(
             "meta_content",
-            lambda x: "".join(
-                html.fromstring(x.text).xpath(
-                    '/html/body/div[4]/div/main/turbo-frame/div/div/div/div[3]/div[2]/div/div[1]/div/p/text()'
-                )
-            ),
+            '/html/body/div[4]/div/main/turbo-frame/div/div/div/div[3]/div[2]/div/div[1]/div/p/text()',
+            many=True,
         )
-        self.item_extractor.add_extractor(
-            "star",
-            lambda x: html.fromstring(x.text).xpath(
-                '//span[@id="repo-stars-counter-star"]/text()'
-            )[0],
-        )
-        self.item_extractor.add_extractor(
-            "fork",
-            lambda x: html.fromstring(x.text).xpath(
-                '//span[@id="repo-network-counter"]/text()'
-            )[0],
-        )
-        self.item_extractor.add_extractor("origin_url", lambda x: str(x.url))
+        self.item_extractor.add_xpath("star", '//span[@id="repo-stars-counter-star"]/text()')
+        self.item_extractor.add_xpath("fork", '//span[@id="repo-network-counter"]/text()')
 
     async def crawl_repo(self, url):
         """Crawl information from one repo"""
         response = await self.request(url)
         # extract item from response
         item = self.item_extractor.extract(response)
+        item["meta_content"] = "".join(item["meta_content"])
         item["origin_url"] = response.url
 
         await self.collect(item)  # let item go through pipelines(be cleaned)
@@ -68,5 +52,5 @@ class GithubAnt(Ant):
         ):
             urls.add(response.url.join(node["href"]))
         for url in urls:
-            self.pool.spawn(self.crawl_repo(url))
+            await self.schedule(self.crawl_repo, url)
         self.logger.info("Waiting...")
@@ -8,6 +8,8 @@ from ant_nest.exceptions import ExceptionFilter
 
 # your ant`s class modules or packages
 ANT_PACKAGES = ["ants"]
+# cache ant names of modules here, so unchanged modules are not imported to find ants
+ANT_INDEX_FILE = ".ant_index.json"
 ANT_ENV = os.getenv("ANT_ENV", "development")
 
 
@@ -30,11 +32,18 @@ POOL_CONFIG = {
 REPORTER = {
     "slot": 60,
 }
+HOST_LIMIT = {
+    "concurrency": 2,
+    "rate": 1,
+}
 
 
 # ANT config
 HTTP_RETRIES = 3
 HTTP_RETRY_DELAY = 1
+HTTP_RETRY_MAX_DELAY = 10
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_RETRY_BUDGET = 0.2
 
 # logger config
 logging.basicConfig(level=logging.INFO)
@@ -1,11 +1,23 @@
 import asyncio
 import os
+import pickle
+import tempfile
+import threading
 
 import pytest
 import httpx
 
-from ant_nest.pipelines import Pipeline
-from ant_nest.ant import CliAnt, Ant
+from ant_nest.pipelines import (
+    Pipeline,
+    HttpCachePipeline,
+    ContentStorePipeline,
+    RequestDuplicateFilterPipeline,
+    RequestUserAgentPipeline,
+)
+from ant_nest.ant import CliAnt, Ant, settings
+from ant_nest.frontier import SqliteFrontier
+from ant_nest.exceptions import Dropped
+from ant_nest.items import Extractor, NestExtractor
 
 
 @pytest.mark.asyncio
@@ -108,6 +120,434 @@ async def test_with_real_send():
     await ant.close()
 
 
+@pytest.mark.asyncio
+async def test_ant_host_limit():
+    running = 0
+    max_running = 0
+
+    async def handler(request):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(running, max_running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return httpx.Response(200, content=b"ok")
+
+    class TestAnt(CliAnt):
+        host_concurrency = 1
+
+    ant = TestAnt()
+    ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    await asyncio.gather(*(ant.request("http://test.com") for _ in range(3)))
+    assert max_running == 1
+    # metrics
+    assert ant.reporter.statuses[("test.com", 200)] == 3
+    assert ant.reporter.histograms["send"].count == 3
+    assert ant.reporter.histograms["queue_wait"].quantile(0.99) > 0.01
+    assert ant.reporter.histograms["response_pipeline"].count == 3
+    await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_ant_http_cache():
+    count = 0
+
+    def handler(request):
+        nonlocal count
+        count += 1
+        return httpx.Response(200, content=b"hi")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = HttpCachePipeline(cache_dir=cache_dir)
+
+        class TestAnt(CliAnt):
+            request_pipelines = [cache]
+            response_pipelines = [cache]
+
+        ant = TestAnt()
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        for _ in range(2):
+            res = await ant.request("http://test.com")
+            assert res.content == b"hi"
+        assert count == 1
+        await ant.close()
+
+        # cache hits skip the rest request pipelines
+        class CachedAnt(CliAnt):
+            request_pipelines = [
+                cache,
+                RequestUserAgentPipeline(user_agent="ant"),
+                RequestDuplicateFilterPipeline(),
+            ]
+            response_pipelines = [cache]
+
+        ant = CachedAnt()
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        for _ in range(2):
+            res = await ant.request("http://test.com")
+            assert res.content == b"hi"
+            assert res.extensions["from_cache"]
+            assert "user-agent" not in res.headers
+        assert count == 1
+        await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_ant_content_store():
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        if request.url.path == "/page":
+            return httpx.Response(
+                200, content=b"page", headers={"content-type": "html"}
+            )
+        return httpx.Response(
+            200, content=b"image", headers={"content-type": "image/png"}
+        )
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = ContentStorePipeline(store_dir=store_dir, content_types=("image/",))
+
+        class TestAnt(CliAnt):
+            # stored responses skip the dedup pipeline
+            request_pipelines = [store, RequestDuplicateFilterPipeline()]
+            response_pipelines = [store]
+
+        ant = TestAnt()
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        res = await ant.request("http://test.com/a.png")
+        assert res.content == b"image"
+        path = res.extensions["store_path"]
+        with open(path, "rb") as f:
+            assert f.read() == b"image"
+        # same content of another url in streaming
+        res = await ant.request("http://test.com/b.png", stream=True)
+        assert res.extensions["store_path"] == path
+        assert await res.aread() == b"image"
+        assert len(os.listdir(os.path.dirname(path))) == 1
+        # known urls are not requested again
+        for url in ("http://test.com/a.png", "http://test.com/b.png"):
+            res = await ant.request(url)
+            assert res.content == b"image"
+            assert res.extensions["from_store"]
+        assert requested == ["/a.png", "/b.png"]
+        # other content types
+        res = await ant.request("http://test.com/page")
+        assert "store_path" not in res.extensions
+        await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_ant_frontier():
+    class TestAnt(Ant):
+        max_depth = 2
+
+        def __init__(self):
+            super().__init__()
+            self.crawled = []
+
+        async def run(self):
+            await self.schedule(self.crawl_page, "http://test.com/0", page=0)
+
+        async def crawl_page(self, url, page):
+            self.crawled.append(page)
+            await self.schedule(
+                self.crawl_page, f"http://test.com/{page + 1}", page=page + 1
+            )
+            await self.schedule(
+                self.crawl_page,
+                f"http://test.com/{page + 2}",
+                page=page + 2,
+                priority=1,
+            )
+
+    ant = TestAnt()
+    ant.pool = ant.pool.__class__(limit=1)
+    await ant.main()
+    # depth limit and priority
+    assert ant.crawled == [0, 2, 4, 1, 3, 3, 2]
+
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, "frontier.sqlite")
+
+        class ResumeAnt(TestAnt):
+            max_depth = 1
+
+            async def crawl_page(self, url, page):
+                if page == 0:  # shutdown
+                    self.pool.running = False
+                await super().crawl_page(url, page)
+
+        ant = ResumeAnt()
+        ant.pool = ant.pool.__class__(limit=1)
+        ant.frontier = SqliteFrontier(path)
+        await ant.main()
+        assert ant.crawled == [0]
+
+        class ResumeAnt2(ResumeAnt):
+            async def run(self):
+                raise Exception("Not run when resuming")
+
+        ant = ResumeAnt2()
+        ant.frontier = SqliteFrontier(path)
+        await ant.main()
+        assert ant.crawled == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_ant_shared_state(mocker):
+    class TestAnt(Ant):
+        def __init__(self):
+            super().__init__()
+            self.request_pipelines = [RequestDuplicateFilterPipeline()]
+            self.crawled = []
+
+        async def run(self):
+            for page in (0, 1, 1):
+                await self.schedule(self.crawl_page, f"http://test.com/{page}")
+
+        async def crawl_page(self, url):
+            self.crawled.append(url)
+
+        async def request(self, url, **kwargs):
+            request = self.client.build_request("GET", url)
+            return await self._pipe(request, self.request_pipelines)
+
+    with tempfile.TemporaryDirectory() as path:
+        mocker.patch.object(
+            settings, "SHARED_STATE", {"url": "sqlite://" + path}, create=True
+        )
+        node1 = TestAnt()
+        node2 = TestAnt()
+        assert isinstance(node1.frontier, SqliteFrontier)
+        await node1.open()
+        await node2.open()
+        await node1._seed()
+        assert node2.frontier.resume() == 3
+        await node2.crawl()
+        assert len(node2.crawled) == 3
+        # requests are deduplicated among nodes
+        await node1.request("http://test.com/0")
+        with pytest.raises(Dropped):
+            await node2.request("http://test.com/0")
+        await node1.close()
+        await node2.close()
+
+    # slow callbacks renew their leases, nodes started at the same time seed once
+    with tempfile.TemporaryDirectory() as path:
+        mocker.patch.object(
+            settings,
+            "SHARED_STATE",
+            {"url": "sqlite://" + path, "visibility_timeout": 0.1},
+            create=True,
+        )
+
+        class SlowAnt(TestAnt):
+            async def crawl_page(self, url):
+                await asyncio.sleep(0.3)
+                self.crawled.append(url)
+
+        node1 = SlowAnt()
+        node2 = SlowAnt()
+        await node1.open()
+        await node2.open()
+        await node1._seed()
+        await node2._seed()
+        assert node1.frontier.size() == 3
+        node1.frontier.done(node1.frontier.pop())
+        node1.frontier.done(node1.frontier.pop())
+        crawling = asyncio.ensure_future(node1.crawl())
+        await asyncio.sleep(0.2)
+        assert node2.frontier.pop() is None
+        await crawling
+        assert len(node1.crawled) == 1
+        await node1.close()
+        await node2.close()
+
+
+@pytest.mark.asyncio
+async def test_ant_extract_in_process():
+    ant = CliAnt()
+    response = httpx.Response(
+        200,
+        request=httpx.Request("GET", "https://test.com"),
+        text='<p class="a">1</p><p>2</p>',
+    )
+    extractor = Extractor(dict, parser="html", executor="process")
+    extractor.add_xpath("xpath", "//p/text()", many=True)
+    extractor.add_regex("regex", r"<p>(\d)</p>")
+    item = await ant.extract(extractor, response)
+    assert item == {"xpath": ["1", "2"], "regex": "2"}
+    await ant.close()
+    # lxml elements can`t be sent back, but css extractors can be sent
+    extractor.add_css("css", "p.a")
+    extractor = pickle.loads(pickle.dumps(extractor))
+    assert extractor.extract(response)["css"].text == "1"
+
+
+@pytest.mark.asyncio
+async def test_ant_instrument(mocker):
+    mocker.patch.object(settings, "INSTRUMENT", {"enabled": True}, create=True)
+
+    class TestPipeline(Pipeline):
+        def process(self, obj):
+            return obj
+
+    ant = CliAnt()
+    ant.item_pipelines = [TestPipeline()]
+    await ant.open()
+    await ant.collect({"a": 1})
+    response = httpx.Response(
+        200, request=httpx.Request("GET", "https://test.com"), text="<p>1</p>"
+    )
+    extractor = Extractor(dict, parser="html", executor="thread")
+    extractor.add_xpath("p", "//p/text()")
+    assert await ant.extract(extractor, response) == {"p": "1"}
+    histograms = ant.reporter.histograms
+    assert histograms["pipeline:TestPipeline"].count == 1
+    assert histograms["pipeline:TestPipeline:cpu"].count == 1
+    assert histograms["extractor:dict.p"].count == 1
+
+    # extractors overriding "extract" without the instrument
+    class CustomExtractor(Extractor):
+        def extract(self, res):
+            item = super().extract(res)
+            item["custom"] = True
+            return item
+
+    extractor = CustomExtractor(dict, parser="html")
+    extractor.add_xpath("p", "//p/text()")
+    assert await ant.extract(extractor, response) == {"p": "1", "custom": True}
+    assert histograms["extractor:dict.p"].count == 2
+    await ant.close()
+
+    # disabled by default
+    mocker.patch.object(settings, "INSTRUMENT", {}, create=True)
+    ant = CliAnt()
+    assert ant.instrument is None
+    await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_ant_collect_batch():
+    batches = []
+
+    class BatchPipeline(Pipeline):
+        def process_batch(self, objs):
+            batches.append([obj["id"] for obj in objs])
+            return objs
+
+    class DropPipeline(Pipeline):
+        def process(self, obj):
+            if obj["id"] == 1:
+                raise Dropped("Drop")
+            return obj
+
+    class TestAnt(CliAnt):
+        item_pipelines = [DropPipeline(), BatchPipeline()]
+
+    ant = TestAnt()
+    ant.item_batch_size = 3
+    results = await asyncio.gather(
+        *(ant.collect({"id": i}) for i in range(5)), return_exceptions=True
+    )
+    assert isinstance(results[1], Dropped)
+    # full batch first, then the rest after max latency
+    assert batches == [[0, 2], [3, 4]]
+    assert ant.reporter._records["dict"].count == 4
+    assert ant.reporter._records["dict"].dropped_count == 1
+    await ant.close()
+
+    # batches of cancelled collecting are processed before closing sinks
+    class SlowBatchPipeline(Pipeline):
+        async def process_batch(self, objs):
+            await asyncio.sleep(0.05)
+            batches.append([obj["id"] for obj in objs])
+            return objs
+
+        def on_spider_close(self):
+            assert batches[-1] == [0, 1]
+
+    class SlowAnt(CliAnt):
+        item_pipelines = [SlowBatchPipeline()]
+
+    ant = SlowAnt()
+    ant.item_batch_size = 2
+    collecting = asyncio.gather(*(ant.collect({"id": i}) for i in range(2)))
+    await asyncio.sleep(0.01)
+    collecting.cancel()
+    assert len(ant._item_batch_tasks) == 1
+    await ant.close()
+    assert not ant._item_batch_tasks
+
+
+@pytest.mark.asyncio
+async def test_ant_item_sink():
+    class SlowPipeline(Pipeline):
+        def __init__(self):
+            super().__init__()
+            self.items = []
+
+        async def process(self, obj):
+            await asyncio.sleep(0.01)
+            if obj["id"] == 1:
+                raise Dropped("Drop")
+            self.items.append(obj["id"])
+            return obj
+
+        def on_spider_close(self):
+            assert len(self.items) == 4  # drained before closing
+
+    class TestAnt(CliAnt):
+        item_pipelines = [SlowPipeline()]
+
+    ant = TestAnt()
+    ant.item_sink_queue_size = 2
+    for i in range(5):
+        await ant.collect({"id": i})
+        # bounded by queue size and the sink worker
+        assert i - len(ant.item_pipelines[0].items) <= 3
+    assert len(ant.item_pipelines[0].items) < 4
+    await ant.close()
+    assert ant.item_pipelines[0].items == [0, 2, 3, 4]
+    assert ant.reporter._records["dict"].count == 4
+    assert ant.reporter._records["dict"].dropped_count == 1
+
+
+@pytest.mark.asyncio
+async def test_ant_executor():
+    class ThreadPipeline(Pipeline):
+        executor = "thread"
+
+        def process(self, obj):
+            obj["thread"] = threading.get_ident()
+            return obj
+
+    class TestAnt(CliAnt):
+        item_pipelines = [ThreadPipeline()]
+
+    ant = TestAnt()
+    item = await ant._pipe({}, ant.item_pipelines)
+    assert item["thread"] != threading.get_ident()
+
+    res = httpx.Response(
+        200,
+        request=httpx.Request("GET", "https://test.com"),
+        content=b"<div><p>1</p><p>2</p></div>",
+    )
+    for executor in (None, "thread"):
+        extractor = Extractor(dict, parser="html", executor=executor)
+        extractor.add_xpath("p", "//p/text()")
+        assert await ant.extract(extractor, res) == {"p": "1"}
+        extractor = NestExtractor(
+            dict, lambda x: x.xpath("//p"), parser="html", executor=executor
+        )
+        extractor.add_xpath("p", "./text()")
+        assert await ant.extract_items(extractor, res) == [{"p": "1"}, {"p": "2"}]
+    await ant.close()
+
+
 @pytest.mark.asyncio
 async def test_ant_main():
     """Pipeline closed before scheduled coroutines done?"""
@@ -1,19 +1,77 @@
 import sys
 import os
+import tempfile
+import time
+import multiprocessing
 from unittest import mock
 
 import pytest
 
-from ant_nest.ant import CliAnt
+from ant_nest.ant import CliAnt, Ant
 from ant_nest.cli import get_ants
 from ant_nest import cli
 
 
+class ShardAnt(Ant):
+    """Crawl fake urls of many hosts in workers"""
+
+    async def run(self):
+        for host in range(10):
+            await self.schedule(self.crawl_host, f"http://{host}.test.com")
+
+    async def crawl_host(self, url):
+        await self.collect({"url": url, "worker": self.worker_index})
+        if "/page" not in url:
+            await self.schedule(self.crawl_host, url + "/page")
+
+
+class CrashAnt(ShardAnt):
+    """The second worker dies at its first entry"""
+
+    async def crawl_host(self, url):
+        if self.worker_index == 1:
+            os._exit(1)
+        await super().crawl_host(url)
+
+
 def test_cli_get_ants():
     ants = get_ants(["ant_nest", "tests"])
     assert CliAnt is list(ants.values())[0]
 
 
+def test_cli_index_ants():
+    with tempfile.TemporaryDirectory() as path:
+        os.mkdir(os.path.join(path, "index_ants"))
+        for name, source in (
+            ("__init__.py", ""),
+            ("a.py", "from ant_nest.ant import Ant\nclass AAnt(Ant):\n    pass\n"),
+            ("b.py", "VALUE = 1\n"),
+        ):
+            with open(os.path.join(path, "index_ants", name), "w") as f:
+                f.write(source)
+        cache_file = os.path.join(path, "index.json")
+        sys.path.insert(0, path)
+        try:
+            index = cli.index_ants(["index_ants"], cache_file)
+            assert index == {"index_ants.a.AAnt": ("index_ants.a", "AAnt")}
+            assert cli.load_ant(index, "index_ants.a.AAnt").__name__ == "AAnt"
+            # unchanged modules are not imported again
+            with mock.patch.object(cli, "import_module") as import_module:
+                assert cli.index_ants(["index_ants"], cache_file) == index
+                assert not import_module.called
+            # changed module is imported
+            module_path = os.path.join(path, "index_ants", "b.py")
+            os.utime(module_path, (time.time() + 10, time.time() + 10))
+            with mock.patch.object(cli, "import_module") as import_module:
+                cli.index_ants(["index_ants"], cache_file)
+                import_module.assert_called_once_with("index_ants.b")
+        finally:
+            sys.path.remove(path)
+
+    with pytest.raises(ModuleNotFoundError):
+        cli.index_ants(["NoAnts"])
+
+
 def test_cli_shutdown():
     ant = CliAnt()
     cli.shutdown_ant([ant])
@@ -39,6 +97,7 @@ def test_cli():
 
     # mock settings.py import
     sys.modules["settings"] = settings
+    settings.ANT_INDEX_FILE = None
 
     settings.ANT_PACKAGES = ["NoAnts"]
     with pytest.raises(ModuleNotFoundError):  # can`t import NoAnts
@@ -61,3 +120,20 @@ def test_cli():
         cli.main(["-c" "."])
 
     cli.main(["-a" "tests.test_cli.CliAnt"])
+
+
+def test_cli_run_workers(monkeypatch, caplog):
+    from ant_nest import ant as ant_module
+
+    # settings without "FRONTIER_DIR"
+    monkeypatch.delattr(ant_module.settings, "FRONTIER_DIR")
+    counts = cli.run_workers(["tests.test_cli.ShardAnt"], ["tests"], 2)
+    assert counts["ShardAnt"]["dict"]["count"] == 20
+    # a dead worker stops the run instead of hanging others
+    with pytest.raises(RuntimeError, match="AntNestWorker-1"):
+        cli.run_workers(["tests.test_cli.CrashAnt"], ["tests"], 2)
+    assert "Get counts of 1 workers in 2" in caplog.text
+    # counts put by workers exiting before being checked
+    monkeypatch.setattr(multiprocessing.Process, "is_alive", lambda self: False)
+    counts = cli.run_workers(["tests.test_cli.ShardAnt"], ["tests"], 2)
+    assert counts["ShardAnt"]["dict"]["count"] == 20
@@ -0,0 +1,139 @@
+import os
+import gzip
+import hashlib
+import tempfile
+
+import pytest
+import httpx
+
+from ant_nest.ant import CliAnt
+from ant_nest.downloader import Downloader
+from ant_nest.pipelines import RequestDuplicateFilterPipeline
+
+DATA = os.urandom(1000)
+
+
+async def stream(content):
+    # not read by the mock transport, like bodies of real responses
+    yield content
+
+
+def create_handler(ranges=True, fail_ranges=()):
+    requested = []
+
+    def handler(request):
+        headers = {"content-length": str(len(DATA)), "etag": '"1"'}
+        if ranges:
+            headers["accept-ranges"] = "bytes"
+        if request.method == "HEAD":
+            return httpx.Response(200, headers=headers)
+        if "range" not in request.headers or not ranges:
+            requested.append(None)
+            return httpx.Response(200, headers=headers, content=stream(DATA))
+        value = request.headers["range"]
+        requested.append(value)
+        if value in fail_ranges:
+            return httpx.Response(403)
+        start, end = map(int, value[len("bytes=") :].split("-"))
+        return httpx.Response(
+            206,
+            headers={"content-range": f"bytes {start}-{end}/{len(DATA)}"},
+            content=stream(DATA[start : end + 1]),
+        )
+
+    return handler, requested
+
+
+class DedupAnt(CliAnt):
+    request_pipelines = [RequestDuplicateFilterPipeline()]
+
+
+@pytest.mark.asyncio
+async def test_downloader():
+    ant = DedupAnt()  # retried and resumed requests are not dropped
+    downloader = Downloader(ant.request, chunk_size=300, concurrency=2)
+    with tempfile.TemporaryDirectory() as path:
+        file_path = os.path.join(path, "file")
+        # interrupted
+        handler, requested = create_handler(fail_ranges=("bytes=300-599",))
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with pytest.raises(ValueError):
+            await downloader.download("http://test.com/file", file_path)
+        assert len(requested) == 4
+        assert not os.path.exists(file_path)
+        assert os.path.getsize(file_path + ".part") == len(DATA)
+        # resumed
+        handler, requested = create_handler()
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        checksum = "sha256:" + hashlib.sha256(DATA).hexdigest()
+        assert await downloader.download("http://test.com/file", file_path) == len(DATA)
+        assert requested == ["bytes=300-599"]
+        with open(file_path, "rb") as f:
+            assert f.read() == DATA
+        assert not os.path.exists(file_path + ".part.json")
+        # checksum
+        requested.clear()
+        assert await downloader.download(
+            "http://test.com/file", file_path, checksum=checksum
+        ) == len(DATA)
+        assert len(requested) == 4
+        with pytest.raises(ValueError):
+            await downloader.download(
+                "http://test.com/file", file_path, checksum="md5:00"
+            )
+        assert not os.path.exists(file_path + ".part")
+        # without range support
+        handler, requested = create_handler(ranges=False)
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        assert await ant.download("http://test.com/file", file_path) == len(DATA)
+        assert requested == [None]
+        with open(file_path, "rb") as f:
+            assert f.read() == DATA
+    await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_downloader_encoded():
+    encoded = gzip.compress(DATA)
+
+    def handler(request):
+        # servers may encode the body even if identity is asked
+        assert request.headers["accept-encoding"] == "identity"
+        headers = {"content-length": str(len(encoded)), "content-encoding": "gzip"}
+        if request.method == "HEAD":
+            return httpx.Response(200, headers=headers)
+        return httpx.Response(200, headers=headers, content=stream(encoded))
+
+    ant = CliAnt()
+    ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with tempfile.TemporaryDirectory() as path:
+        file_path = os.path.join(path, "file.gz")
+        # bytes are saved as received
+        assert await ant.download("http://test.com/file", file_path) == len(encoded)
+        with open(file_path, "rb") as f:
+            assert gzip.decompress(f.read()) == DATA
+    await ant.close()
+
+
+@pytest.mark.asyncio
+async def test_downloader_without_head():
+    requested = []
+
+    def handler(request):
+        requested.append(request.method)
+        if request.method == "HEAD":
+            return httpx.Response(405)
+        return httpx.Response(
+            200, headers={"content-length": str(len(DATA))}, content=stream(DATA)
+        )
+
+    ant = CliAnt()
+    ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with tempfile.TemporaryDirectory() as path:
+        file_path = os.path.join(path, "file")
+        assert await ant.download("http://test.com/file", file_path) == len(DATA)
+        assert requested == ["HEAD", "GET"]
+        assert ant.reporter.bytes_in == len(DATA)  # streaming bodies are counted
+        with open(file_path, "rb") as f:
+            assert f.read() == DATA
+    await ant.close()
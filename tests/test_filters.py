@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+import pytest
+
+from ant_nest.filters import (
+    MemoryFilter,
+    BloomFilter,
+    SqliteFilter,
+    RedisFilter,
+    create_filter,
+)
+
+
+def test_memory_filter():
+    f = MemoryFilter()
+    assert f.add(b"a")
+    assert not f.add(b"a")
+    assert f.add(b"b")
+    assert len(f) == 2
+    f.close()
+
+
+def test_bloom_filter():
+    f = BloomFilter(capacity=100, error_rate=0.001)
+    fingerprints = [os.urandom(16) for _ in range(1000)]
+    added = sum(f.add(fingerprint) for fingerprint in fingerprints)
+    assert added > 990  # few false positives
+    assert len(f._filters) > 1  # scaled
+    assert not any(f.add(fingerprint) for fingerprint in fingerprints)
+    # short fingerprint
+    assert f.add(b"short")
+    assert not f.add(b"short")
+
+    with pytest.raises(ValueError):
+        BloomFilter(error_rate=1)
+
+
+def test_sqlite_filter():
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, "fingerprints.sqlite")
+        f = SqliteFilter(path, commit_interval=2)
+        for fingerprint in (b"a", b"b", b"c"):
+            assert f.add(fingerprint)
+        assert not f.add(b"a")
+        assert len(f) == 3
+        f.close()
+        # survive restarts
+        f = SqliteFilter(path)
+        assert not f.add(b"c")
+        assert f.add(b"d")
+        f.close()
+
+
+def test_shared_filter():
+    with tempfile.TemporaryDirectory() as path:
+        node1 = create_filter("sqlite://" + path, "Ant")
+        node2 = create_filter("sqlite://" + path, "Ant")
+        assert node1.add(b"a")
+        assert not node2.add(b"a")
+        node1.close()
+        node2.close()
+
+    with pytest.raises(ValueError):
+        create_filter("mysql://localhost", "Ant")
+
+
+@pytest.mark.skipif(not os.getenv("TEST_REDIS"), reason="TEST_REDIS is not set")
+@pytest.mark.asyncio
+async def test_redis_filter():
+    f = RedisFilter(os.environ["TEST_REDIS"], key=f"ant_nest:test:{os.getpid()}")
+    assert await f.add(b"a")
+    assert not await f.add(b"a")
+    await f.redis.delete(f.key)
+    await f.close()
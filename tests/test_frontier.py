@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import tempfile
+
+import pytest
+
+from ant_nest.frontier import Entry, Frontier, SqliteFrontier, create_frontier
+
+
+def test_frontier():
+    frontier = Frontier()
+    assert frontier.resume() == 0
+    assert frontier.pop() is None
+    frontier.push(Entry("crawl", "http://a.com"))
+    frontier.push(Entry("crawl", "http://b.com", priority=1))
+    frontier.push(Entry("crawl", "http://c.com"))
+    entry = frontier.pop()
+    assert entry.url == "http://b.com"
+    frontier.release(entry)
+    assert frontier.pop() is entry
+    frontier.done(entry)
+    assert [frontier.pop().url for _ in range(2)] == ["http://a.com", "http://c.com"]
+    assert len(frontier) == 2
+    assert frontier.pop() is None
+    frontier.close()
+
+
+def test_sqlite_frontier():
+    with tempfile.TemporaryDirectory() as path:
+        path = os.path.join(path, "frontier.sqlite")
+        frontier = SqliteFrontier(path)
+        assert frontier.resume() == 0
+        frontier.push(Entry("crawl", "http://a.com", kwargs={"page": 1}))
+        frontier.push(Entry("crawl", "http://b.com", priority=1, depth=2))
+        frontier.push(Entry("crawl", "http://c.com"))
+        entry = frontier.pop()
+        assert entry.url == "http://b.com"
+        assert entry.depth == 2
+        frontier.release(entry)
+        entry = frontier.pop()
+        assert entry.url == "http://b.com"
+        frontier.done(entry)
+        entry = frontier.pop()
+        assert entry.kwargs == {"page": 1}
+        assert len(frontier) == 2
+        frontier.close()
+        # in-flight entry is pending again
+        frontier = SqliteFrontier(path)
+        assert frontier.resume() == 2
+        assert [frontier.pop().url for _ in range(2)] == [
+            "http://a.com",
+            "http://c.com",
+        ]
+        assert frontier.pop() is None
+        frontier.close()
+
+
+def test_sqlite_frontier_lease():
+    with tempfile.TemporaryDirectory() as path:
+        node1 = create_frontier("sqlite://" + path, "Ant", visibility_timeout=0.1)
+        node2 = create_frontier("sqlite://" + path, "Ant", visibility_timeout=0.1)
+        assert isinstance(node1, SqliteFrontier)
+        node1.push(Entry("crawl", "http://a.com"))
+        node1.push(Entry("crawl", "http://b.com"))
+        assert node1.pop().url == "http://a.com"
+        assert node2.pop().url == "http://b.com"
+        assert node2.pop() is None
+        # node1 crashed, its entry is leased to node2 after timeout
+        time.sleep(0.15)
+        assert node2.resume() == 2
+        entry = node2.pop()
+        assert entry.url == "http://a.com"
+        node2.done(entry)
+        assert node2.size() == 1
+        # renewed lease is not expired
+        entry = node1.pop()
+        assert entry.url == "http://b.com"
+        time.sleep(0.06)
+        node1.renew(entry)
+        time.sleep(0.06)
+        assert node2.pop() is None
+        node1.done(entry)
+        # only one node seeds, the claim is released after crawled
+        assert node1.claim_seeding()
+        assert not node2.claim_seeding()
+        node1.close()
+        node2.close()
+        node1 = create_frontier("sqlite://" + path, "Ant", visibility_timeout=0.1)
+        assert node1.claim_seeding()
+        node1.close()
+        assert SqliteFrontier(os.path.join(path, "test.sqlite")).claim_seeding()
+
+    with pytest.raises(ValueError):
+        create_frontier("mysql://localhost", "Ant")
+
+
+@pytest.mark.skipif(not os.getenv("TEST_REDIS"), reason="TEST_REDIS is not set")
+@pytest.mark.asyncio
+async def test_redis_frontier():
+    node1 = create_frontier(
+        os.environ["TEST_REDIS"], f"Ant{time.time()}", visibility_timeout=0.1
+    )
+    node2 = create_frontier(
+        os.environ["TEST_REDIS"], node1.prefix.split(":")[1], visibility_timeout=0.1
+    )
+    await node1.push(Entry("crawl", "http://a.com", kwargs={"page": 1}))
+    await node1.push(Entry("crawl", "http://b.com", priority=1, depth=2))
+    await node1.push(Entry("crawl", "http://c.com"))
+    entry = await node1.pop()
+    assert (entry.url, entry.depth) == ("http://b.com", 2)
+    await node1.release(entry)
+    entry = await node2.pop()
+    assert entry.url == "http://b.com"
+    await node2.done(entry)
+    assert (await node1.pop()).kwargs == {"page": 1}
+    assert (await node2.pop()).url == "http://c.com"
+    assert await node2.pop() is None
+    # node1 crashed, its entry is leased to node2 after timeout
+    await asyncio.sleep(0.15)
+    assert await node2.size() == 2
+    entry = await node2.pop()
+    assert entry.url == "http://a.com"
+    await node2.done(await node2.pop())  # c.com
+    # renewed lease is not expired
+    await asyncio.sleep(0.06)
+    await node2.renew(entry)
+    await asyncio.sleep(0.06)
+    assert await node1.pop() is None
+    await node2.done(entry)
+    # released after done or reclaimed
+    await node2.release(entry)
+    assert await node1.pop() is None
+    # only one node seeds
+    assert await node1.claim_seeding()
+    assert not await node2.claim_seeding()
+    await node1.close()
+    await node2.close()
@@ -0,0 +1,142 @@
+import os
+import cProfile
+import tempfile
+
+import httpx
+import pytest
+
+from ant_nest.instrument import (
+    Hook,
+    Instrument,
+    TimingHook,
+    ProfileHook,
+    current_instrument,
+    use_instrument,
+)
+from ant_nest.items import Extractor, ColumnExtractor
+from ant_nest.pipelines import Pipeline, PipelineChain
+from ant_nest.reporter import Reporter
+from ant_nest.exceptions import Dropped
+
+
+class RecordHook(Hook):
+    def __init__(self):
+        self.calls = []
+
+    def after(self, stage, obj, state, wall, cpu):
+        self.calls.append((stage, obj, wall >= 0, cpu))
+
+
+class AddPipeline(Pipeline):
+    def process(self, obj):
+        return obj + 1
+
+
+class AsyncPipeline(Pipeline):
+    async def process(self, obj):
+        return obj * 2
+
+
+class DropPipeline(Pipeline):
+    def process(self, obj):
+        raise Dropped()
+
+
+@pytest.mark.asyncio
+async def test_instrument_pipeline_chain():
+    hook = RecordHook()
+    instrument = Instrument([hook])
+    pipelines = [AddPipeline(), AsyncPipeline(), AddPipeline()]
+    chain = PipelineChain(pipelines, instrument=instrument)
+    assert await chain(1) == 5
+    assert [call[:3] for call in hook.calls] == [
+        ("pipeline:AddPipeline", 1, True),
+        ("pipeline:AsyncPipeline", 2, True),
+        ("pipeline:AddPipeline", 4, True),
+    ]
+    assert hook.calls[0][3] is not None
+    assert hook.calls[1][3] is None  # no cpu time for coroutine stages
+    assert chain.is_stale(pipelines)
+    assert not chain.is_stale(pipelines, instrument)
+
+    # dropped objs are timed too
+    with pytest.raises(Dropped):
+        await PipelineChain([DropPipeline()], instrument=instrument)(1)
+    assert hook.calls[-1][0] == "pipeline:DropPipeline"
+
+
+@pytest.mark.asyncio
+async def test_timing_hook():
+    reporter = Reporter()
+    instrument = Instrument([TimingHook(reporter)])
+    response = httpx.Response(
+        200,
+        request=httpx.Request("GET", "https://test.com"),
+        text="<html><body><p>1</p><p>2</p></body></html>",
+    )
+    extractor = Extractor(dict, parser="html")
+    extractor.add_xpath("p", "//p/text()")
+    column_extractor = ColumnExtractor(
+        dict, parser="html", root_extractor=lambda document: document.xpath("//p")
+    )
+    column_extractor.add_xpath("p", "//p/text()")
+    with use_instrument(instrument):
+        assert current_instrument() is instrument
+        assert extractor.extract(response) == {"p": "1"}
+        items = list(column_extractor.extract_items(response))
+    assert current_instrument() is None
+    assert extractor.extract(response) == {"p": "1"}  # not timed
+    assert items == [{"p": "1"}, {"p": "2"}]
+
+    histograms = reporter.histograms
+    assert histograms["parser:html"].count == 2
+    assert histograms["extractor:dict.p"].count == 2
+    assert histograms["extractor:dict.p:cpu"].count == 2
+    assert histograms["extractor:dict.p"].buckets == TimingHook.BUCKETS
+    assert histograms["extractor:dict.<root>"].count == 1
+    reporter.close()
+
+
+def test_profile_hook():
+    hook = ProfileHook(top=2, sample_rate=1)
+    instrument = Instrument([hook])
+    for i in range(5):
+        instrument.call("stage:sum", lambda n: sum(range(n)), 1000 * (i + 1))
+    slowest = hook.slowest()
+    assert len(slowest) == 2
+    assert slowest[0][0] >= slowest[1][0]
+
+    with tempfile.TemporaryDirectory() as path:
+        hook.profile_dir = os.path.join(path, "profiles")
+        instrument.close()
+        assert sorted(os.listdir(hook.profile_dir)) == [
+            "0-stage-sum.prof",
+            "1-stage-sum.prof",
+        ]
+
+    # not sampled
+    hook = ProfileHook(top=2, sample_rate=0)
+    Instrument([hook]).call("stage", str, 1)
+    assert hook.slowest() == []
+
+
+def test_failed_hooks(mocker):
+    class FailedHook(RecordHook):
+        def before(self, stage, obj):
+            raise RuntimeError("before")
+
+    class ActiveProfile(cProfile.Profile):
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    # stages run without failed hooks
+    record_hook = RecordHook()
+    instrument = Instrument([FailedHook(), record_hook])
+    assert instrument.call("stage", str, 1) == "1"
+    assert instrument.hooks[0].calls == []
+    assert record_hook.calls == [("stage", 1, True, record_hook.calls[0][3])]
+
+    mocker.patch.object(cProfile, "Profile", ActiveProfile)
+    hook = ProfileHook(top=2, sample_rate=1)
+    assert Instrument([hook]).call("stage", str, 1) == "1"
+    assert hook.slowest() == []  # the sample is skipped
@@ -10,6 +10,10 @@ from ant_nest.items import (
     set_value,
     get_value,
     NestExtractor,
+    ColumnExtractor,
+    PARSERS,
+    get_document,
+    compile_xpath,
 )
 from ant_nest.exceptions import Dropped, ItemGetValueError, ExceptionFilter
 
@@ -80,6 +84,143 @@ def test_extract_item():
         temp += 1
 
 
+def test_extract_item_with_parser(mocker):
+    with open("./tests/test.html", "rb") as f:
+        response = httpx.Response(
+            200, request=httpx.Request("Get", "https://test.com"), content=f.read()
+        )
+
+    class Item:
+        pass
+
+    parse_html = mocker.Mock(wraps=PARSERS["html"])
+    mocker.patch.dict(PARSERS, {"html": parse_html})
+    item_extractor = Extractor(Item, parser="html")
+    item_extractor.add_extractor(
+        "paragraph", lambda x: x.xpath("/html/body/div/p/text()")[0]
+    )
+    item_extractor.add_extractor("title", lambda x: x.xpath("//title/text()")[0])
+    item = item_extractor.extract(response)
+    assert item.paragraph == "test"
+    assert item.title == "Test html"
+    # parsed document is shared
+    item_nest_extractor = NestExtractor(
+        Item, lambda x: x.xpath('//div[@id="nest"]/div'), parser="html"
+    )
+    item_nest_extractor.add_extractor("xpath_key", lambda x: x.xpath("./p/text()")[0])
+    assert [item.xpath_key for item in item_nest_extractor.extract_items(response)] == [
+        "1",
+        "2",
+        "3",
+    ]
+    assert parse_html.call_count == 1
+    assert get_document(response, "html") is get_document(response, "html")
+    assert get_document(response, None) is response
+    # json
+    response = httpx.Response(
+        200,
+        request=httpx.Request("Get", "https://test.com"),
+        content=b'{"a": {"b": {"c": 1}}}',
+    )
+    item_extractor = Extractor(Item, parser="json")
+    item_extractor.add_extractor("author", lambda x: jpath.get_all("a.b.c", x)[0])
+    assert item_extractor.extract(response).author == 1
+
+
+def test_extract_item_with_selectors():
+    with open("./tests/test.html", "rb") as f:
+        response = httpx.Response(
+            200, request=httpx.Request("Get", "https://test.com"), content=f.read()
+        )
+
+    class Item:
+        pass
+
+    item_extractor = Extractor(Item)
+    item_extractor.add_xpath("paragraph", "/html/body/div/p/text()")
+    item_extractor.add_xpath("nest", '//div[@id="nest"]/div/p/text()', many=True)
+    item_extractor.add_xpath("missing", "//h1/text()", default="")
+    item_extractor.add_css("link", "div > a")
+    item_extractor.add_regex("title", r"<title>([A-Z a-z]+)</title>")
+    item_extractor.add_regex("regex", r"regex(\d+)<", many=True)
+    item = item_extractor.extract(response)
+    assert item.paragraph == "test"
+    assert item.nest == ["1", "2", "3"]
+    assert item.missing == ""
+    assert item.link.get("href") == "www.www.www"
+    assert item.title == "Test html"
+    assert item.regex == ["1", "2", "3"]
+    # selectors work with nodes too
+    item_nest_extractor = NestExtractor(
+        Item, lambda x: x.xpath('//div[@id="nest"]/div'), parser="html"
+    )
+    item_nest_extractor.add_xpath("xpath_key", "./p/text()")
+    item_nest_extractor.add_regex("regex_key", r"regex(\d+)</")
+    for index, item in enumerate(item_nest_extractor.extract_items(response)):
+        assert item.xpath_key == item.regex_key == str(index + 1)
+    # compiled once
+    assert compile_xpath("./p/text()") is compile_xpath("./p/text()")
+
+
+def test_column_extractor():
+    with open("./tests/test.html", "rb") as f:
+        response = httpx.Response(
+            200, request=httpx.Request("Get", "https://test.com"), content=f.read()
+        )
+
+    class Item:
+        pass
+
+    item_extractor = ColumnExtractor(Item, parser="html")
+    item_extractor.add_xpath("xpath_key", '//div[@id="nest"]/div/p/text()', many=True)
+    item_extractor.add_regex("regex_key", r"regex(\d+)</", many=True)
+    items = list(item_extractor.extract_items(response))
+    assert [item.xpath_key for item in items] == ["1", "2", "3"]
+    assert [item.regex_key for item in items] == ["1", "2", "3"]
+    # not aligned
+    item_extractor.add_xpath("paragraph", "/html/body/div/p/text()", many=True)
+    with pytest.raises(ValueError):
+        list(item_extractor.extract_items(response))
+
+    # ragged rows are aligned by their root nodes
+    response = httpx.Response(
+        200,
+        request=httpx.Request("Get", "https://test.com"),
+        text=(
+            '<div class="row"><p>1</p><a href="/1">a</a></div>'
+            '<div class="row"><p>2</p></div>'
+            '<div class="row"><a href="/3">a</a></div>'
+        ),
+    )
+    item_extractor = ColumnExtractor(
+        dict,
+        parser="html",
+        root_extractor=compile_xpath('//div[@class="row"]'),
+    )
+    item_extractor.add_xpath("p", '//div[@class="row"]/p/text()', many=True)
+    item_extractor.add_xpath("href", '//div[@class="row"]/a/@href', many=True)
+    item_extractor.add_xpath("row", '//div[@class="row"]', many=True)
+    items = list(item_extractor.extract_items(response))
+    assert [(item["p"], item["href"]) for item in items] == [
+        ("1", "/1"),
+        ("2", None),
+        (None, "/3"),
+    ]
+    assert items[2]["row"].get("class") == "row"
+    # plain strings have no nodes
+    item_extractor.add_regex("regex", r"<p>(\d)</p>", many=True)
+    with pytest.raises(ValueError):
+        list(item_extractor.extract_items(response))
+
+    # selectors get columns by default, single values are not columns
+    item_extractor = ColumnExtractor(dict, parser="html")
+    item_extractor.add_xpath("p", '//div[@class="row"]/p/text()')
+    assert list(item_extractor.extract_items(response)) == [{"p": "1"}, {"p": "2"}]
+    item_extractor.add_xpath("first", '//div[@class="row"]/p/text()', many=False)
+    with pytest.raises(ValueError, match="first"):
+        list(item_extractor.extract_items(response))
+
+
 def test_exception_filter():
     class FakeRecord:
         pass
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+import httpx
+
+from ant_nest.limiter import HostLimiter
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_concurrency():
+    limiter = HostLimiter(concurrency=2)
+    running = 0
+    max_running = 0
+
+    async def request(host):
+        nonlocal running, max_running
+        async with limiter.limit(host):
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(request("a.com") for _ in range(10)))
+    assert max_running == 2
+    # hosts are limited separately
+    max_running = 0
+    await asyncio.gather(*(request(host) for host in ("a.com", "b.com", "c.com")))
+    assert max_running == 3
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_rate():
+    limiter = HostLimiter(rate=20)
+    start = time.monotonic()
+    for _ in range(5):
+        async with limiter.limit("a.com"):
+            pass
+    assert time.monotonic() - start >= 0.19
+    # burst
+    limiter = HostLimiter(rate=1, burst=5)
+    start = time.monotonic()
+    for _ in range(5):
+        async with limiter.limit("a.com"):
+            pass
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_feedback():
+    limiter = HostLimiter(max_backoff=0.3)
+    request = httpx.Request("GET", "https://a.com")
+    limiter.feedback("a.com", httpx.Response(429, headers={"Retry-After": "0.2"}))
+    start = time.monotonic()
+    async with limiter.limit("a.com"):
+        assert time.monotonic() - start >= 0.19
+    async with limiter.limit("b.com"):
+        pass
+    # exponential backoff
+    for _ in range(3):
+        limiter.feedback("a.com", httpx.Response(503, request=request))
+    assert limiter._hosts["a.com"].backoff == 0.3
+    limiter.feedback("a.com", httpx.Response(200, request=request))
+    assert limiter._hosts["a.com"].backoff == 0
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_eviction():
+    limiter = HostLimiter(concurrency=1)
+    async with limiter.limit("a.com"):
+        assert "a.com" in limiter._hosts
+    assert not limiter._hosts  # idle
+
+    # paused and rate limited hosts are kept until idle
+    limiter = HostLimiter(rate=100, max_backoff=0.05)
+    request = httpx.Request("GET", "https://a.com")
+    limiter.feedback("a.com", httpx.Response(503, request=request))
+    async with limiter.limit("b.com"):
+        pass
+    assert set(limiter._hosts) == {"a.com", "b.com"}
+    await asyncio.sleep(0.11)  # after the pause and backoff, with a full bucket
+    limiter._sweep_size = 2
+    async with limiter.limit("c.com"):
+        assert set(limiter._hosts) == {"c.com"}  # swept by the new host
+    limiter.feedback("c.com", httpx.Response(200, request=request))
+    assert "c.com" in limiter._hosts  # no token
+    await asyncio.sleep(0.02)
+    limiter.feedback("c.com", httpx.Response(200, request=request))
+    assert not limiter._hosts
@@ -1,5 +1,9 @@
 import os
 import io
+import gzip
+import asyncio
+import sqlite3
+import tempfile
 
 import pytest
 import httpx
@@ -7,6 +11,8 @@ import aiofiles
 
 from ant_nest import pipelines as pls
 from ant_nest.exceptions import Dropped
+from ant_nest.filters import BloomFilter
+from ant_nest.utils import canonicalize_url
 
 
 @pytest.mark.asyncio
@@ -15,6 +21,143 @@ async def test_pipeline():
     pl.process(httpx.Request("GET", "https://test.com"))
 
 
+@pytest.mark.asyncio
+async def test_pipeline_chain():
+    class AppendPipeline(pls.Pipeline):
+        def __init__(self, value):
+            super().__init__()
+            self.value = value
+
+        def process(self, obj):
+            return obj + [self.value]
+
+    class AsyncAppendPipeline(AppendPipeline):
+        async def process(self, obj):
+            return obj + [self.value]
+
+    class AwaitablePipeline(AppendPipeline):
+        awaitable = True
+
+        def process(self, obj):
+            return asyncio.sleep(0, obj + [self.value])
+
+    class DropPipeline(pls.Pipeline):
+        def process(self, obj):
+            raise Dropped("Drop")
+
+    pipelines = [
+        AppendPipeline(0),
+        AppendPipeline(1),
+        AsyncAppendPipeline(2),
+        AwaitablePipeline(3),
+        AppendPipeline(4),
+    ]
+    chain = pls.PipelineChain(pipelines)
+    assert [is_sync for is_sync, _ in chain._runs] == [True, False, False, True]
+    assert await chain([]) == [0, 1, 2, 3, 4]
+    assert not chain.is_stale(pipelines)
+    pipelines[0] = DropPipeline()
+    assert chain.is_stale(pipelines)
+    with pytest.raises(Dropped):
+        await pls.PipelineChain(pipelines)([])
+
+    # sync "process" returning coroutines without "awaitable" are awaited too
+    class CoroutinePipeline(AppendPipeline):
+        def process(self, obj):
+            return AsyncAppendPipeline.process(self, obj)
+
+    for pipelines in (
+        [AppendPipeline(0), CoroutinePipeline(1), AppendPipeline(2)],
+        [AppendPipeline(0), AppendPipeline(1), CoroutinePipeline(2)],
+        [CoroutinePipeline(0), CoroutinePipeline(1), CoroutinePipeline(2)],
+    ):
+        assert await pls.PipelineChain(pipelines)([]) == [0, 1, 2]
+    assert await pls.PipelineChain([CoroutinePipeline(0)])([]) == [0]
+
+    # shared filters are async
+    class AsyncFilter(BloomFilter):
+        async def add(self, fingerprint):
+            return super().add(fingerprint)
+
+    assert not pls.RequestDuplicateFilterPipeline().awaitable
+    pl = pls.RequestDuplicateFilterPipeline(AsyncFilter())
+    assert pl.awaitable
+    chain = pls.PipelineChain([pl])
+    req = httpx.Request("GET", "http://test.com")
+    assert await chain(req) is req
+    with pytest.raises(Dropped):
+        await chain(req)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_chain_batch():
+    batches = []
+
+    class BatchPipeline(pls.Pipeline):
+        async def process_batch(self, objs):
+            if 0 in objs:
+                raise Dropped("Drop batch")
+            batches.append(objs)
+            return [obj * 10 for obj in objs]
+
+    class OddPipeline(pls.Pipeline):
+        def process(self, obj):
+            if obj % 2:
+                raise Dropped("Odd")
+            return obj
+
+    chain = pls.PipelineChain([OddPipeline(), BatchPipeline(), pls.Pipeline()])
+    assert chain.batched
+    results = await chain.process_batch([1, 2, 4])
+    assert isinstance(results[0], Dropped)
+    assert results[1:] == [20, 40]
+    assert batches == [[2, 4]]
+    results = await chain.process_batch([0, 2])
+    assert all(isinstance(result, Dropped) for result in results)
+    # without batch pipelines
+    chain = pls.PipelineChain([OddPipeline()])
+    assert not chain.batched
+    results = await chain.process_batch([1, 2])
+    assert isinstance(results[0], Dropped) and results[1] == 2
+
+
+@pytest.mark.asyncio
+async def test_fan_out_pipeline():
+    class SinkPipeline(pls.Pipeline):
+        def __init__(self, delay, error=None):
+            super().__init__()
+            self.delay = delay
+            self.error = error
+            self.objs = []
+            self.opened = False
+
+        def on_spider_open(self):
+            self.opened = True
+
+        async def process(self, obj):
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            self.objs.append(obj)
+            return obj
+
+    sinks = [SinkPipeline(0.05), SinkPipeline(0.05), SinkPipeline(0, TypeError())]
+    pl = pls.FanOutPipeline(*sinks)
+    await pl.on_spider_open()
+    assert all(sink.opened for sink in sinks)
+    start_time = asyncio.get_event_loop().time()
+    assert await pl.process(1) == 1
+    assert asyncio.get_event_loop().time() - start_time < 0.1  # concurrently
+    assert sinks[0].objs == sinks[1].objs == [1]
+    # dropped by all branches
+    pl = pls.FanOutPipeline(SinkPipeline(0, Dropped()), SinkPipeline(0, Dropped()))
+    with pytest.raises(Dropped):
+        await pl.process(1)
+    pl = pls.FanOutPipeline(SinkPipeline(0, Dropped()), SinkPipeline(0))
+    assert await pl.process(1) == 1
+    await pl.on_spider_close()
+
+
 def test_response_filter_error_pipeline():
     pl = pls.ResponseFilterErrorPipeline()
     res = httpx.Response(
@@ -34,6 +177,83 @@ def test_request_duplicate_filter_pipeline():
     assert pl.process(req) is req
     with pytest.raises(Dropped):
         pl.process(req)
+    # canonical url
+    for url in (
+        "HTTP://Test.com:80/?#fragment",
+        "http://test.com/",
+    ):
+        with pytest.raises(Dropped):
+            pl.process(httpx.Request("GET", url))
+    pl.process(httpx.Request("POST", "http://test.com", content=b"1"))
+    pl.process(httpx.Request("POST", "http://test.com", content=b"2"))
+    # chunks of one file
+    pl.process(httpx.Request("GET", "http://test.com", headers={"Range": "bytes=0-1"}))
+    pl.process(httpx.Request("GET", "http://test.com", headers={"Range": "bytes=2-3"}))
+    pl.on_spider_close()
+
+    pl = pls.RequestDuplicateFilterPipeline(BloomFilter())
+    pl.process(httpx.Request("GET", "https://test.com/?b=2&a=1"))
+    with pytest.raises(Dropped):
+        pl.process(httpx.Request("GET", "https://test.com:443/?a=1&b=2#a"))
+
+
+def test_canonicalize_url():
+    assert canonicalize_url("HTTP://A.com:80") == "http://a.com/"
+    assert canonicalize_url("https://a.com:443/x?b=2&a=1&a=0#f") == (
+        "https://a.com/x?a=0&a=1&b=2"
+    )
+    assert canonicalize_url("https://u:p@a.com:8443/x?") == "https://u:p@a.com:8443/x"
+    assert canonicalize_url("http://[::1]:8080/") == "http://[::1]:8080/"
+
+
+@pytest.mark.asyncio
+async def test_http_cache_pipeline():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pl = pls.HttpCachePipeline(cache_dir=cache_dir)
+        pl.on_spider_open()
+        req = httpx.Request("GET", "https://test.com")
+        assert await pl.process(req) is req
+        res = httpx.Response(
+            200,
+            headers={"etag": "1", "content-encoding": "gzip"},
+            content=gzip.compress(b"hi"),
+            request=req,
+        )
+        await res.aread()
+        assert await pl.process(res) is res
+        # fresh
+        res = await pl.process(httpx.Request("GET", "https://test.com/#a"))
+        assert res.content == b"hi"
+        assert res.extensions["from_cache"]
+        assert await pl.process(res) is res
+        # not cached
+        req = httpx.Request("POST", "https://test.com")
+        assert await pl.process(req) is req
+        res = httpx.Response(
+            200, headers={"cache-control": "no-store"}, content=b"", request=req
+        )
+        await pl.process(res)
+        req = httpx.Request("GET", "https://test.com/stream")
+        await pl.process(httpx.Response(200, content=iter([b""]), request=req))
+        await pl.process(httpx.Response(304, request=req))
+        assert await pl.process(req) is req
+        # revalidate
+        pl.ttl = 0
+        req = httpx.Request("GET", "https://test.com")
+        assert await pl.process(req) is req
+        assert req.headers["If-None-Match"] == "1"
+        res = await pl.process(httpx.Response(304, headers={"etag": "2"}, request=req))
+        assert res.status_code == 200
+        assert res.content == b"hi"
+        assert res.headers["etag"] == "2"
+        # evict
+        pl.on_spider_close()
+        assert len(os.listdir(cache_dir)) == 1
+        pl.max_size = 0
+        pl.on_spider_close()
+        req = httpx.Request("GET", "https://test.com")
+        pl.ttl = 3600
+        assert await pl.process(req) is req
 
 
 def test_item_print_pipeline(item_cls):
@@ -69,6 +289,22 @@ async def test_item_base_file_dump_pipeline():
         await pl.dump("/dev/null", None)
 
 
+@pytest.mark.asyncio
+async def test_item_base_file_dump_pipeline_stream():
+    async def chunks():
+        yield b"1"
+        yield b"2"
+
+    res = httpx.Response(200, content=b"345")
+    with tempfile.TemporaryDirectory() as file_dir:
+        file_path = os.path.join(file_dir, "file")
+        await pls.ItemBaseFileDumpPipeline.dump(file_path, chunks())
+        await pls.ItemBaseFileDumpPipeline.dump(file_path, res, append=True)
+        assert res.is_closed
+        with open(file_path, "rb") as f:
+            assert f.read() == b"12345"
+
+
 @pytest.mark.asyncio
 async def test_item_json_dump_pipeline(item_cls):
     pl = pls.ItemJsonDumpPipeline(to_dict=lambda x: x.__dict__)
@@ -86,6 +322,46 @@ async def test_item_json_dump_pipeline(item_cls):
         os.remove("./Item.json")
 
 
+@pytest.mark.asyncio
+async def test_item_json_lines_dump_pipeline(item_cls):
+    with tempfile.TemporaryDirectory() as file_dir:
+        pl = pls.ItemJsonLinesDumpPipeline(
+            to_dict=lambda x: x.__dict__, file_dir=file_dir, buffer_size=20
+        )
+        pl.on_spider_open()
+        for i in range(3):
+            item = item_cls()
+            item.count = i
+            assert await pl.process(item) is item
+        # flushed by size
+        with open(os.path.join(file_dir, "Item.jsonl")) as f:
+            assert f.read() == '{"count":0}\n{"count":1}\n'
+        await pl.on_spider_close()
+        with open(os.path.join(file_dir, "Item.jsonl")) as f:
+            assert f.read().splitlines()[-1] == '{"count":2}'
+        # flushed by time, compressed and rotated
+        pl = pls.ItemJsonLinesDumpPipeline(
+            to_dict=lambda x: x.__dict__,
+            file_dir=file_dir,
+            flush_interval=0.1,
+            compression="gzip",
+            max_file_size=1,
+        )
+        pl.on_spider_open()
+        item = item_cls()
+        item.info = "hi"
+        await pl.process(item)
+        await asyncio.sleep(0.2)
+        await pl.process(item)
+        await pl.on_spider_close()
+        for index in range(2):
+            with gzip.open(os.path.join(file_dir, f"Item.{index}.jsonl.gz")) as f:
+                assert f.read() == b'{"info":"hi"}\n'
+
+    with pytest.raises(ValueError):
+        pls.ItemJsonLinesDumpPipeline(to_dict=lambda x: x, compression="zip")
+
+
 def test_request_user_agent_pipeline():
     pl = pls.RequestUserAgentPipeline(user_agent="ant")
     req = httpx.Request("GET", "https://www.hi.com")
@@ -109,3 +385,126 @@ def test_request_random_user_agent_pipeline():
     user_agent = pl.create()
     assert "X11" in user_agent
     assert "Firefox" in user_agent
+
+
+@pytest.mark.asyncio
+async def test_item_columnar_dump_pipeline():
+    with tempfile.TemporaryDirectory() as file_dir:
+        pl = pls.ItemColumnarDumpPipeline(
+            to_dict=lambda x: x, file_dir=file_dir, row_group_size=2
+        )
+        for i in range(3):
+            assert await pl.process({"id": i, "name": f"n{i}"}) == {
+                "id": i,
+                "name": f"n{i}",
+            }
+        # flushed by size
+        with open(os.path.join(file_dir, "dict.csv")) as f:
+            assert f.read().splitlines() == ["id,name", "0,n0", "1,n1"]
+        await pl.process({"id": 3, "other": 1})
+        await pl.on_spider_close()
+        with open(os.path.join(file_dir, "dict.csv")) as f:
+            assert f.read().splitlines()[-2:] == ["2,n2", "3,"]
+
+        with pytest.raises(ValueError):
+            pls.ItemColumnarDumpPipeline(to_dict=lambda x: x, format="xlsx")
+
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+        pl = pls.ItemColumnarDumpPipeline(
+            to_dict=lambda x: x, file_dir=file_dir, format="parquet", row_group_size=2
+        )
+        for i in range(3):
+            await pl.process({"id": i, "name": f"n{i}"})
+        await pl.on_spider_close()
+        parquet_file = pq.ParquetFile(os.path.join(file_dir, "dict.parquet"))
+        assert parquet_file.metadata.num_row_groups == 2
+        assert parquet_file.read().to_pydict() == {
+            "id": [0, 1, 2],
+            "name": ["n0", "n1", "n2"],
+        }
+
+        # columns null in the first row group
+        pl = pls.ItemColumnarDumpPipeline(
+            to_dict=lambda x: x,
+            file_dir=file_dir,
+            format="parquet",
+            row_group_size=2,
+            schemas={"dict": {"score": pa.float64()}},
+        )
+        for i in range(4):
+            await pl.process(
+                {"id": i, "note": None if i < 2 else "x", "score": None if i < 2 else i}
+            )
+        await pl.on_spider_close()
+        assert pq.read_table(os.path.join(file_dir, "dict.parquet")).to_pydict() == {
+            "id": [0, 1, 2, 3],
+            "note": [None, None, "x", "x"],
+            "score": [None, None, 2.0, 3.0],
+        }
+
+        # rows are kept when writing fails
+        pl = pls.ItemColumnarDumpPipeline(
+            to_dict=lambda x: x,
+            file_dir=file_dir,
+            format="parquet",
+            row_group_size=2,
+            schemas={"dict": {"id": pa.int64()}},
+        )
+        await pl.process({"id": 0})
+        with pytest.raises(pa.ArrowInvalid):
+            await pl.process({"id": "x"})
+        assert pl.row_counts["dict"] == 2
+        assert pl.columns["dict"]["id"] == [0, "x"]
+        pl.columns["dict"]["id"][1] = 1
+        await pl.on_spider_close()
+        assert pq.read_table(os.path.join(file_dir, "dict.parquet")).to_pydict() == {
+            "id": [0, 1]
+        }
+
+        # csv files of earlier runs are overwritten, not appended
+        pl = pls.ItemColumnarDumpPipeline(to_dict=lambda x: x, file_dir=file_dir)
+        await pl.process({"name": "n0"})
+        await pl.on_spider_close()
+        with open(os.path.join(file_dir, "dict.csv")) as f:
+            assert f.read().splitlines() == ["name", "n0"]
+
+
+@pytest.mark.asyncio
+async def test_item_sqlite_dump_pipeline():
+    with tempfile.TemporaryDirectory() as file_dir:
+        file_path = os.path.join(file_dir, "items.sqlite")
+        pl = pls.ItemSqliteDumpPipeline(
+            to_dict=lambda x: x, file_path=file_path, key="id", batch_size=2
+        )
+        assert await pl.process({"id": 1, "name": "a", "tags": ["x"]}) == {
+            "id": 1,
+            "name": "a",
+            "tags": ["x"],
+        }
+        assert not os.path.exists(file_path)  # buffered
+        await pl.process({"id": 2, "name": "b", "score": 1.5})  # unknown field
+        items = [{"id": 2, "name": "c"}, {"id": 3}]
+        assert await pl.process_batch(items) is items  # upsert
+        await pl.on_spider_close()
+
+        connection = sqlite3.connect(file_path)
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("SELECT * FROM dict ORDER BY id").fetchall() == [
+            (1, "a", '["x"]'),
+            (2, "c", None),
+            (3, None, None),
+        ]
+        connection.close()
+
+        # given schema without key
+        pl = pls.ItemSqliteDumpPipeline(
+            to_dict=lambda x: x,
+            file_path=file_path,
+            schemas={"dict": {"id": "INTEGER", "name": "TEXT", "tags": "TEXT"}},
+        )
+        await pl.process_batch([{"id": 4, "name": "d"}])
+        await pl.on_spider_close()
+        connection = sqlite3.connect(file_path)
+        assert connection.execute("SELECT COUNT(*) FROM dict").fetchone()[0] == 4
+        connection.close()
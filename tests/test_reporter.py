@@ -1,7 +1,13 @@
+import os
+import socket
+import tempfile
+
 import pytest
 import asyncio
+import httpx
+import ujson
 
-from ant_nest.reporter import Reporter
+from ant_nest.reporter import Reporter, Histogram
 
 
 @pytest.mark.asyncio
@@ -16,6 +22,141 @@ async def test_ant_report():
     reporter.report(item, dropped=True)
     assert reporter._records["dict"].dropped_count == 1
     assert reporter._records["dict"].dropped_last_count == 0
+    # retried request
+    reporter.report(item, retried=True)
+    assert reporter._records["dict"].retried_count == 1
+    assert reporter._records["dict"].count == 1
     # waiting log
     await asyncio.sleep(2)
+    assert reporter._records["dict"].last_count == 1
+    assert reporter._records["dict"].dropped_last_count == 1
+    reporter.close()
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 4))
+    assert histogram.quantile(0.5) == 0
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 16
+    assert histogram.quantile(0.4) == 1
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1) == 4  # above all bounds
+    assert histogram.snapshot()["p50"] == 1.5
+
+
+@pytest.mark.asyncio
+async def test_reporter_metrics():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with tempfile.TemporaryDirectory() as path:
+        reporter = Reporter(
+            slot=0.1,
+            name="TestAnt",
+            prometheus_port=port,
+            snapshot_file=os.path.join(path, "{name}.json"),
+        )
+        request = httpx.Request("POST", "http://test.com", content=b"12")
+        response = httpx.Response(200, request=request, content=b"1234")
+        response.read()
+        reporter.report(request)
+        reporter.report_response(response)
+        reporter.observe("send", 0.02)
+
+        metrics = reporter.metrics()
+        assert metrics["bytes_out"] == 2
+        assert metrics["statuses"] == {"test.com": {"200": 1}}
+        assert metrics["histograms"]["send"]["count"] == 1
+
+        text = reporter.prometheus()
+        assert (
+            'ant_nest_objects_total{ant="TestAnt",type="Request",state="ok"} 1' in text
+        )
+        assert (
+            'ant_nest_responses_total{ant="TestAnt",host="test.com",status="200"} 1'
+            in text
+        )
+        assert (
+            'ant_nest_latency_seconds_bucket{ant="TestAnt",stage="send",le="0.025"} 1'
+            in text
+        )
+        assert 'ant_nest_latency_seconds_count{ant="TestAnt",stage="send"} 1' in text
+
+        await asyncio.sleep(0.2)
+        async with httpx.AsyncClient() as client:
+            res = await client.get(f"http://127.0.0.1:{port}/metrics")
+            assert res.status_code == 200
+            assert res.text == reporter.prometheus()
+            res = await client.get(f"http://127.0.0.1:{port}/")
+            assert res.status_code == 404
+        with open(os.path.join(path, "TestAnt.json")) as f:
+            assert ujson.load(f)["records"] == {
+                "Request": {"count": 1, "dropped_count": 0, "retried_count": 0}
+            }
+        reporter.close()
+
+
+@pytest.mark.asyncio
+async def test_reporter_metrics_of_many_ants():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    reporter1 = Reporter(name="Ant1", prometheus_port=port)
+    reporter2 = Reporter(name="Ant2", prometheus_port=port)
+    assert reporter1._metrics_server is reporter2._metrics_server
+    reporter1.report({})
+    reporter2.report({})
+    reporter1.observe("send", 0.02)
+    reporter2.observe("send", 0.02)
+
+    await asyncio.sleep(0.1)
+    async with httpx.AsyncClient() as client:
+        text = (await client.get(f"http://127.0.0.1:{port}/metrics")).text
+    lines = text.splitlines()
+    # every family is declared once, samples of all ants follow it
+    types = [line for line in lines if line.startswith("# TYPE")]
+    assert len(types) == len(set(types)) == 4
+    for family in ("ant_nest_objects_total", "ant_nest_latency_seconds"):
+        start = lines.index(next(t for t in types if f" {family} " in t))
+        end = next(
+            (i for i in range(start + 1, len(lines)) if lines[i].startswith("#")),
+            len(lines),
+        )
+        family_lines = lines[start + 1 : end]
+        assert any('ant="Ant1"' in line for line in family_lines)
+        assert any('ant="Ant2"' in line for line in family_lines)
+    assert 'ant_nest_objects_total{ant="Ant2",type="dict",state="ok"} 1' in lines
+    reporter1.close()
+    reporter2.close()
+
+
+@pytest.mark.asyncio
+async def test_reporter_streaming_bytes():
+    async def body():
+        yield b"12"
+        yield b"34"
+
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, content=body())
+        )
+    )
+    reporter = Reporter()
+    request = client.build_request("GET", "http://test.com")
+    response = await client.send(request, stream=True)
+    reporter.report_response(response)
+    assert reporter.bytes_in == 0  # not read yet
+    assert await response.aread() == b"1234"
+    assert reporter.bytes_in == 4
+    # closed without reading all
+    response = await client.send(request, stream=True)
+    reporter.report_response(response)
+    async for _ in response.aiter_raw():
+        break
+    await response.aclose()
+    assert reporter.bytes_in == 6
+    await client.aclose()
     reporter.close()
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import tempfile
+
+import httpx
+import pytest
+import ujson
+
+from ant_nest.tracer import Tracer, trace_phase
+
+
+@pytest.mark.asyncio
+async def test_tracer():
+    with tempfile.TemporaryDirectory() as path:
+        file_path = os.path.join(path, "trace", "test.json")
+        tracer = Tracer(file_path, buffer_size=3)
+        span1 = tracer.start_span("GET http://test.com/1")
+        span2 = tracer.start_span("GET http://test.com/2")
+        assert (span1.lane, span2.lane) == (0, 1)
+        with trace_phase(span1, "request_pipeline"):
+            pass
+        with trace_phase(None, "request_pipeline"):
+            pass
+        await span1.trace("connection.connect_tcp.started", {})
+        await span1.trace("connection.connect_tcp.complete", {"return_value": None})
+        await span1.trace("http11.receive_response_headers.started", {})
+        await span1.trace(
+            "http11.receive_response_headers.failed", {"exception": OSError("reset")}
+        )
+        await span1.trace("http11.unknown.complete", {})  # not started
+        span1.end(status=200)
+        span1.end(status=500)  # ended only once
+        span3 = tracer.start_span("GET http://test.com/3")
+        assert span3.lane == 0  # free lane is reused
+        span2.end()
+        span3.end()
+        tracer.close()
+        tracer.add_event("download", "phase", 0, 1, 0)  # ignored after closing
+
+        with open(file_path) as f:
+            events = ujson.load(f)
+        assert [(e["name"], e["tid"]) for e in events] == [
+            ("request_pipeline", 0),
+            ("connect", 0),
+            ("first_byte", 0),
+            ("GET http://test.com/1", 0),
+            ("GET http://test.com/2", 1),
+            ("GET http://test.com/3", 0),
+        ]
+        assert events[2]["args"] == {"error": "OSError('reset')"}
+        assert events[3]["args"] == {"status": 200}
+        assert events[3]["cat"] == "request"
+        assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+        assert events[3]["ts"] <= events[0]["ts"]
+
+    tracer = Tracer("test.json", sample_rate=0)
+    assert tracer.start_span("GET http://test.com") is None
+    tracer.close()
+    assert not os.path.exists("test.json")  # no events
+
+
+@pytest.mark.asyncio
+async def test_tracer_with_real_connection(mocker):
+    from ant_nest.ant import CliAnt, settings
+
+    async def handle(reader, writer):
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        await asyncio.sleep(0.01)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    with tempfile.TemporaryDirectory() as path:
+        mocker.patch.object(
+            settings,
+            "TRACE",
+            {"file": os.path.join(path, "{name}-{pid}.json")},
+            create=True,
+        )
+        ant = CliAnt()
+        response = await ant.request(f"http://127.0.0.1:{port}/")
+        assert response.text == "ok"
+        file_path = ant.tracer.file_path
+        assert file_path == os.path.join(path, f"CliAnt-{os.getpid()}.json")
+        await ant.close()
+
+        with open(file_path) as f:
+            events = {e["name"]: e for e in ujson.load(f)}
+    server.close()
+    for name in (
+        "request_pipeline",
+        "queue_wait",
+        "connect",
+        "send_headers",
+        "first_byte",
+        "download",
+        "send",
+        "response_pipeline",
+    ):
+        assert events[name]["cat"] == "phase"
+    span = events[f"GET http://127.0.0.1:{port}/"]
+    assert span["args"]["status"] == 200
+    assert events["first_byte"]["dur"] >= 10000
+    assert span["dur"] >= events["send"]["dur"]
+
+
+@pytest.mark.asyncio
+async def test_tracer_cancelled(mocker):
+    from ant_nest.ant import CliAnt, settings
+
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    with tempfile.TemporaryDirectory() as path:
+        mocker.patch.object(
+            settings, "TRACE", {"file": os.path.join(path, "test.json")}, create=True
+        )
+        ant = CliAnt()
+        ant.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        task = asyncio.ensure_future(ant.request("http://test.com"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        span = ant.tracer.start_span("next")
+        assert span.lane == 0  # freed by the cancelled span
+        span.end()
+        await ant.close()
+
+        with open(os.path.join(path, "test.json")) as f:
+            events = {e["name"]: e for e in ujson.load(f)}
+    assert events["GET http://test.com"]["args"]["error"] == "CancelledError()"
@@ -0,0 +1,102 @@
+import os
+import threading
+
+import pytest
+import httpx
+
+from ant_nest import utils
+
+
+def test_parse_retry_after():
+    assert utils.parse_retry_after(None) is None
+    assert utils.parse_retry_after("2") == 2
+    assert utils.parse_retry_after("-1") == 0
+    assert utils.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert utils.parse_retry_after("soon") is None
+
+
+def test_retry_budget():
+    budget = utils.RetryBudget(ratio=0.5, min_retries=1)
+    budget.on_request()
+    assert budget.can_retry()
+    budget.on_retry()
+    assert budget.can_retry()
+    budget.on_retry()
+    assert not budget.can_retry()
+    budget.on_request()
+    budget.on_request()
+    assert budget.can_retry()
+    # new window
+    budget.window = 0
+    assert budget.can_retry()
+    assert budget.retries == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_policy():
+    responses = []
+    retries = []
+
+    async def send(status_code, headers=None):
+        if status_code == 0:
+            raise httpx.ConnectError("Connect error")
+        elif status_code < 0:
+            raise ValueError("Not retried")
+        responses.append(httpx.Response(status_code, headers=headers))
+        return responses[-1]
+
+    policy = utils.RetryPolicy(retries=2, delay=0.01, max_delay=0.1)
+    retry = policy(send, on_retry=lambda *args: retries.append(args))
+    # on status
+    res = await retry(503)
+    assert res.status_code == 503
+    assert len(responses) == 3
+    assert [attempt for attempt, _ in retries] == [1, 2]
+    assert all(0 <= delay <= 0.02 for _, delay in retries)
+    assert await retry(404) is responses[-1]
+    # on exception
+    with pytest.raises(httpx.ConnectError):
+        await retry(0)
+    assert len(retries) == 4
+    with pytest.raises(ValueError):
+        await retry(-1)
+    assert len(retries) == 4
+    # with retry-after
+    await retry(429, headers={"Retry-After": "0.05"})
+    assert retries[-1][1] == 0.05
+    responses.clear()
+    assert (await retry(429, headers={"Retry-After": "1"})).status_code == 429
+    assert len(responses) == 1
+    # with budget
+    policy.budget = utils.RetryBudget(ratio=0, min_retries=1)
+    responses.clear()
+    await retry(500)
+    assert len(responses) == 2
+    responses.clear()
+    await retry(500)
+    assert len(responses) == 1
+
+
+def get_pid(obj):
+    return os.getpid(), obj
+
+
+@pytest.mark.asyncio
+async def test_offload_executor():
+    executor = utils.OffloadExecutor("thread", max_workers=1)
+    assert executor.queue_size == 2
+    assert await executor.run(threading.get_ident) != threading.get_ident()
+    executor.shutdown()
+
+    executor = utils.OffloadExecutor("process", max_workers=1)
+    res = httpx.Response(
+        200, request=httpx.Request("GET", "https://test.com"), content=b"hi"
+    )
+    pid, snapshot = await executor.run(get_pid, res)
+    assert pid != os.getpid()
+    assert snapshot.content == b"hi"
+    assert snapshot.request.url == "https://test.com"
+    executor.shutdown()
+
+    with pytest.raises(ValueError):
+        utils.OffloadExecutor("gpu")